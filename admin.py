@@ -1,17 +1,19 @@
 import logging
 from telebot.async_telebot import AsyncTeleBot
-from telebot.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton, InputFile
+from telebot.types import Message, CallbackQuery, InputFile
 
-from database import db
+from database import db, exporter, search
 from states import user_states
 from states.user_states import AdminState
-from utils import helpers
+from utils import helpers, outbound
+from utils.callback_codec import Action
+from utils.router import Router
 import config
 
 logger = logging.getLogger(__name__)
 
-def register_admin_handlers(bot: AsyncTeleBot): 
-    @bot.callback_query_handler(func=lambda call: call.data == "admin_panel")
+def register_admin_handlers(bot: AsyncTeleBot, router: Router):
+    @router.action(Action.ADMIN_PANEL)
     async def admin_panel_callback(call: CallbackQuery):
         user_id = call.from_user.id
         
@@ -22,14 +24,15 @@ def register_admin_handlers(bot: AsyncTeleBot):
         markup = helpers.get_admin_panel_markup()
         
         await bot.answer_callback_query(call.id)
-        await bot.send_message(
+        await outbound.send(
+            bot.send_message,
             user_id,
             "*🐵 Панель администратора:*",
             reply_markup=markup,
             parse_mode="Markdown"
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data == "create_room")
+    @router.action(Action.CREATE_ROOM)
     async def create_room_callback(call: CallbackQuery):
         user_id = call.from_user.id
         
@@ -41,56 +44,50 @@ def register_admin_handlers(bot: AsyncTeleBot):
         user_states.clear_temp_room_data(user_id)
         
         await bot.answer_callback_query(call.id)
-        await bot.send_message(
+        await outbound.send(
+            bot.send_message,
             user_id,
             "🐒 *Введите название комнаты:*",
             parse_mode="Markdown"
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data == "list_rooms")
-    async def list_rooms_callback(call: CallbackQuery):
+    @router.action(Action.LIST_ROOMS)
+    async def list_rooms_callback(call: CallbackQuery, after_id: int = 0, before_id: int = 0):
         user_id = call.from_user.id
         
         if not helpers.is_admin(user_id):
             await bot.answer_callback_query(call.id, "🙈 У вас нет доступа к этой функции.")
             return
         
-        rooms = await db.get_all_rooms()
+        page = await helpers.get_all_rooms_page(after_id, before_id)
         
-        if not rooms:
+        if not page['rooms']:
             await bot.answer_callback_query(call.id)
-            await bot.send_message(
+            await outbound.send(
+                bot.send_message,
                 user_id,
                 "🙉 Комнаты еще не созданы.",
                 parse_mode="Markdown"
             )
             return
         
-        markup = InlineKeyboardMarkup(row_width=1)
-        for room in rooms:
-            markup.add(InlineKeyboardButton(
-                f"{room['name']} (ID: {room['room_id']})", 
-                callback_data=f"room_info_{room['room_id']}"
-            ))
-        markup.add(InlineKeyboardButton("Назад", callback_data="admin_panel"))
-        
         await bot.answer_callback_query(call.id)
-        await bot.send_message(
+        await outbound.send(
+            bot.send_message,
             user_id,
             "*📜 Список всех комнат:*",
-            reply_markup=markup,
+            reply_markup=page['markup'],
             parse_mode="Markdown"
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("room_info_"))
-    async def room_info_callback(call: CallbackQuery):
+    @router.action(Action.ROOM_INFO)
+    async def room_info_callback(call: CallbackQuery, room_id: int):
         user_id = call.from_user.id
         
         if not helpers.is_admin(user_id):
             await bot.answer_callback_query(call.id, "🙈 У вас нет доступа к этой функции.")
             return
         
-        room_id = int(call.data.split("_")[2])
         room = await db.get_room_by_id(room_id)
         
         if not room:
@@ -103,17 +100,11 @@ def register_admin_handlers(bot: AsyncTeleBot):
             for member in members
         ])
         
-        markup = InlineKeyboardMarkup(row_width=1)
-        markup.add(
-            InlineKeyboardButton("▶️ Войти в комнату", callback_data=f"admin_enter_room_{room_id}"),
-            InlineKeyboardButton("📤 Экспорт истории", callback_data=f"export_history_{room_id}"),
-            InlineKeyboardButton("🗑️ Удалить комнату", callback_data=f"delete_room_{room_id}"),
-            InlineKeyboardButton("◀️ Назад к списку", callback_data="list_rooms"),
-            InlineKeyboardButton("🏠 Главное меню", callback_data="main_menu")
-        )
+        markup = helpers.get_room_info_markup(room_id)
         
         await bot.answer_callback_query(call.id)
-        await bot.send_message(
+        await outbound.send(
+            bot.send_message,
             user_id,
             f"*ℹ️ Информация о комнате:*  \n"
             f"• *ID:* `{room['room_id']}`  \n"
@@ -124,53 +115,124 @@ def register_admin_handlers(bot: AsyncTeleBot):
             parse_mode="Markdown"
         )
 
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("delete_room_"))
-    async def delete_room_callback(call: CallbackQuery):
+    @router.action(Action.DELETE_ROOM)
+    async def delete_room_callback(call: CallbackQuery, room_id: int):
         user_id = call.from_user.id
 
         if not helpers.is_admin(user_id):
             await bot.answer_callback_query(call.id, "🙈 У вас нет доступа к этой функции.")
             return
 
-        room_id = int(call.data.split("_")[2])
         room = await db.get_room_by_id(room_id)
 
         if not room:
             await bot.answer_callback_query(call.id, "🙊 Комната не найдена.")
             return
 
-        await db.delete_room(room_id)
+        user_ids = await db.delete_room(room_id)
+        user_states.clear_deleted_room(room_id, user_ids)
 
         await bot.answer_callback_query(call.id, f"✅ Комната *{room['name']}* (ID: `{room_id}`) удалена.", parse_mode="Markdown")
         markup = helpers.get_admin_panel_markup()
-        await bot.send_message(
+        await outbound.send(
+            bot.send_message,
             user_id,
             "*🐵 Панель администратора:*",
             reply_markup=markup,
             parse_mode="Markdown"
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("export_history_"))
-    async def export_history_callback(call: CallbackQuery):
+    @router.action(Action.EXPORT_HISTORY)
+    async def export_history_callback(call: CallbackQuery, room_id: int):
         user_id = call.from_user.id
         if not helpers.is_admin(user_id):
             await bot.answer_callback_query(call.id, "🙈 У вас нет доступа.")
             return
 
-        room_id = int(call.data.split("_")[2])
-        buf = await db.export_room_history(room_id)
+        room = await db.get_room_by_id(room_id)
+
+        if not room:
+            await bot.answer_callback_query(call.id, "🙊 Комната не найдена.")
+            return
+
         await bot.answer_callback_query(call.id, "📤 Экспорт истории...")
-        await bot.send_document(user_id, InputFile(buf))
+
+        fmt = config.settings.export_format
+        compress = config.settings.export_compress
+        buf = await db.export_room_history(room_id, fmt, compress)
+        try:
+            await outbound.send(
+                bot.send_document,
+                user_id,
+                InputFile(buf, file_name=exporter.export_filename(room_id, fmt, compress))
+            )
+        finally:
+            buf.close()
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("admin_enter_room_"))
-    async def admin_enter_room_callback(call: CallbackQuery):
+    @router.action(Action.SEARCH_ROOM)
+    async def search_room_callback(call: CallbackQuery, room_id: int):
+        user_id = call.from_user.id
+
+        if not helpers.is_admin(user_id):
+            await bot.answer_callback_query(call.id, "🙈 У вас нет доступа к этой функции.")
+            return
+
+        user_states.set_temp_room_data(user_id, 'search_room_id', room_id)
+        user_states.set_user_state(user_id, AdminState.WAITING_FOR_SEARCH_QUERY)
+
+        await bot.answer_callback_query(call.id)
+        await outbound.send(
+            bot.send_message,
+            user_id,
+            "🔎 *Введите слова для поиска по истории комнаты:*",
+            parse_mode="Markdown"
+        )
+
+    @router.action(Action.SEARCH_PAGE)
+    async def search_page_callback(call: CallbackQuery, room_id: int, snapshot: int, offset: int):
+        user_id = call.from_user.id
+
+        if not helpers.is_admin(user_id):
+            await bot.answer_callback_query(call.id, "🙈 У вас нет доступа к этой функции.")
+            return
+
+        temp_data = user_states.get_temp_room_data(user_id)
+        if temp_data.get('search_room_id') != room_id or not temp_data.get('search_query'):
+            await bot.answer_callback_query(call.id, "🙊 Поиск устарел, начните новый.")
+            return
+
+        await bot.answer_callback_query(call.id)
+        await send_search_results(user_id, room_id, temp_data['search_query'], (snapshot, offset))
+
+    async def send_search_results(user_id: int, room_id: int, query: str, cursor=None):
+        page = await db.search_room(room_id, query, cursor=cursor)
+        markup = helpers.get_search_results_markup(room_id, page['cursor'])
+
+        if not page['messages']:
+            await outbound.send(bot.send_message, user_id, f"🙉 По запросу «{query}» ничего не найдено.", reply_markup=markup)
+            return
+
+        first = (cursor[1] if cursor else 0) + 1
+        results = "\n\n".join(
+            f"#{message['message_id']} · {message['username'] or message['user_id']} · {message['sent_at']}\n"
+            f"{helpers.truncate(message['text'] or '', 300)}"
+            for message in page['messages']
+        )
+        await outbound.send(
+            bot.send_message,
+            user_id,
+            f"🔎 Результаты {first}–{first + len(page['messages']) - 1} по запросу «{query}»:\n\n{results}",
+            reply_markup=markup
+        )
+
+    @router.action(Action.ADMIN_ENTER_ROOM)
+    async def admin_enter_room_callback(call: CallbackQuery, room_id: int):
         user_id = call.from_user.id
         
         if not helpers.is_admin(user_id):
             await bot.answer_callback_query(call.id, "🙈 У вас нет доступа к этой функции.")
             return
         
-        room_id = int(call.data.split("_")[3])
         room = await db.get_room_by_id(room_id)
         
         if not room:
@@ -187,7 +249,8 @@ def register_admin_handlers(bot: AsyncTeleBot):
         markup = helpers.get_room_exit_markup()
         
         await bot.answer_callback_query(call.id)
-        await bot.send_message(
+        await outbound.send(
+            bot.send_message,
             user_id,
             f"*🐵 Вы вошли в комнату:* _{room['name']}_ (как администратор)  \n"
             "Все сообщения будут отправлены другим участникам комнаты.  \n"
@@ -196,43 +259,62 @@ def register_admin_handlers(bot: AsyncTeleBot):
             parse_mode="Markdown"
         )
     
-    @bot.message_handler(func=lambda message: user_states.get_user_state(message.from_user.id) == AdminState.WAITING_FOR_ROOM_NAME)
+    @router.state(AdminState.WAITING_FOR_ROOM_NAME)
     async def process_room_name(message: Message):
         user_id = message.from_user.id
         room_name = message.text.strip()
         
         if not room_name:
-            await bot.send_message(user_id, "🙉 Название комнаты не может быть пустым. Попробуйте ещё раз:", parse_mode="Markdown")
+            await outbound.send(bot.send_message, user_id, "🙉 Название комнаты не может быть пустым. Попробуйте ещё раз:", parse_mode="Markdown")
             return
         
         user_states.set_temp_room_data(user_id, 'name', room_name)
         user_states.set_user_state(user_id, AdminState.WAITING_FOR_CLIENT_ID)
         
-        await bot.send_message(user_id, "🐵 *Введите ID клиента:*", parse_mode="Markdown")
+        await outbound.send(bot.send_message, user_id, "🐵 *Введите ID клиента:*", parse_mode="Markdown")
     
-    @bot.message_handler(func=lambda message: user_states.get_user_state(message.from_user.id) == AdminState.WAITING_FOR_CLIENT_ID)
+    @router.state(AdminState.WAITING_FOR_SEARCH_QUERY)
+    async def process_search_query(message: Message):
+        user_id = message.from_user.id
+        query = message.text.strip()
+        room_id = user_states.get_temp_room_data(user_id).get('search_room_id')
+
+        if room_id is None:
+            user_states.set_user_state(user_id, AdminState.IDLE)
+            return
+
+        if not search.build_match(room_id, query):
+            await outbound.send(bot.send_message, user_id, "🙉 Запрос должен содержать хотя бы одно слово. Попробуйте ещё раз:")
+            return
+
+        user_states.set_temp_room_data(user_id, 'search_query', query)
+        user_states.set_user_state(user_id, AdminState.IDLE)
+
+        await send_search_results(user_id, room_id, query)
+
+    @router.state(AdminState.WAITING_FOR_CLIENT_ID)
     async def process_client_id(message: Message):
         user_id = message.from_user.id
         
         try:
             client_id = int(message.text.strip())
         except ValueError:
-            await bot.send_message(user_id, "🙈 ID должен быть числом. Попробуйте ещё раз:", parse_mode="Markdown")
+            await outbound.send(bot.send_message, user_id, "🙈 ID должен быть числом. Попробуйте ещё раз:", parse_mode="Markdown")
             return
         
         user_states.set_temp_room_data(user_id, 'client_id', client_id)
         user_states.set_user_state(user_id, AdminState.WAITING_FOR_CODER_ID)
         
-        await bot.send_message(user_id, "🐵 *Введите ID программиста:*", parse_mode="Markdown")
+        await outbound.send(bot.send_message, user_id, "🐵 *Введите ID программиста:*", parse_mode="Markdown")
     
-    @bot.message_handler(func=lambda message: user_states.get_user_state(message.from_user.id) == AdminState.WAITING_FOR_CODER_ID)
+    @router.state(AdminState.WAITING_FOR_CODER_ID)
     async def process_coder_id(message: Message):
         user_id = message.from_user.id
         
         try:
             coder_id = int(message.text.strip())
         except ValueError:
-            await bot.send_message(user_id, "🙈 ID должен быть числом. Попробуйте ещё раз:", parse_mode="Markdown")
+            await outbound.send(bot.send_message, user_id, "🙈 ID должен быть числом. Попробуйте ещё раз:", parse_mode="Markdown")
             return
         
         temp_data = user_states.get_temp_room_data(user_id)
@@ -241,13 +323,8 @@ def register_admin_handlers(bot: AsyncTeleBot):
         room_name = temp_data['name']
         client_id = temp_data['client_id']
         
-        conn = db.get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (client_id,))
-        client_exists = cursor.fetchone() is not None
-        cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (coder_id,))
-        coder_exists = cursor.fetchone() is not None
-        conn.close()
+        client_exists = await db.user_exists(client_id)
+        coder_exists = await db.user_exists(coder_id)
         
         if not client_exists:
             await db.add_user(client_id, f"client_{client_id}", "client")
@@ -261,7 +338,8 @@ def register_admin_handlers(bot: AsyncTeleBot):
         user_states.clear_temp_room_data(user_id)
         user_states.set_user_state(user_id, AdminState.IDLE)
         
-        await bot.send_message(
+        await outbound.send(
+            bot.send_message,
             user_id,
             f"✅ *Комната '{room_name}' успешно создана!* 🐵\n"
             f"• *ID комнаты:* `{room_id}`\n"
@@ -271,7 +349,8 @@ def register_admin_handlers(bot: AsyncTeleBot):
         )
         
         try:
-            await bot.send_message(
+            await outbound.send(
+                bot.send_message,
                 client_id,
                 f"🐵 Вы были добавлены в комнату '*{room_name}*'. Используйте /start для входа.",
                 parse_mode="Markdown"
@@ -280,7 +359,8 @@ def register_admin_handlers(bot: AsyncTeleBot):
             logger.error(f"Не удалось отправить уведомление клиенту: {e}")
         
         try:
-            await bot.send_message(
+            await outbound.send(
+                bot.send_message,
                 coder_id,
                 f"🐵 Вы были добавлены в комнату '*{room_name}*'. Используйте /start для входа.",
                 parse_mode="Markdown"
@@ -0,0 +1,580 @@
+import argparse
+import asyncio
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+from contextlib import ExitStack
+from typing import Any, Callable, Dict, List
+from unittest import mock
+
+from database import exporter, migrations
+
+WORDS = "привет как дела сборка упала тест прошёл релиз завтра ревью посмотри логи ошибка".split()
+
+def _populate(conn: sqlite3.Connection, messages: int, seed: int) -> None:
+    rng = random.Random(seed)
+    conn.executemany("INSERT INTO users (user_id, username, role) VALUES (?, ?, ?)",
+                     [(user_id, f"user{user_id}", 'client') for user_id in range(1, 11)])
+    conn.execute("INSERT INTO rooms (room_id, name) VALUES (1, 'bench')")
+    conn.executemany("INSERT INTO room_members (room_id, user_id, role) VALUES (1, ?, ?)",
+                     [(user_id, 'coder' if user_id % 2 else 'client') for user_id in range(1, 11)])
+    conn.executemany(
+        "INSERT INTO messages (room_id, user_id, text, sent_at) "
+        "VALUES (1, ?, ?, datetime('2024-01-01', ? || ' seconds'))",
+        (
+            (rng.randint(1, 10), " ".join(rng.choices(WORDS, k=rng.randint(3, 30))), number)
+            for number in range(messages)
+        )
+    )
+    conn.commit()
+
+def bench_exporter(messages: int, chunk_size: int, repeat: int, seed: int) -> List[Dict[str, Any]]:
+    with tempfile.TemporaryDirectory() as directory:
+        conn = sqlite3.connect(os.path.join(directory, "bench.db"))
+        conn.row_factory = sqlite3.Row
+        migrations.migrate(conn)
+        _populate(conn, messages, seed)
+
+        results = []
+        for fmt in exporter.FORMATS:
+            for compress in (False, True):
+                best = float('inf')
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    with exporter.write_room_history(conn, 1, fmt, compress, chunk_size=chunk_size) as spool:
+                        size = spool.seek(0, os.SEEK_END)
+                    best = min(best, time.perf_counter() - started)
+                results.append({
+                    'format': fmt + (".gz" if compress else ""),
+                    'rows_per_second': messages / best,
+                    'megabytes_per_second': size / best / 2 ** 20,
+                    'size_bytes': size,
+                    'seconds': best
+                })
+        conn.close()
+    return results
+
+def _message(user_id: int, text: str):
+    from telebot.types import Message
+
+    return Message.de_json({
+        'message_id': 1, 'date': 0, 'text': text,
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': {'id': user_id, 'is_bot': False, 'first_name': "bench"}
+    })
+
+def _callback(user_id: int, data: str):
+    from telebot.types import CallbackQuery
+
+    return CallbackQuery.de_json({
+        'id': "1", 'chat_instance': "1", 'data': data,
+        'from': {'id': user_id, 'is_bot': False, 'first_name': "bench"}
+    })
+
+async def _telebot_resolve(bot, handlers: List[Dict], update):
+    # the same walk AsyncTeleBot does for every update: test each handler's filters in registration order
+    for handler in handlers:
+        if await bot._test_message_handler(handler, update):
+            return handler['function']
+    return None
+
+def _time_per_call(resolve: Callable, updates: List) -> float:
+    started = time.perf_counter()
+    for update in updates:
+        if resolve(update) is None:
+            raise RuntimeError("benchmark update matched no route")
+    return (time.perf_counter() - started) / len(updates)
+
+async def _time_per_async_call(resolve: Callable, updates: List) -> float:
+    started = time.perf_counter()
+    for update in updates:
+        if await resolve(update) is None:
+            raise RuntimeError("benchmark update matched no route")
+    return (time.perf_counter() - started) / len(updates)
+
+def bench_router(routes: int, lookups: int, seed: int) -> List[Dict[str, Any]]:
+    from telebot.async_telebot import AsyncTeleBot
+
+    from utils import callback_codec
+    from utils.router import Router
+
+    if not 0 < routes < 256:
+        raise ValueError("callback actions are one byte, use between 1 and 255 routes")
+
+    async def handler(*args):
+        pass
+
+    def get_state(user_id: int) -> str:
+        return f"state_{user_id % routes}"
+
+    router = Router(get_state, lambda user_id: False)
+    bot = AsyncTeleBot("1:bench")
+    for index in range(routes):
+        router.command(f"cmd_{index}")(handler)
+        router.state(f"state_{index}")(handler)
+        router.action(index + 1)(handler)
+        bot.register_message_handler(handler, commands=[f"cmd_{index}"])
+
+    # telebot takes the first matching handler, so commands go first like the router checks them first
+    for index in range(routes):
+        bot.register_message_handler(
+            handler, content_types=['text'],
+            func=lambda message, state=f"state_{index}": get_state(message.from_user.id) == state
+        )
+        bot.register_callback_query_handler(
+            handler, func=lambda call, prefix=f"action_{index}_": call.data.startswith(prefix)
+        )
+
+    rng = random.Random(seed)
+    targets = [rng.randrange(routes) for _ in range(lookups)]
+    commands = [_message(1, f"/cmd_{index}") for index in targets]
+    texts = [_message(index, "hello") for index in targets]
+    packed = [callback_codec.encode(index + 1, 42) for index in targets]
+    legacy = [_callback(1, f"action_{index}_42") for index in targets]
+
+    async def run_telebot() -> Dict[str, float]:
+        return {
+            'command': await _time_per_async_call(lambda m: _telebot_resolve(bot, bot.message_handlers, m), commands),
+            'state': await _time_per_async_call(lambda m: _telebot_resolve(bot, bot.message_handlers, m), texts),
+            'callback': await _time_per_async_call(
+                lambda c: _telebot_resolve(bot, bot.callback_query_handlers, c), legacy
+            )
+        }
+
+    telebot_seconds = asyncio.run(run_telebot())
+    router_seconds = {
+        'command': _time_per_call(router.resolve_message, commands),
+        'state': _time_per_call(router.resolve_message, texts),
+        'callback': _time_per_call(lambda data: router.resolve_callback(data)[0], packed)
+    }
+
+    return [
+        {
+            'route': route,
+            'router_us': router_seconds[route] * 1e6,
+            'telebot_us': telebot_seconds[route] * 1e6,
+            'speedup': telebot_seconds[route] / router_seconds[route]
+        }
+        for route in ('command', 'state', 'callback')
+    ]
+
+RELAY_SAMPLES = {
+    'text': {'text': "Привет, это **важное** сообщение со ссылкой",
+             'entities': [{'type': 'bold', 'offset': 12, 'length': 8}, {'type': 'url', 'offset': 30, 'length': 6}]},
+    'photo': {'photo': [{'file_id': "AgACAgIAAxkBAAIB", 'file_unique_id': "AQADAgAT", 'width': 90, 'height': 90},
+                        {'file_id': "AgACAgIAAxkBAAIB", 'file_unique_id': "AQADAgAT", 'width': 1280, 'height': 960}],
+              'caption': "Скриншот ошибки", 'caption_entities': [{'type': 'italic', 'offset': 0, 'length': 8}]},
+    'document': {'document': {'file_id': "BQACAgIAAxkBAAIC", 'file_unique_id': "AgADBQAT", 'file_name': "report.pdf"},
+                 'caption': "Отчёт"},
+    'voice': {'voice': {'file_id': "AwACAgIAAxkBAAID", 'file_unique_id': "AgADAwAT", 'duration': 3}},
+    'sticker': {'sticker': {'file_id': "CAACAgIAAxkBAAIE", 'file_unique_id': "AgADCAAT", 'type': 'regular',
+                            'width': 512, 'height': 512, 'is_animated': False, 'is_video': False}},
+    'venue': {'venue': {'location': {'latitude': 55.75, 'longitude': 37.61}, 'title': "Офис", 'address': "Москва"}}
+}
+
+def bench_relay(number: int, members: int, repeat: int) -> List[Dict[str, Any]]:
+    from telebot import asyncio_helper
+    from telebot.async_telebot import AsyncTeleBot
+    from telebot.types import Message
+
+    import config
+    from handlers import messaging
+    from loadtest import UNTHROTTLED, FakeTelegramServer
+    from utils import outbound
+
+    sender_title = "👤 Клиент"
+    recipients = [{'user_id': user_id} for user_id in range(2, members + 2)]
+
+    def best_of(measure: Callable[[], float]) -> float:
+        return min(measure() for _ in range(repeat))
+
+    def time_build(build: Callable, message) -> float:
+        started = time.perf_counter()
+        for _ in range(number):
+            build(message, sender_title)
+        return (time.perf_counter() - started) / number
+
+    async def time_relay(bot: AsyncTeleBot, message, call) -> float:
+        started = time.perf_counter()
+        for _ in range(number):
+            await messaging.deliver_to_members(bot, message, *call, recipients, message.content_type)
+        return (time.perf_counter() - started) / number
+
+    async def run() -> List[Dict[str, Any]]:
+        server = FakeTelegramServer()
+        asyncio_helper.API_URL = await server.start('127.0.0.1', 0)
+        outbound.apply_settings(config.settings.replace(**UNTHROTTLED))
+        bot = AsyncTeleBot("1:bench")
+
+        results = []
+        for name, content in RELAY_SAMPLES.items():
+            message = Message.de_json({
+                'message_id': 1, 'date': 0, 'chat': {'id': 1, 'type': 'private'},
+                'from': {'id': 1, 'is_bot': False, 'first_name': "bench"}, **content
+            })
+            calls = {
+                'rebuild': messaging.build_relay_call(message, sender_title),
+                'copy': messaging.build_copy_call(message, sender_title)
+            }
+            result = {'content': name}
+            for mode, build in (('rebuild', messaging.build_relay_call), ('copy', messaging.build_copy_call)):
+                if calls[mode] is None:
+                    continue
+                relay = []
+                for _ in range(repeat):
+                    relay.append(await time_relay(bot, message, calls[mode]))
+                result[mode] = {
+                    'method': calls[mode][0],
+                    'build_us': best_of(lambda: time_build(build, message)) * 1e6,
+                    'relay_us': min(relay) * 1e6
+                }
+            results.append(result)
+
+        await bot.close_session()
+        await server.stop()
+        return results
+
+    return asyncio.run(run())
+
+def _build_room_info_markup(room_id: int):
+    from telebot.types import InlineKeyboardButton, InlineKeyboardMarkup
+
+    from utils import helpers
+    from utils.callback_codec import encode
+
+    # what get_room_info_markup built on every call before it rendered a template
+    markup = InlineKeyboardMarkup(row_width=1)
+    markup.add(*(
+        InlineKeyboardButton(text, callback_data=encode(callback, room_id) if isinstance(callback, int) else callback)
+        for row in helpers.ROOM_INFO_TEMPLATE.rows for text, callback in row
+    ))
+    return markup
+
+def bench_handlers(number: int, repeat: int) -> List[Dict[str, Any]]:
+    import config
+    from loadtest import UNTHROTTLED
+
+    admin_id = 1
+    with tempfile.TemporaryDirectory(prefix="bench-") as directory:
+        os.environ.update(
+            BOT_TOKEN="1:bench", ADMIN_IDS=str(admin_id), STATE_BACKEND="memory", METRICS_PORT="0",
+            DB_PATH=os.path.join(directory, "bench.db"), LOG_FILE=os.path.join(directory, "bench.log"),
+            **{name.upper(): str(value) for name, value in UNTHROTTLED.items()}
+        )
+        config.reload()
+        return asyncio.run(_bench_handlers(admin_id, number, repeat))
+
+async def _bench_handlers(admin_id: int, number: int, repeat: int) -> List[Dict[str, Any]]:
+    from telebot import asyncio_helper
+    from telebot.types import Update
+
+    import main
+    from database import db
+    from loadtest import FakeTelegramServer, message_update
+    from utils import helpers
+    from utils.callback_codec import Action, encode
+
+    server = FakeTelegramServer()
+    asyncio_helper.API_URL = await server.start('127.0.0.1', 0)
+    db.init_db()
+    room_id = await db.create_room("bench room")
+    for user_id in range(2, 12):
+        await db.add_user(user_id, f"user_{user_id}", 'client')
+        await db.add_member_to_room(room_id, user_id, 'client')
+    bot = main.create_bot()
+
+    def callback(data: str) -> Dict[str, Any]:
+        update = message_update(admin_id, 1, {'text': "menu"})
+        return {'callback_query': {
+            'id': "1", 'chat_instance': "1", 'data': data, 'from': update['message']['from'],
+            'message': update['message']
+        }}
+
+    cases = {
+        '/start': message_update(admin_id, 1, {'text': "/start"}),
+        'main menu': callback(encode(Action.MAIN_MENU)),
+        'admin panel': callback(encode(Action.ADMIN_PANEL)),
+        'room info': callback(encode(Action.ROOM_INFO, room_id))
+    }
+    cached_markups = [
+        helpers._main_menu_markup, helpers.get_admin_panel_markup, helpers.get_room_exit_markup,
+        helpers.get_back_to_main_menu_markup, helpers.get_room_left_markup
+    ]
+
+    async def measure(payload: Dict[str, Any], cached: bool) -> float:
+        updates = [Update.de_json(dict(payload, update_id=index)) for index in range(number)]
+        with ExitStack() as stack:
+            if not cached:
+                stack.enter_context(mock.patch.object(helpers, 'get_room_info_markup', _build_room_info_markup))
+            started = time.perf_counter()
+            for update in updates:
+                if not cached:
+                    for markup in cached_markups:
+                        markup.cache_clear()
+                await bot.process_new_updates([update])
+            return (time.perf_counter() - started) / number
+
+    results = []
+    for name, payload in cases.items():
+        await measure(payload, True)
+        uncached = min([await measure(payload, False) for _ in range(repeat)])
+        cached = min([await measure(payload, True) for _ in range(repeat)])
+        results.append({'handler': name, 'uncached_us': uncached * 1e6, 'cached_us': cached * 1e6})
+
+    await bot.close_session()
+    await server.stop()
+    await db.flush_messages()
+    db.close_db()
+    return results
+
+def bench_metrics(number: int, repeat: int) -> List[Dict[str, Any]]:
+    import config
+    from loadtest import UNTHROTTLED
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as directory:
+        os.environ.update(
+            BOT_TOKEN="1:bench", STATE_BACKEND="memory", METRICS_PORT="0", METRICS_ENABLED="true",
+            # a group commit would make every room message wait out the flush interval
+            MESSAGE_DURABILITY="async",
+            DB_PATH=os.path.join(directory, "bench.db"), LOG_FILE=os.path.join(directory, "bench.log"),
+            **{name.upper(): str(value) for name, value in UNTHROTTLED.items()}
+        )
+        config.reload()
+        return asyncio.run(_bench_metrics(number, repeat))
+
+async def _bench_metrics(number: int, repeat: int) -> List[Dict[str, Any]]:
+    from telebot import asyncio_helper
+    from telebot.types import Update
+
+    import main
+    from database import db
+    from loadtest import FakeTelegramServer, message_update
+    from states import user_states
+    from utils import metrics
+    from utils.callback_codec import Action, encode
+
+    server = FakeTelegramServer()
+    asyncio_helper.API_URL = await server.start('127.0.0.1', 0)
+    db.init_db()
+    room_id = await db.create_room("bench room")
+    for user_id in (2, 3, 4):
+        await db.add_user(user_id, f"user_{user_id}", 'client')
+        await db.add_member_to_room(room_id, user_id, 'client')
+    user_states.set_active_room(2, room_id)
+    bot = main.create_bot()
+
+    menu = message_update(5, 1, {'text': "menu"})
+    cases = {
+        'room text': message_update(2, 1, {'text': "hello room"}),
+        'main menu': {'callback_query': {
+            'id': "1", 'chat_instance': "1", 'data': encode(Action.MAIN_MENU),
+            'from': menu['message']['from'], 'message': menu['message']
+        }}
+    }
+
+    def observations() -> int:
+        return sum(
+            sum(metric.counts().values()) for metric in metrics.registry._metrics.values()
+            if isinstance(metric, metrics.Histogram)
+        )
+
+    # one instrumented call: a perf_counter pair and an observation on a bound series
+    series = metrics.Registry().histogram('bench_seconds', "").series()
+    started = time.perf_counter()
+    for _ in range(100000):
+        observed = time.perf_counter()
+        series.observe(time.perf_counter() - observed)
+    observation_cost = (time.perf_counter() - started) / 100000
+
+    async def measure(payload: Dict[str, Any], enabled: bool) -> float:
+        metrics.registry.enabled = enabled
+        updates = [Update.de_json(dict(payload, update_id=index)) for index in range(number)]
+        started = time.perf_counter()
+        for update in updates:
+            await bot.process_new_updates([update])
+        return (time.perf_counter() - started) / number
+
+    results = []
+    for name, payload in cases.items():
+        before = observations()
+        await measure(payload, True)
+        per_update = (observations() - before) / number
+        timings = {True: [], False: []}
+        # interleaved so drift on the machine hits both modes alike
+        for _ in range(repeat):
+            for enabled in (False, True):
+                timings[enabled].append(await measure(payload, enabled))
+        on, off = statistics.median(timings[True]), statistics.median(timings[False])
+        results.append({
+            'handler': name,
+            'enabled_us': on * 1e6,
+            'disabled_us': off * 1e6,
+            'overhead': on / off - 1,
+            'observations': per_update,
+            # stable against the run-to-run noise of the end-to-end medians
+            'instrumentation_us': per_update * observation_cost * 1e6,
+            'instrumentation_share': per_update * observation_cost / off
+        })
+
+    metrics.registry.enabled = True
+    await bot.close_session()
+    await server.stop()
+    await db.flush_messages()
+    db.close_db()
+    return results
+
+def bench_writer(rates: List[int], seconds: float, flush_interval_ms: int, flush_rows: int) -> List[Dict[str, Any]]:
+    import config
+
+    with tempfile.TemporaryDirectory(prefix="bench-") as directory:
+        os.environ.update(
+            BOT_TOKEN="1:bench", STATE_BACKEND="memory", METRICS_PORT="0",
+            DB_PATH=os.path.join(directory, "bench.db"), LOG_FILE=os.path.join(directory, "bench.log")
+        )
+        config.reload()
+        return asyncio.run(_bench_writer(rates, seconds, flush_interval_ms, flush_rows))
+
+async def _bench_writer(rates: List[int], seconds: float, flush_interval_ms: int,
+                        flush_rows: int) -> List[Dict[str, Any]]:
+    from database import db
+    from database.writer import DURABILITY_GROUP, DURABILITY_SYNC, WriteBehindBuffer
+
+    db.init_db()
+    room_id = await db.create_room("bench room")
+    await db.add_user(1, "bench", 'client')
+
+    results = []
+    for rate in rates:
+        for durability in (DURABILITY_SYNC, DURABILITY_GROUP):
+            commits = []
+
+            async def write_rows(rows: List[tuple]):
+                started = time.perf_counter()
+                await db._insert_messages(rows)
+                commits.append(time.perf_counter() - started)
+
+            buffer = WriteBehindBuffer(write_rows, flush_interval_ms, flush_rows, durability)
+            waits = []
+
+            async def save(number: int):
+                started = time.perf_counter()
+                await buffer.add((room_id, 1, f"bench message {number}"))
+                waits.append(time.perf_counter() - started)
+
+            total = int(rate * seconds)
+            tasks = []
+            started = time.perf_counter()
+            for number in range(total):
+                delay = started + number / rate - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                tasks.append(asyncio.create_task(save(number)))
+            await asyncio.gather(*tasks)
+            await buffer.close()
+            elapsed = time.perf_counter() - started
+
+            waits.sort()
+            commits.sort()
+            results.append({
+                'rate': rate,
+                'durability': durability,
+                'rows': total,
+                'rows_per_second': total / elapsed,
+                'commits': len(commits),
+                'commit_p50_ms': commits[len(commits) // 2] * 1000,
+                'commit_p99_ms': commits[min(len(commits) - 1, int(len(commits) * 0.99))] * 1000,
+                'save_p50_ms': waits[len(waits) // 2] * 1000,
+                'save_p99_ms': waits[min(len(waits) - 1, int(len(waits) * 0.99))] * 1000
+            })
+
+    db.close_db()
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Micro-benchmarks that run without a bot or a Telegram API")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = commands.add_parser("exporter", help="room history export throughput per format")
+    export_parser.add_argument("--messages", type=int, default=100000)
+    export_parser.add_argument("--chunk-size", type=int, default=1000)
+    export_parser.add_argument("--repeat", type=int, default=3)
+    export_parser.add_argument("--seed", type=int, default=1)
+
+    router_parser = commands.add_parser("router", help="keyed route tables against telebot's linear filter chain")
+    router_parser.add_argument("--routes", type=int, default=250)
+    router_parser.add_argument("--lookups", type=int, default=20000)
+    router_parser.add_argument("--seed", type=int, default=1)
+
+    relay_parser = commands.add_parser("relay", help="copy_message against rebuilt sends, per content type")
+    relay_parser.add_argument("--number", type=int, default=500)
+    relay_parser.add_argument("--members", type=int, default=3)
+    relay_parser.add_argument("--repeat", type=int, default=3)
+
+    handlers_parser = commands.add_parser("handlers", help="handler latency with and without the markup caches")
+    handlers_parser.add_argument("--number", type=int, default=500)
+    handlers_parser.add_argument("--repeat", type=int, default=3)
+
+    metrics_parser = commands.add_parser("metrics", help="handler latency with metrics on and off, median of runs")
+    metrics_parser.add_argument("--number", type=int, default=300)
+    metrics_parser.add_argument("--repeat", type=int, default=15)
+
+    writer_parser = commands.add_parser("writer", help="per-row against batched message commits on a file db")
+    writer_parser.add_argument("--rate", type=int, action="append", help="rows per second, may be repeated")
+    writer_parser.add_argument("--seconds", type=float, default=3)
+    writer_parser.add_argument("--flush-interval-ms", type=int, default=50)
+    writer_parser.add_argument("--flush-rows", type=int, default=500)
+
+    args = parser.parse_args()
+
+    if args.command == "exporter":
+        for result in bench_exporter(args.messages, args.chunk_size, args.repeat, args.seed):
+            print(
+                f"{result['format']:9} {result['rows_per_second']:10.0f} rows/s  "
+                f"{result['megabytes_per_second']:7.1f} MB/s  {result['size_bytes'] / 2 ** 20:7.1f} MB  "
+                f"{result['seconds'] * 1000:8.1f} ms"
+            )
+    elif args.command == "router":
+        print(f"{args.routes} routes per table, {args.lookups} lookups")
+        for result in bench_router(args.routes, args.lookups, args.seed):
+            print(
+                f"{result['route']:9} router {result['router_us']:8.2f} us  "
+                f"telebot {result['telebot_us']:8.2f} us  {result['speedup']:6.1f}x"
+            )
+    elif args.command == "relay":
+        print(f"per message relayed to {args.members} members through a local fake Bot API")
+        for result in bench_relay(args.number, args.members, args.repeat):
+            columns = [
+                f"{mode} {result[mode]['method']:15} build {result[mode]['build_us']:6.1f} us  "
+                f"relay {result[mode]['relay_us']:7.1f} us"
+                for mode in ('rebuild', 'copy') if mode in result
+            ]
+            print(f"{result['content']:9} " + "   ".join(columns))
+    elif args.command == "handlers":
+        print("per update, through the bot and a local fake Bot API")
+        for result in bench_handlers(args.number, args.repeat):
+            print(
+                f"{result['handler']:12} uncached {result['uncached_us']:7.1f} us  "
+                f"cached {result['cached_us']:7.1f} us  "
+                f"saved {result['uncached_us'] - result['cached_us']:6.1f} us"
+            )
+    elif args.command == "writer":
+        print(f"message_durability sync against group, {args.seconds:g}s per run on a file db")
+        for result in bench_writer(args.rate or [1000, 10000], args.seconds, args.flush_interval_ms, args.flush_rows):
+            print(
+                f"{result['rate']:6} rows/s {result['durability']:5}  achieved {result['rows_per_second']:7.0f} rows/s  "
+                f"commits {result['commits']:6}  commit p50 {result['commit_p50_ms']:6.2f} ms  "
+                f"p99 {result['commit_p99_ms']:6.2f} ms  save p50 {result['save_p50_ms']:7.2f} ms  "
+                f"p99 {result['save_p99_ms']:7.2f} ms"
+            )
+    elif args.command == "metrics":
+        print(f"per update, median of {args.repeat} interleaved runs through a local fake Bot API")
+        for result in bench_metrics(args.number, args.repeat):
+            print(
+                f"{result['handler']:10} metrics on {result['enabled_us']:7.1f} us  "
+                f"off {result['disabled_us']:7.1f} us  measured {result['overhead'] * 100:+5.2f}%  "
+                f"{result['observations']:4.1f} observations {result['instrumentation_us']:5.2f} us  "
+                f"instrumentation {result['instrumentation_share'] * 100:5.2f}%"
+            )
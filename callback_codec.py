@@ -0,0 +1,103 @@
+import base64
+import binascii
+from typing import Tuple
+
+VERSION = 1
+PREFIX = "~"
+MAX_LENGTH = 64
+
+class Action:
+    VIEW_ROOMS = 1
+    MAIN_MENU = 2
+    ENTER_ROOM = 3
+    EXIT_ROOM = 4
+    ADMIN_PANEL = 5
+    CREATE_ROOM = 6
+    LIST_ROOMS = 7
+    ROOM_INFO = 8
+    ADMIN_ENTER_ROOM = 9
+    EXPORT_HISTORY = 10
+    DELETE_ROOM = 11
+    SEARCH_ROOM = 12
+    SEARCH_PAGE = 13
+    ROOM_HISTORY = 14
+
+LEGACY_ACTIONS = {
+    'view_rooms': Action.VIEW_ROOMS,
+    'main_menu': Action.MAIN_MENU,
+    'exit_room': Action.EXIT_ROOM,
+    'admin_panel': Action.ADMIN_PANEL,
+    'create_room': Action.CREATE_ROOM,
+    'list_rooms': Action.LIST_ROOMS
+}
+
+LEGACY_PREFIXES = {
+    'enter_room_': Action.ENTER_ROOM,
+    'admin_enter_room_': Action.ADMIN_ENTER_ROOM,
+    'room_info_': Action.ROOM_INFO,
+    'export_history_': Action.EXPORT_HISTORY,
+    'delete_room_': Action.DELETE_ROOM
+}
+
+class CallbackDataError(ValueError):
+    pass
+
+def encode(action: int, *args: int) -> str:
+    if not 0 < action < 256:
+        raise CallbackDataError(f"Action id {action} does not fit in one byte")
+
+    packed = bytearray((VERSION, action))
+    for value in args:
+        value = value * 2 if value >= 0 else -value * 2 - 1
+        while value > 0x7f:
+            packed.append(value & 0x7f | 0x80)
+            value >>= 7
+        packed.append(value)
+
+    data = PREFIX + base64.urlsafe_b64encode(bytes(packed)).rstrip(b"=").decode('ascii')
+    if len(data) > MAX_LENGTH:
+        raise CallbackDataError(f"Callback data for action {action} is {len(data)} bytes, limit is {MAX_LENGTH}")
+    return data
+
+def _decode_packed(payload: str) -> Tuple[int, Tuple[int, ...]]:
+    try:
+        packed = base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4))
+    except (binascii.Error, ValueError) as e:
+        raise CallbackDataError(f"Malformed callback payload: {e}") from None
+
+    if len(packed) < 2:
+        raise CallbackDataError("Callback payload is truncated")
+    if packed[0] != VERSION:
+        raise CallbackDataError(f"Unsupported callback version {packed[0]}")
+
+    args = []
+    value = shift = 0
+    for byte in packed[2:]:
+        value |= (byte & 0x7f) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        args.append(value >> 1 if not value & 1 else -(value >> 1) - 1)
+        value = shift = 0
+    if shift:
+        raise CallbackDataError("Callback payload ends inside an integer")
+
+    return packed[1], tuple(args)
+
+def _decode_legacy(data: str) -> Tuple[int, Tuple[int, ...]]:
+    action = LEGACY_ACTIONS.get(data)
+    if action is not None:
+        return action, ()
+
+    for prefix, action in LEGACY_PREFIXES.items():
+        if data.startswith(prefix):
+            try:
+                return action, (int(data[len(prefix):]),)
+            except ValueError:
+                break
+    raise CallbackDataError(f"Unknown callback data {data!r}")
+
+def decode(data: str) -> Tuple[int, Tuple[int, ...]]:
+    if data.startswith(PREFIX):
+        return _decode_packed(data[len(PREFIX):])
+    return _decode_legacy(data)
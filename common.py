@@ -1,15 +1,17 @@
 import logging
 from telebot.async_telebot import AsyncTeleBot
-from telebot.types import Message, CallbackQuery, InlineKeyboardMarkup, InlineKeyboardButton
+from telebot.types import Message, CallbackQuery
 
 from database import db
 from states import user_states
-from utils import helpers
+from utils import helpers, outbound
+from utils.callback_codec import Action
+from utils.router import Router
 
 logger = logging.getLogger(__name__)
 
-def register_common_handlers(bot: AsyncTeleBot):
-    @bot.message_handler(commands=['start'])
+def register_common_handlers(bot: AsyncTeleBot, router: Router):
+    @router.command('start')
     async def start_command(message: Message):
         user_id = message.from_user.id
         username = message.from_user.username or f"user_{user_id}"
@@ -19,26 +21,29 @@ def register_common_handlers(bot: AsyncTeleBot):
         if helpers.is_admin(user_id):
             markup = helpers.get_main_menu_markup(user_id)
             
-            await bot.send_message(
+            await outbound.send(
+                bot.send_message,
                 user_id,
                 "*🐵 Добро пожаловать в бот!*  \nВы вошли как администратор.",
                 reply_markup=markup,
                 parse_mode="Markdown"
             )
         else:
-            rooms = await db.get_user_rooms(user_id)
+            page = await helpers.get_user_rooms_page(user_id)
+            rooms = page['rooms']
             
             if not rooms:
                 markup = helpers.get_main_menu_markup(user_id)
                 
-                await bot.send_message(
+                await outbound.send(
+                    bot.send_message,
                     user_id,
                     "*🙈 Доброго времени суток!*  \n"
                     "У вас пока нет доступных комнат. Ожидайте, когда администратор добавит вас в комнату.",
                     reply_markup=markup,
                     parse_mode="Markdown"
                 )
-            elif len(rooms) == 1:
+            elif len(rooms) == 1 and not page['has_more']:
                 room = rooms[0]
                 room_id = room['room_id']
                 
@@ -46,7 +51,8 @@ def register_common_handlers(bot: AsyncTeleBot):
                 
                 markup = helpers.get_room_exit_markup()
                 
-                await bot.send_message(
+                await outbound.send(
+                    bot.send_message,
                     user_id,
                     f"*🐵 Доброго времени суток!*  \n\n"
                     f"Вы автоматически вошли в комнату: {room['name']}  \n"
@@ -56,70 +62,58 @@ def register_common_handlers(bot: AsyncTeleBot):
                     parse_mode="Markdown"
                 )
             else:
-                markup = InlineKeyboardMarkup(row_width=1)
-                for room in rooms:
-                    markup.add(InlineKeyboardButton(
-                        room['name'], 
-                        callback_data=f"enter_room_{room['room_id']}"
-                    ))
-                    
-                await bot.send_message(
+                await outbound.send(
+                    bot.send_message,
                     user_id,
                     "*🙈 Добро пожаловать в бот Monkey Studio!*  \n\n"
                     "У вас есть несколько доступных комнат. Выберите комнату для входа:",
-                    reply_markup=markup,
+                    reply_markup=page['markup'],
                     parse_mode="Markdown"
                 )
     
-    @bot.callback_query_handler(func=lambda call: call.data == "view_rooms")
-    async def view_rooms_callback(call: CallbackQuery):
+    @router.action(Action.VIEW_ROOMS)
+    async def view_rooms_callback(call: CallbackQuery, after_id: int = 0, before_id: int = 0):
         user_id = call.from_user.id
-        rooms = await db.get_user_rooms(user_id)
+        page = await helpers.get_user_rooms_page(user_id, after_id, before_id)
         
-        if not rooms:
+        if not page['rooms']:
             await bot.answer_callback_query(call.id)
             
             markup = helpers.get_back_to_main_menu_markup()
             
-            await bot.send_message(
+            await outbound.send(
+                bot.send_message,
                 user_id, 
                 "У вас пока нет доступных комнат.",
                 reply_markup=markup
             )
             return
         
-        markup = InlineKeyboardMarkup(row_width=1)
-        for room in rooms:
-            markup.add(InlineKeyboardButton(
-                room['name'], 
-                callback_data=f"enter_room_{room['room_id']}"
-            ))
-        markup.add(InlineKeyboardButton("Главное меню", callback_data="main_menu"))
-        
         await bot.answer_callback_query(call.id)
-        await bot.send_message(
+        await outbound.send(
+            bot.send_message,
             user_id,
             "Ваши доступные комнаты:",
-            reply_markup=markup
+            reply_markup=page['markup']
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data == "main_menu")
+    @router.action(Action.MAIN_MENU)
     async def main_menu_callback(call: CallbackQuery):
         user_id = call.from_user.id
         
         markup = helpers.get_main_menu_markup(user_id)
         
         await bot.answer_callback_query(call.id)
-        await bot.send_message(
+        await outbound.send(
+            bot.send_message,
             user_id,
             "Главное меню:",
             reply_markup=markup
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data.startswith("enter_room_"))
-    async def enter_room_callback(call: CallbackQuery):
+    @router.action(Action.ENTER_ROOM)
+    async def enter_room_callback(call: CallbackQuery, room_id: int):
         user_id = call.from_user.id
-        room_id = int(call.data.split("_")[2])
         
         if not await db.is_user_in_room(user_id, room_id):
             await bot.answer_callback_query(call.id, "У вас нет доступа к этой комнате.")
@@ -135,7 +129,8 @@ def register_common_handlers(bot: AsyncTeleBot):
         markup = helpers.get_room_exit_markup()
         
         await bot.answer_callback_query(call.id)
-        await bot.send_message(
+        await outbound.send(
+            bot.send_message,
             user_id,
             f"Вы вошли в комнату: {room['name']}\n"
             f"Все сообщения будут отправлены другим участникам комнаты.\n"
@@ -143,7 +138,24 @@ def register_common_handlers(bot: AsyncTeleBot):
             reply_markup=markup
         )
     
-    @bot.callback_query_handler(func=lambda call: call.data == "exit_room")
+    @router.action(Action.ROOM_HISTORY)
+    async def room_history_callback(call: CallbackQuery, before_id: int = 0):
+        user_id = call.from_user.id
+
+        if not user_states.is_user_in_active_room(user_id):
+            await bot.answer_callback_query(call.id, "Вы не находитесь ни в одной комнате.")
+            return
+
+        page = await helpers.get_history_page(user_states.get_active_room(user_id), before_id)
+
+        await bot.answer_callback_query(call.id)
+        if not page['messages']:
+            await outbound.send(bot.send_message, user_id, "В этой комнате пока нет сообщений.")
+            return
+
+        await outbound.send(bot.send_message, user_id, page['text'], reply_markup=page['markup'])
+    
+    @router.action(Action.EXIT_ROOM)
     async def exit_room_callback(call: CallbackQuery):
         user_id = call.from_user.id
         
@@ -153,14 +165,11 @@ def register_common_handlers(bot: AsyncTeleBot):
         
         user_states.clear_active_room(user_id)
         
-        markup = InlineKeyboardMarkup(row_width=1)
-        markup.add(
-            InlineKeyboardButton("Мои комнаты", callback_data="view_rooms"),
-            InlineKeyboardButton("Главное меню", callback_data="main_menu")
-        )
+        markup = helpers.get_room_left_markup()
         
         await bot.answer_callback_query(call.id)
-        await bot.send_message(
+        await outbound.send(
+            bot.send_message,
             user_id,
             "Вы вышли из комнаты.",
             reply_markup=markup
@@ -1,2 +1,179 @@
-BOT_TOKEN = ""
-ADMIN_IDS = []
+import dataclasses
+import json
+import logging
+import os
+import signal
+from dataclasses import dataclass
+from typing import Callable, Dict, FrozenSet, List, Optional
+
+logger = logging.getLogger(__name__)
+
+CONFIG_PATH_ENV = "ROOM_BOT_CONFIG"
+
+@dataclass(frozen=True)
+class Settings:
+    bot_token: str = ""
+    admin_ids: FrozenSet[int] = frozenset()
+
+    # polling or webhook
+    update_mode: str = "polling"
+    polling_timeout: int = 60
+    webhook_url: str = ""
+    webhook_host: str = "0.0.0.0"
+    webhook_port: int = 8443
+    webhook_path: str = "/telegram/webhook"
+    # empty generates a random secret per run, which requires webhook_url so it can be registered
+    webhook_secret: str = ""
+    # max_connections registered with Telegram, updates of different users are processed concurrently
+    webhook_workers: int = 8
+    webhook_queue_size: int = 1000
+
+    db_path: str = "room_bot.db"
+    db_workers: int = 4
+    # 0 sizes the pool to db_workers + 2
+    db_pool_size: int = 0
+    db_busy_timeout_ms: int = 5000
+    db_statement_cache_size: int = 256
+
+    membership_cache_size: int = 1024
+    membership_cache_ttl: float = 300
+
+    rooms_page_size: int = 10
+    room_pages_cache_size: int = 1024
+    room_pages_cache_ttl: float = 300
+
+    fanout_concurrency: int = 16
+    fanout_timeout: float = 15
+
+    outbound_global_rate: float = 30
+    outbound_chat_rate: float = 1
+    outbound_chat_burst: int = 3
+    outbound_max_retries: int = 3
+    outbound_max_queue: int = 10000
+
+    outbox_batch_size: int = 50
+    outbox_poll_interval: float = 2
+    outbox_max_attempts: int = 8
+    outbox_backoff_base: float = 2
+    outbox_backoff_max: float = 600
+
+    # sync: commit every message, group: await a shared batch commit, async: fire and forget
+    message_durability: str = "group"
+    message_flush_interval_ms: int = 50
+    message_flush_rows: int = 500
+
+    history_page_size: int = 10
+    history_pages_cache_size: int = 1024
+    history_pages_cache_ttl: float = 600
+
+    search_page_size: int = 5
+    # newest matches ranked per query, bounds search cost on large rooms
+    search_candidates: int = 1000
+    search_backfill_batch: int = 2000
+    search_backfill_interval: float = 0.2
+
+    # copy: relay with copy_message and a sender header, rebuild: resend every content type by hand
+    relay_mode: str = "copy"
+    # albums arrive as one update per item, buffered until no item came for this long
+    media_group_window_ms: int = 500
+
+    state_backend: str = "sqlite"
+    state_cache_size: int = 10000
+    state_cache_ttl: float = 3600
+
+    # csv, jsonl or html
+    export_format: str = "csv"
+    export_compress: bool = False
+    export_chunk_size: int = 1000
+    export_spool_max_size: int = 8 * 1024 * 1024
+
+    # >1 starts a supervisor that shards updates across worker processes by room
+    worker_processes: int = 1
+
+    log_level: str = "INFO"
+    log_file: str = "bot.log"
+    # text or json
+    log_format: str = "text"
+    log_max_bytes: int = 10 * 1024 * 1024
+    log_backup_count: int = 5
+    log_queue_size: int = 10000
+    # records per second allowed from one logging call site, 0 disables the limit
+    log_rate_limit: float = 10
+    log_rate_burst: int = 50
+
+    metrics_enabled: bool = True
+    metrics_host: str = "127.0.0.1"
+    # 0 disables the /metrics endpoint, workers listen on metrics_port + worker index
+    metrics_port: int = 0
+
+    def __post_init__(self):
+        if not self.db_pool_size:
+            object.__setattr__(self, 'db_pool_size', self.db_workers + 2)
+
+    def replace(self, **changes) -> "Settings":
+        return dataclasses.replace(self, **changes)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None, environ: Optional[Dict[str, str]] = None) -> "Settings":
+        environ = os.environ if environ is None else environ
+        path = path or environ.get(CONFIG_PATH_ENV)
+
+        values = {}
+        if path:
+            with open(path, encoding='utf-8') as f:
+                values.update(json.load(f))
+
+        for field in dataclasses.fields(cls):
+            raw = environ.get(field.name.upper())
+            if raw is not None:
+                values[field.name] = raw
+
+        unknown = set(values) - {field.name for field in dataclasses.fields(cls)}
+        if unknown:
+            raise ValueError(f"Unknown settings: {', '.join(sorted(unknown))}")
+
+        return cls(**{
+            field.name: _coerce(field, values[field.name])
+            for field in dataclasses.fields(cls) if field.name in values
+        })
+
+def _coerce(field: dataclasses.Field, value):
+    if field.type == FrozenSet[int]:
+        if isinstance(value, str):
+            value = value.replace(",", " ").split()
+        return frozenset(int(item) for item in value)
+    if field.type is bool and isinstance(value, str):
+        if value.lower() not in ('1', '0', 'true', 'false', 'yes', 'no', 'on', 'off'):
+            raise ValueError(f"Setting {field.name} expects a boolean, got {value!r}")
+        return value.lower() in ('1', 'true', 'yes', 'on')
+    return field.type(value)
+
+settings = Settings.load()
+_reload_listeners: List[Callable[[Settings], None]] = []
+
+def add_reload_listener(listener: Callable[[Settings], None]):
+    _reload_listeners.append(listener)
+
+def reload() -> Settings:
+    global settings
+    try:
+        new_settings = Settings.load()
+    except (OSError, ValueError, TypeError) as e:
+        logger.error(f"Failed to reload settings, keeping the current ones: {e}")
+        return settings
+
+    settings = new_settings
+    for listener in _reload_listeners:
+        try:
+            listener(new_settings)
+        except Exception as e:
+            logger.error(f"Settings reload listener failed: {e}", exc_info=True)
+
+    logger.info(f"Settings reloaded ({len(new_settings.admin_ids)} admins)")
+    return new_settings
+
+def install_reload_handler(loop) -> bool:
+    if not hasattr(signal, 'SIGHUP'):
+        return False
+    loop.add_signal_handler(signal.SIGHUP, reload)
+    return True
@@ -1,225 +1,486 @@
-import sqlite3
+import asyncio
+import functools
 import logging
-from typing import Dict, List, Optional
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO, Dict, List, Optional, Tuple
+
+import config
+from database import exporter, migrations, search
+from database.pool import ConnectionPool
+from database.writer import WriteBehindBuffer
+from utils import metrics
+from utils.cache import LRUCache
 
 logger = logging.getLogger(__name__)
 
+_executor = ThreadPoolExecutor(max_workers=config.settings.db_workers, thread_name_prefix="db")
+
+_call_seconds = metrics.registry.histogram(
+    'db_call_seconds', 'Database call latency including executor wait', ('function',)
+)
+_call_errors = metrics.registry.counter('db_errors_total', 'Database calls that raised', ('function',))
+metrics.track_queue('db_executor', lambda: _executor._work_queue.qsize())
+
+def run_in_db_thread(func):
+    name = func.__name__
+    seconds = _call_seconds.series(name)
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        call = functools.partial(func, *args, **kwargs)
+        if not metrics.registry.enabled:
+            return await asyncio.get_running_loop().run_in_executor(_executor, call)
+
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(_executor, call)
+        except Exception:
+            _call_errors.inc(name)
+            raise
+        finally:
+            seconds.observe(time.perf_counter() - started)
+    return wrapper
+
+_pool: Optional[ConnectionPool] = None
+
+_membership_cache = LRUCache(config.settings.membership_cache_size, config.settings.membership_cache_ttl)
+metrics.track_cache('membership', _membership_cache.stats)
+_change_listeners = []
+_invalidation_hooks = []
+_message_hooks = []
+
+def add_change_listener(listener):
+    _change_listeners.append(listener)
+
+def add_invalidation_hook(hook):
+    _invalidation_hooks.append(hook)
+
+def add_message_hook(hook):
+    _message_hooks.append(hook)
+
+def invalidate_room(room_id: int):
+    _membership_cache.invalidate(room_id)
+    for hook in _invalidation_hooks:
+        hook(room_id)
+
+def _room_changed(room_id: int):
+    invalidate_room(room_id)
+    for listener in _change_listeners:
+        try:
+            listener(room_id)
+        except Exception as e:
+            logger.error(f"Room change listener failed: {e}", exc_info=True)
+
 def init_db():
-    conn = sqlite3.connect('room_bot.db')
-    cursor = conn.cursor()
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS users (
-        user_id INTEGER PRIMARY KEY,
-        username TEXT,
-        role TEXT,
-        registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS rooms (
-        room_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        name TEXT NOT NULL,
-        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-    )
-    ''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS room_members (
-        id INTEGER PRIMARY KEY AUTOINCREMENT,
-        room_id INTEGER,
-        user_id INTEGER,
-        role TEXT,
-        FOREIGN KEY (room_id) REFERENCES rooms (room_id),
-        FOREIGN KEY (user_id) REFERENCES users (user_id),
-        UNIQUE(room_id, user_id)
-    )
-    ''')
-    
-    cursor.execute('''
-    CREATE TABLE IF NOT EXISTS messages (
-        message_id INTEGER PRIMARY KEY AUTOINCREMENT,
-        room_id INTEGER,
-        user_id INTEGER,
-        text TEXT,
-        sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-        FOREIGN KEY (room_id) REFERENCES rooms (room_id),
-        FOREIGN KEY (user_id) REFERENCES users (user_id)
-    )
-    ''')
-    
-    conn.commit()
-    conn.close()
-    logger.info("Database initialized successfully")
+    global _pool
+    if _pool is None:
+        _pool = ConnectionPool(
+            config.settings.db_path,
+            size=config.settings.db_pool_size,
+            busy_timeout=config.settings.db_busy_timeout_ms,
+            cached_statements=config.settings.db_statement_cache_size
+        )
+
+    with get_db_connection() as conn:
+        version = migrations.migrate(conn)
+        # planner statistics are refreshed by sqlite when they are missing or stale, never frozen by a one-off ANALYZE
+        conn.execute("PRAGMA optimize=0x10002")
+    logger.info(f"Database initialized successfully (schema version {version})")
 
 def get_db_connection():
-    conn = sqlite3.connect('room_bot.db')
-    conn.row_factory = sqlite3.Row
-    return conn
+    if _pool is None:
+        raise RuntimeError("Database is not initialized, call init_db() first")
+    return _pool.connection()
 
-async def add_user(user_id: int, username: str, role: str = None):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "INSERT OR IGNORE INTO users (user_id, username, role) VALUES (?, ?, ?)",
-        (user_id, username, role)
-    )
-    
-    conn.commit()
-    conn.close()
+def close_db():
+    global _pool
+    _executor.shutdown(wait=True)
+    if _pool is not None:
+        with get_db_connection() as conn:
+            conn.execute("PRAGMA optimize")
+        _pool.close()
+        _pool = None
+    logger.info("Database connections closed")
 
-async def create_room(name: str) -> int:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("INSERT INTO rooms (name) VALUES (?)", (name,))
-    room_id = cursor.lastrowid
-    
-    conn.commit()
-    conn.close()
-    
+@run_in_db_thread
+def add_user(user_id: int, username: str, role: str = None):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "INSERT OR IGNORE INTO users (user_id, username, role) VALUES (?, ?, ?)",
+            (user_id, username, role)
+        )
+        
+        conn.commit()
+
+@run_in_db_thread
+def create_room(name: str) -> int:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute("INSERT INTO rooms (name) VALUES (?)", (name,))
+        room_id = cursor.lastrowid
+        
+        conn.commit()
+    
+    _room_changed(room_id)
     return room_id
 
-async def add_member_to_room(room_id: int, user_id: int, role: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "INSERT OR IGNORE INTO room_members (room_id, user_id, role) VALUES (?, ?, ?)",
-        (room_id, user_id, role)
-    )
-    
-    conn.commit()
-    conn.close()
+@run_in_db_thread
+def add_member_to_room(room_id: int, user_id: int, role: str):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(
+            "INSERT OR IGNORE INTO room_members (room_id, user_id, role) VALUES (?, ?, ?)",
+            (room_id, user_id, role)
+        )
+        
+        conn.commit()
+    
+    _room_changed(room_id)
 
-async def get_user_rooms(user_id: int) -> List[Dict]:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT r.room_id, r.name 
-        FROM rooms r 
-        JOIN room_members rm ON r.room_id = rm.room_id 
-        WHERE rm.user_id = ?
-    """, (user_id,))
-    
-    rooms = [dict(row) for row in cursor.fetchall()]
+USER_ROOMS_AFTER_SQL = """
+    SELECT r.room_id, r.name
+    FROM room_members rm
+    JOIN rooms r ON r.room_id = rm.room_id
+    WHERE rm.user_id = ? AND rm.room_id > ?
+    ORDER BY rm.room_id
+    LIMIT ?
+"""
+
+USER_ROOMS_BEFORE_SQL = """
+    SELECT r.room_id, r.name
+    FROM room_members rm
+    JOIN rooms r ON r.room_id = rm.room_id
+    WHERE rm.user_id = ? AND rm.room_id < ?
+    ORDER BY rm.room_id DESC
+    LIMIT ?
+"""
+
+@run_in_db_thread
+def get_user_rooms(user_id: int, after_id: int = 0, limit: Optional[int] = None,
+                   before_id: Optional[int] = None) -> List[Dict]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        if before_id:
+            cursor.execute(USER_ROOMS_BEFORE_SQL, (user_id, before_id, limit or -1))
+            rooms = [dict(row) for row in reversed(cursor.fetchall())]
+        else:
+            cursor.execute(USER_ROOMS_AFTER_SQL, (user_id, after_id, limit or -1))
+            rooms = [dict(row) for row in cursor.fetchall()]
     
-    conn.close()
     return rooms
 
-async def get_room_members(room_id: int) -> List[Dict]:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT u.user_id, u.username, rm.role 
-        FROM users u 
-        JOIN room_members rm ON u.user_id = rm.user_id 
-        WHERE rm.room_id = ?
-    """, (room_id,))
-    
-    members = [dict(row) for row in cursor.fetchall()]
+@run_in_db_thread
+def get_room_members(room_id: int) -> List[Dict]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute("""
+            SELECT u.user_id, u.username, rm.role 
+            FROM users u 
+            JOIN room_members rm ON u.user_id = rm.user_id 
+            WHERE rm.room_id = ?
+        """, (room_id,))
+        
+        members = [dict(row) for row in cursor.fetchall()]
     
-    conn.close()
     return members
 
+@run_in_db_thread
+def _insert_messages(rows: List[Tuple]):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.executemany(
+            "INSERT INTO messages (room_id, user_id, text) VALUES (?, ?, ?)",
+            rows
+        )
+        
+        conn.commit()
+
+_message_writer = WriteBehindBuffer(
+    _insert_messages,
+    flush_interval_ms=config.settings.message_flush_interval_ms,
+    flush_rows=config.settings.message_flush_rows,
+    durability=config.settings.message_durability
+)
+metrics.track_queue('message_writes', lambda: len(_message_writer))
+
 async def save_message(room_id: int, user_id: int, text: str):
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "INSERT INTO messages (room_id, user_id, text) VALUES (?, ?, ?)",
-        (room_id, user_id, text)
-    )
-    
-    conn.commit()
-    conn.close()
+    for hook in _message_hooks:
+        hook(room_id)
+    await _message_writer.add((room_id, user_id, text))
 
-async def get_room_by_id(room_id: int) -> Optional[Dict]:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("SELECT * FROM rooms WHERE room_id = ?", (room_id,))
-    room = cursor.fetchone()
+async def flush_messages():
+    await _message_writer.close()
+
+async def flush_pending_messages():
+    await _message_writer.flush()
+
+@run_in_db_thread
+def get_room_by_id(room_id: int) -> Optional[Dict]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT * FROM rooms WHERE room_id = ?", (room_id,))
+        room = cursor.fetchone()
     
-    conn.close()
     return dict(room) if room else None
 
-async def is_user_in_room(user_id: int, room_id: int) -> bool:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "SELECT 1 FROM room_members WHERE user_id = ? AND room_id = ?",
-        (user_id, room_id)
-    )
-    
-    result = cursor.fetchone() is not None
+MEMBERSHIP_SQL = "SELECT 1 FROM room_members WHERE user_id = ? AND room_id = ?"
+
+@run_in_db_thread
+def is_user_in_room(user_id: int, room_id: int) -> bool:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(MEMBERSHIP_SQL, (user_id, room_id))
+        
+        result = cursor.fetchone() is not None
     
-    conn.close()
     return result
 
-async def get_all_rooms() -> List[Dict]:
-    conn = get_db_connection()
-    cursor = conn.cursor()
+@run_in_db_thread
+def user_exists(user_id: int) -> bool:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute("SELECT 1 FROM users WHERE user_id = ?", (user_id,))
+        result = cursor.fetchone() is not None
     
-    cursor.execute("SELECT room_id, name FROM rooms")
-    rooms = [dict(row) for row in cursor.fetchall()]
+    return result
+
+@run_in_db_thread
+def get_active_rooms(user_ids: List[int]) -> Dict[int, int]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        placeholders = ", ".join("?" * len(user_ids))
+        cursor.execute(
+            f"SELECT user_id, active_room FROM user_states WHERE user_id IN ({placeholders}) AND active_room IS NOT NULL",
+            user_ids
+        )
+        
+        active_rooms = {row['user_id']: row['active_room'] for row in cursor.fetchall()}
+    
+    return active_rooms
+
+@run_in_db_thread
+def get_all_rooms(after_id: int = 0, limit: Optional[int] = None,
+                  before_id: Optional[int] = None) -> List[Dict]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        if before_id:
+            cursor.execute(
+                "SELECT room_id, name FROM rooms WHERE room_id < ? ORDER BY room_id DESC LIMIT ?",
+                (before_id, limit or -1)
+            )
+            rooms = [dict(row) for row in reversed(cursor.fetchall())]
+        else:
+            cursor.execute(
+                "SELECT room_id, name FROM rooms WHERE room_id > ? ORDER BY room_id LIMIT ?",
+                (after_id, limit or -1)
+            )
+            rooms = [dict(row) for row in cursor.fetchall()]
     
-    conn.close()
     return rooms
 
-async def get_user_role_in_room(user_id: int, room_id: int) -> Optional[str]:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute(
-        "SELECT role FROM room_members WHERE user_id = ? AND room_id = ?",
-        (user_id, room_id)
-    )
-    
-    result = cursor.fetchone()
-    
-    conn.close()
-    return result['role'] if result else None
+ROOM_ROLES_SQL = "SELECT user_id, role FROM room_members WHERE room_id = ?"
 
-async def get_other_room_members(room_id: int, user_id: int) -> List[Dict]:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    cursor.execute("""
-        SELECT u.user_id, u.role, rm.role as room_role
-        FROM users u
-        JOIN room_members rm ON u.user_id = rm.user_id
-        WHERE rm.room_id = ? AND u.user_id != ?
-    """, (room_id, user_id))
-    
-    members = [dict(row) for row in cursor.fetchall()]
-    
-    conn.close()
-    return members
+@run_in_db_thread
+def _fetch_room_roles(room_id: int) -> Tuple[Tuple[int, str], ...]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(ROOM_ROLES_SQL, (room_id,))
+        
+        roles = tuple((row['user_id'], row['role']) for row in cursor.fetchall())
+    
+    return roles
+
+async def get_relay_context(room_id: int, sender_id: int) -> Tuple[Optional[str], List[Dict]]:
+    roles = _membership_cache.get(room_id)
+    if roles is None:
+        generation = _membership_cache.version(room_id)
+        roles = await _fetch_room_roles(room_id)
+        _membership_cache.set(room_id, roles, generation)
+    
+    sender_role = None
+    recipients = []
+    for member_id, role in roles:
+        if member_id == sender_id:
+            sender_role = role
+        else:
+            recipients.append({'user_id': member_id, 'room_role': role})
+    
+    return sender_role, recipients
+
+def get_membership_cache_stats() -> Dict:
+    return _membership_cache.stats()
+
+@run_in_db_thread
+def delete_room(room_id: int) -> List[int]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        # members cover the memory state backend, which has no user_states rows
+        cursor.execute("""
+            SELECT user_id FROM user_states WHERE active_room = ?
+            UNION
+            SELECT user_id FROM room_members WHERE room_id = ?
+        """, (room_id, room_id))
+        user_ids = [row['user_id'] for row in cursor.fetchall()]
+
+        cursor.execute(
+            "UPDATE user_states SET active_room = NULL WHERE active_room = ?",
+            (room_id,)
+        )
+
+        cursor.execute(
+            "DELETE FROM messages WHERE room_id = ?",
+            (room_id,)
+        )
+
+        cursor.execute(
+            "DELETE FROM room_members WHERE room_id = ?",
+            (room_id,)
+        )
+
+        cursor.execute(
+            "DELETE FROM rooms WHERE room_id = ?",
+            (room_id,)
+        )
+
+        conn.commit()
+
+    _room_changed(room_id)
+    return user_ids
+
+@run_in_db_thread
+def export_room_history(room_id: int, fmt: str = None, compress: bool = None) -> IO[bytes]:
+    with get_db_connection() as conn:
+        return exporter.write_room_history(
+            conn,
+            room_id,
+            fmt=fmt or config.settings.export_format,
+            compress=config.settings.export_compress if compress is None else compress,
+            chunk_size=config.settings.export_chunk_size,
+            spool_max_size=config.settings.export_spool_max_size
+        )
+
+ROOM_HISTORY_SQL = """
+    SELECT m.message_id, m.user_id, rm.role, m.text, m.sent_at
+    FROM messages m
+    LEFT JOIN room_members rm ON rm.room_id = m.room_id AND rm.user_id = m.user_id
+    WHERE m.room_id = ? AND m.message_id < ?
+    ORDER BY m.message_id DESC
+    LIMIT ?
+"""
+
+@run_in_db_thread
+def get_room_history(room_id: int, before_id: int, limit: int) -> List[Dict]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+
+        cursor.execute(ROOM_HISTORY_SQL, (room_id, before_id, limit))
+
+        messages = [dict(row) for row in cursor.fetchall()]
+
+    return messages
+
+@run_in_db_thread
+def search_room(room_id: int, query: str, limit: int = None, cursor: Optional[Tuple[int, int]] = None) -> Dict:
+    with get_db_connection() as conn:
+        return search.search_messages(
+            conn,
+            room_id,
+            query,
+            limit=limit or config.settings.search_page_size,
+            cursor=cursor,
+            candidates=config.settings.search_candidates
+        )
+
+@run_in_db_thread
+def backfill_search_index(batch_size: int) -> int:
+    with get_db_connection() as conn:
+        return search.backfill(conn, batch_size)
+
+async def run_search_backfill():
+    indexed = 0
+    while True:
+        try:
+            count = await backfill_search_index(config.settings.search_backfill_batch)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Search backfill error: {e}", exc_info=True)
+            count = None
+
+        if count == 0:
+            break
+        indexed += count or 0
+        await asyncio.sleep(config.settings.search_backfill_interval)
+
+    if indexed:
+        logger.info(f"Search index backfill finished: {indexed} messages indexed")
 
-async def delete_room(room_id: int):
-    conn = get_db_connection()
-    cursor = conn.cursor()
+@run_in_db_thread
+def enqueue_deliveries(deliveries: List[Dict]):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.executemany("""
+            INSERT OR IGNORE INTO outbox
+                (source_chat_id, source_message_id, recipient_id, method, payload, attempts, next_attempt_at, last_error)
+            VALUES
+                (:source_chat_id, :source_message_id, :recipient_id, :method, :payload, :attempts, :next_attempt_at, :last_error)
+        """, deliveries)
+        
+        conn.commit()
 
-    cursor.execute(
-        "DELETE FROM messages WHERE room_id = ?",
-        (room_id,)
-    )
+DUE_DELIVERIES_SQL = """
+    SELECT id, source_chat_id, source_message_id, recipient_id, method, payload, attempts
+    FROM outbox
+    WHERE next_attempt_at <= ?
+    ORDER BY next_attempt_at
+    LIMIT ?
+"""
 
-    cursor.execute(
-        "DELETE FROM room_members WHERE room_id = ?",
-        (room_id,)
-    )
+@run_in_db_thread
+def get_due_deliveries(now: float, limit: int) -> List[Dict]:
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.execute(DUE_DELIVERIES_SQL, (now, limit))
+        
+        deliveries = [dict(row) for row in cursor.fetchall()]
+    
+    return deliveries
 
-    cursor.execute(
-        "DELETE FROM rooms WHERE room_id = ?",
-        (room_id,)
-    )
+@run_in_db_thread
+def complete_deliveries(delivery_ids: List[int]):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.executemany("DELETE FROM outbox WHERE id = ?", [(delivery_id,) for delivery_id in delivery_ids])
+        
+        conn.commit()
 
-    conn.commit()
-    conn.close()
\ No newline at end of file
+@run_in_db_thread
+def reschedule_deliveries(updates: List[Dict]):
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        
+        cursor.executemany("""
+            UPDATE outbox
+            SET attempts = :attempts, next_attempt_at = :next_attempt_at, last_error = :last_error
+            WHERE id = :id
+        """, updates)
+        
+        conn.commit()
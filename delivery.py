@@ -0,0 +1,136 @@
+import asyncio
+import json
+import logging
+import random
+import time
+from typing import Any, Dict, List
+
+from telebot.async_telebot import AsyncTeleBot
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.types import MessageEntity
+
+from database import db
+from utils import media_groups, outbound
+import config
+
+logger = logging.getLogger(__name__)
+
+PERMANENT_ERROR_CODES = (400, 403)
+ENTITY_KWARGS = ('entities', 'caption_entities')
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, ApiTelegramException):
+        return error.error_code not in PERMANENT_ERROR_CODES
+    if isinstance(error, outbound.SendTimeout):
+        # retrying a request that was already sent would deliver the message twice
+        return not error.dispatched
+    return True
+
+def backoff_delay(attempts: int) -> float:
+    delay = min(config.settings.outbox_backoff_max, config.settings.outbox_backoff_base * 2 ** attempts)
+    return delay * random.uniform(0.8, 1.2)
+
+def _to_json(value: Any) -> Any:
+    if hasattr(value, 'to_dict'):
+        return {key: item for key, item in value.to_dict().items() if item is not None}
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+async def call_method(bot: AsyncTeleBot, method: str, chat_id: int, kwargs: Dict[str, Any]) -> Any:
+    if method == 'send_media_group':
+        kwargs = dict(kwargs, media=media_groups.hydrate(kwargs['media']))
+    for key in ENTITY_KWARGS:
+        if kwargs.get(key) and isinstance(kwargs[key][0], dict):
+            kwargs = dict(kwargs, **{key: [MessageEntity.de_json(entity) for entity in kwargs[key]]})
+    return await outbound.send(
+        getattr(bot, method), chat_id, priority=outbound.BULK, send_timeout=config.settings.fanout_timeout, **kwargs
+    )
+
+async def enqueue_failed(source_chat_id: int, source_message_id: int, method: str,
+                         kwargs: Dict[str, Any], failures: List[Dict]) -> int:
+    now = time.time()
+    payload = json.dumps(kwargs, ensure_ascii=False, default=_to_json)
+
+    deliveries = []
+    for failure in failures:
+        if not is_retryable(failure['error']):
+            continue
+        deliveries.append({
+            'source_chat_id': source_chat_id,
+            'source_message_id': source_message_id,
+            'recipient_id': failure['user_id'],
+            'method': method,
+            'payload': payload,
+            'attempts': 1,
+            'next_attempt_at': now + backoff_delay(1),
+            'last_error': str(failure['error'])
+        })
+
+    if deliveries:
+        await db.enqueue_deliveries(deliveries)
+    return len(deliveries)
+
+async def _attempt(bot: AsyncTeleBot, delivery: Dict) -> Dict:
+    try:
+        await call_method(bot, delivery['method'], delivery['recipient_id'], json.loads(delivery['payload']))
+    except Exception as e:
+        return {'delivery': delivery, 'error': e}
+    return {'delivery': delivery, 'error': None}
+
+async def drain_outbox(bot: AsyncTeleBot) -> int:
+    deliveries = await db.get_due_deliveries(time.time(), config.settings.outbox_batch_size)
+    if not deliveries:
+        return 0
+
+    results = await asyncio.gather(*(_attempt(bot, delivery) for delivery in deliveries))
+
+    delivered = []
+    abandoned = []
+    retries = []
+    now = time.time()
+    for result in results:
+        delivery = result['delivery']
+        error = result['error']
+        if error is None:
+            delivered.append(delivery['id'])
+            continue
+
+        attempts = delivery['attempts'] + 1
+        if not is_retryable(error) or attempts >= config.settings.outbox_max_attempts:
+            logger.error(
+                f"Giving up on delivery {delivery['id']} to {delivery['recipient_id']} "
+                f"after {attempts} attempts: {error}"
+            )
+            abandoned.append(delivery['id'])
+            continue
+
+        retries.append({
+            'id': delivery['id'],
+            'attempts': attempts,
+            'next_attempt_at': now + backoff_delay(attempts),
+            'last_error': str(error)
+        })
+
+    # given up deliveries are only logged, keeping them would grow the outbox without bound
+    if delivered or abandoned:
+        await db.complete_deliveries(delivered + abandoned)
+    if retries:
+        await db.reschedule_deliveries(retries)
+
+    logger.info(
+        f"Outbox drained: {len(delivered)} delivered, {len(retries)} rescheduled, {len(abandoned)} given up"
+    )
+    return len(deliveries)
+
+async def run_outbox_worker(bot: AsyncTeleBot):
+    logger.info("Outbox worker started")
+    while True:
+        try:
+            processed = await drain_outbox(bot)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Outbox worker error: {e}", exc_info=True)
+            processed = 0
+
+        if processed < config.settings.outbox_batch_size:
+            await asyncio.sleep(config.settings.outbox_poll_interval)
@@ -0,0 +1,133 @@
+import csv
+import gzip
+import html
+import io
+import json
+import sqlite3
+import tempfile
+from typing import IO, List
+
+COLUMNS = ['message_id', 'sent_at', 'user_id', 'username', 'role', 'text']
+
+HISTORY_SQL = """
+    SELECT m.message_id, m.sent_at, m.user_id, u.username, rm.role, m.text
+    FROM messages m
+    LEFT JOIN users u ON u.user_id = m.user_id
+    LEFT JOIN room_members rm ON rm.room_id = m.room_id AND rm.user_id = m.user_id
+    WHERE m.room_id = ?
+    ORDER BY m.sent_at, m.message_id
+"""
+
+class _TextSink:
+    def __init__(self, raw: IO[bytes]):
+        self.raw = raw
+        self.bytes_written = 0
+
+    def write(self, text: str) -> int:
+        data = text.encode('utf-8')
+        self.raw.write(data)
+        self.bytes_written += len(data)
+        return len(text)
+
+class CsvExport:
+    extension = 'csv'
+
+    def __init__(self, sink: _TextSink):
+        self.sink = sink
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer)
+
+    def _drain(self):
+        self.sink.write(self.buffer.getvalue())
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def begin(self, room_id: int):
+        self.writer.writerow(COLUMNS)
+        self._drain()
+
+    def write_rows(self, rows: List[sqlite3.Row]):
+        self.writer.writerows(rows)
+        self._drain()
+
+    def end(self):
+        pass
+
+class JsonlExport:
+    extension = 'jsonl'
+
+    def __init__(self, sink: _TextSink):
+        self.sink = sink
+
+    def begin(self, room_id: int):
+        pass
+
+    def write_rows(self, rows: List[sqlite3.Row]):
+        self.sink.write("".join(json.dumps(dict(row), ensure_ascii=False) + "\n" for row in rows))
+
+    def end(self):
+        pass
+
+class HtmlExport:
+    extension = 'html'
+
+    def __init__(self, sink: _TextSink):
+        self.sink = sink
+
+    def begin(self, room_id: int):
+        header = "".join(f"<th>{column}</th>" for column in COLUMNS)
+        self.sink.write(
+            "<!DOCTYPE html>\n<html><head><meta charset=\"utf-8\">"
+            f"<title>Room {room_id}</title></head><body>\n"
+            f"<table>\n<tr>{header}</tr>\n"
+        )
+
+    def write_rows(self, rows: List[sqlite3.Row]):
+        self.sink.write("".join(
+            "<tr>" + "".join(f"<td>{html.escape(str(value) if value is not None else '')}</td>" for value in row) + "</tr>\n"
+            for row in rows
+        ))
+
+    def end(self):
+        self.sink.write("</table>\n</body></html>\n")
+
+FORMATS = {
+    'csv': CsvExport,
+    'jsonl': JsonlExport,
+    'html': HtmlExport
+}
+
+def export_filename(room_id: int, fmt: str, compress: bool) -> str:
+    name = f"room_{room_id}_history.{FORMATS[fmt].extension}"
+    return name + ".gz" if compress else name
+
+def write_room_history(conn: sqlite3.Connection, room_id: int, fmt: str = 'csv', compress: bool = False,
+                       chunk_size: int = 1000, spool_max_size: int = 8 * 1024 * 1024) -> IO[bytes]:
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+
+    spool = tempfile.SpooledTemporaryFile(max_size=spool_max_size, mode='w+b')
+    raw = gzip.GzipFile(fileobj=spool, mode='wb') if compress else spool
+    exporter = FORMATS[fmt](_TextSink(raw))
+
+    cursor = conn.cursor()
+    cursor.execute(HISTORY_SQL, (room_id,))
+
+    try:
+        exporter.begin(room_id)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            exporter.write_rows(rows)
+        exporter.end()
+    except Exception:
+        spool.close()
+        raise
+    finally:
+        cursor.close()
+
+    if compress:
+        raw.close()
+    spool.seek(0)
+    return spool
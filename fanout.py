@@ -0,0 +1,27 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, Iterable, List
+
+import config
+
+async def fan_out(recipients: Iterable[int], send: Callable[[int], Awaitable], limit: int = None) -> List[Dict]:
+    semaphore = asyncio.Semaphore(limit or config.settings.fanout_concurrency)
+
+    async def deliver(user_id: int) -> Dict:
+        async with semaphore:
+            started = time.monotonic()
+            try:
+                await send(user_id)
+            except Exception as e:
+                error = e
+            else:
+                error = None
+
+            return {
+                'user_id': user_id,
+                'ok': error is None,
+                'error': error,
+                'elapsed': time.monotonic() - started
+            }
+
+    return await asyncio.gather(*(deliver(user_id) for user_id in recipients))
@@ -1,37 +1,227 @@
+import functools
+import json
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
 import config
 from telebot.types import InlineKeyboardMarkup, InlineKeyboardButton
 
+from database import db
+from utils import metrics
+from utils.cache import LRUCache
+from utils.callback_codec import Action, encode
+
+_room_pages = LRUCache(config.settings.room_pages_cache_size, config.settings.room_pages_cache_ttl)
+db.add_invalidation_hook(lambda room_id: _room_pages.clear())
+metrics.track_cache('room_pages', _room_pages.stats)
+
+_history_pages = LRUCache(config.settings.history_pages_cache_size, config.settings.history_pages_cache_ttl)
+db.add_invalidation_hook(lambda room_id: _history_pages.clear())
+# older pages never change, only the latest one gains messages
+db.add_message_hook(lambda room_id: _history_pages.invalidate((room_id, 0)))
+metrics.track_cache('history_pages', _history_pages.stats)
+# the largest rowid, so the first page is the same keyset range read as the older ones
+MAX_MESSAGE_ID = 2 ** 63 - 1
+
+class FrozenMarkup(InlineKeyboardMarkup):
+    def __init__(self, data: str, inline_keyboard: Optional[List[List[InlineKeyboardButton]]] = None):
+        super().__init__(inline_keyboard=inline_keyboard)
+        self._json = data
+
+    def to_json(self) -> str:
+        return self._json
+
+    def to_dict(self) -> Dict:
+        return json.loads(self._json)
+
+    def add(self, *args, **kwargs):
+        raise TypeError("Frozen markups cannot be modified")
+
+    row = add
+
+def freeze(markup: InlineKeyboardMarkup) -> FrozenMarkup:
+    return FrozenMarkup(markup.to_json(), markup.inline_keyboard)
+
+_PLACEHOLDER = "\x00"
+
+class MarkupTemplate:
+    def __init__(self, *rows: List[Tuple[str, Union[int, str]]]):
+        self.rows = rows
+        self.actions = [callback for row in rows for _, callback in row if isinstance(callback, int)]
+        data = json.dumps({'inline_keyboard': [
+            [{'text': text, 'callback_data': _PLACEHOLDER if isinstance(callback, int) else callback}
+             for text, callback in row]
+            for row in rows
+        ]})
+        self._parts = data.split(json.dumps(_PLACEHOLDER)[1:-1])
+
+    def render(self, *args: int) -> FrozenMarkup:
+        chunks = [self._parts[0]]
+        for action, part in zip(self.actions, self._parts[1:]):
+            chunks.append(encode(action, *args))
+            chunks.append(part)
+        return FrozenMarkup("".join(chunks))
+
+ROOM_INFO_TEMPLATE = MarkupTemplate(
+    [("▶️ Войти в комнату", Action.ADMIN_ENTER_ROOM)],
+    [("📤 Экспорт истории", Action.EXPORT_HISTORY)],
+    [("🔎 Поиск по истории", Action.SEARCH_ROOM)],
+    [("🗑️ Удалить комнату", Action.DELETE_ROOM)],
+    [("◀️ Назад к списку", encode(Action.LIST_ROOMS))],
+    [("🏠 Главное меню", encode(Action.MAIN_MENU))]
+)
+
 def is_admin(user_id: int) -> bool:
-    return user_id in config.ADMIN_IDS
+    return user_id in config.settings.admin_ids
 
 def get_main_menu_markup(user_id: int) -> InlineKeyboardMarkup:
+    return _main_menu_markup(is_admin(user_id))
+
+@functools.lru_cache(maxsize=None)
+def _main_menu_markup(admin: bool) -> FrozenMarkup:
     markup = InlineKeyboardMarkup(row_width=1)
-    markup.add(InlineKeyboardButton("Мои комнаты", callback_data="view_rooms"))
+    markup.add(InlineKeyboardButton("Мои комнаты", callback_data=encode(Action.VIEW_ROOMS)))
     
-    if is_admin(user_id):
-        markup.add(InlineKeyboardButton("Панель администратора", callback_data="admin_panel"))
+    if admin:
+        markup.add(InlineKeyboardButton("Панель администратора", callback_data=encode(Action.ADMIN_PANEL)))
     
-    return markup
+    return freeze(markup)
 
+@functools.lru_cache(maxsize=None)
 def get_admin_panel_markup() -> InlineKeyboardMarkup:
     markup = InlineKeyboardMarkup(row_width=1)
     markup.add(
-        InlineKeyboardButton("Создать комнату", callback_data="create_room"),
-        InlineKeyboardButton("Список комнат", callback_data="list_rooms"),
-        InlineKeyboardButton("Главное меню", callback_data="main_menu")
+        InlineKeyboardButton("Создать комнату", callback_data=encode(Action.CREATE_ROOM)),
+        InlineKeyboardButton("Список комнат", callback_data=encode(Action.LIST_ROOMS)),
+        InlineKeyboardButton("Главное меню", callback_data=encode(Action.MAIN_MENU))
     )
-    return markup
+    return freeze(markup)
 
+@functools.lru_cache(maxsize=None)
 def get_room_exit_markup() -> InlineKeyboardMarkup:
     markup = InlineKeyboardMarkup()
-    markup.add(InlineKeyboardButton("Выйти из комнаты", callback_data="exit_room"))
-    return markup
+    markup.add(InlineKeyboardButton("📜 История сообщений", callback_data=encode(Action.ROOM_HISTORY)))
+    markup.add(InlineKeyboardButton("Выйти из комнаты", callback_data=encode(Action.EXIT_ROOM)))
+    return freeze(markup)
 
+@functools.lru_cache(maxsize=None)
 def get_back_to_main_menu_markup() -> InlineKeyboardMarkup:
     markup = InlineKeyboardMarkup()
-    markup.add(InlineKeyboardButton("Главное меню", callback_data="main_menu"))
+    markup.add(InlineKeyboardButton("Главное меню", callback_data=encode(Action.MAIN_MENU)))
+    return freeze(markup)
+
+@functools.lru_cache(maxsize=None)
+def get_room_left_markup() -> InlineKeyboardMarkup:
+    markup = InlineKeyboardMarkup(row_width=1)
+    markup.add(
+        InlineKeyboardButton("Мои комнаты", callback_data=encode(Action.VIEW_ROOMS)),
+        InlineKeyboardButton("Главное меню", callback_data=encode(Action.MAIN_MENU))
+    )
+    return freeze(markup)
+
+def get_room_info_markup(room_id: int) -> InlineKeyboardMarkup:
+    return ROOM_INFO_TEMPLATE.render(room_id)
+
+def get_search_results_markup(room_id: int, cursor: Optional[Tuple[int, int]]) -> InlineKeyboardMarkup:
+    markup = InlineKeyboardMarkup(row_width=1)
+    if cursor:
+        markup.add(InlineKeyboardButton("▶️ Ещё результаты", callback_data=encode(Action.SEARCH_PAGE, room_id, *cursor)))
+    markup.add(
+        InlineKeyboardButton("🔎 Новый поиск", callback_data=encode(Action.SEARCH_ROOM, room_id)),
+        InlineKeyboardButton("◀️ Назад к комнате", callback_data=encode(Action.ROOM_INFO, room_id))
+    )
     return markup
 
+async def _get_rooms_page(scope: Tuple, fetch, action: int, after_id: int, before_id: int,
+                          make_button: Callable[[Dict], InlineKeyboardButton],
+                          footer: InlineKeyboardButton) -> Dict:
+    key = scope + (after_id, before_id)
+    page = _room_pages.get(key)
+    if page is not None:
+        return page
+
+    generation = _room_pages.version(key)
+    size = config.settings.rooms_page_size
+    if before_id:
+        rooms = await fetch(before_id=before_id, limit=size + 1)
+        has_prev, has_next = len(rooms) > size, True
+        rooms = rooms[-size:]
+    else:
+        rooms = await fetch(after_id=after_id, limit=size + 1)
+        has_prev, has_next = after_id > 0, len(rooms) > size
+        rooms = rooms[:size]
+
+    if not rooms and (after_id or before_id):
+        return await _get_rooms_page(scope, fetch, action, 0, 0, make_button, footer)
+
+    markup = InlineKeyboardMarkup(row_width=1)
+    for room in rooms:
+        markup.add(make_button(room))
+
+    navigation = []
+    if has_prev:
+        navigation.append(InlineKeyboardButton("◀️", callback_data=encode(action, 0, rooms[0]['room_id'])))
+    if has_next:
+        navigation.append(InlineKeyboardButton("▶️", callback_data=encode(action, rooms[-1]['room_id'])))
+    if navigation:
+        markup.row(*navigation)
+    markup.add(footer)
+
+    page = {'rooms': rooms, 'markup': freeze(markup), 'has_more': has_prev or has_next}
+    _room_pages.set(key, page, generation)
+    return page
+
+async def get_all_rooms_page(after_id: int = 0, before_id: int = 0) -> Dict:
+    return await _get_rooms_page(
+        ('all',), db.get_all_rooms, Action.LIST_ROOMS, after_id, before_id,
+        lambda room: InlineKeyboardButton(
+            f"{room['name']} (ID: {room['room_id']})",
+            callback_data=encode(Action.ROOM_INFO, room['room_id'])
+        ),
+        InlineKeyboardButton("Назад", callback_data=encode(Action.ADMIN_PANEL))
+    )
+
+async def get_user_rooms_page(user_id: int, after_id: int = 0, before_id: int = 0) -> Dict:
+    return await _get_rooms_page(
+        ('user', user_id), functools.partial(db.get_user_rooms, user_id), Action.VIEW_ROOMS, after_id, before_id,
+        lambda room: InlineKeyboardButton(room['name'], callback_data=encode(Action.ENTER_ROOM, room['room_id'])),
+        InlineKeyboardButton("Главное меню", callback_data=encode(Action.MAIN_MENU))
+    )
+
+async def get_history_page(room_id: int, before_id: int = 0) -> Dict:
+    key = (room_id, before_id)
+    page = _history_pages.get(key)
+    if page is not None:
+        return page
+
+    generation = _history_pages.version(key)
+    if not before_id:
+        # the latest page has to show messages still waiting in the write buffer
+        await db.flush_pending_messages()
+    size = config.settings.history_page_size
+    messages = await db.get_room_history(room_id, before_id or MAX_MESSAGE_ID, size + 1)
+    has_more = len(messages) > size
+    messages = messages[:size][::-1]
+
+    text = "\n\n".join(
+        f"{get_sender_title(is_admin(message['user_id']), message['role'])} · {message['sent_at']}\n"
+        f"{truncate(message['text'] or '', 300)}"
+        for message in messages
+    )
+
+    markup = InlineKeyboardMarkup()
+    if has_more:
+        markup.add(InlineKeyboardButton(
+            "⬅️ Более ранние", callback_data=encode(Action.ROOM_HISTORY, messages[0]['message_id'])
+        ))
+    markup.add(InlineKeyboardButton("Выйти из комнаты", callback_data=encode(Action.EXIT_ROOM)))
+
+    page = {'messages': messages, 'text': text, 'markup': freeze(markup), 'has_more': has_more}
+    _history_pages.set(key, page, generation)
+    return page
+
+def truncate(text: str, limit: int) -> str:
+    return text if len(text) <= limit else text[:limit - 1].rstrip() + "…"
+
 def get_sender_title(is_admin: bool, role: str) -> str:
     if is_admin:
         return "Администратор"
@@ -0,0 +1,61 @@
+import asyncio
+import logging
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, Hashable, Set
+
+logger = logging.getLogger(__name__)
+
+class KeyedRunner:
+    """Runs items concurrently, except that items sharing a key run one at a time in arrival order."""
+
+    def __init__(self, handle: Callable[[Any], Awaitable], max_pending: int = 0):
+        self.handle = handle
+        self.max_pending = max_pending
+        self.pending = 0
+
+        self._chains: Dict[Hashable, Deque] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+    def submit(self, key: Hashable, item: Any) -> bool:
+        if self.max_pending and self.pending >= self.max_pending:
+            return False
+
+        self.pending += 1
+        self._idle.clear()
+        chain = self._chains.get(key)
+        if chain is not None:
+            chain.append(item)
+            return True
+
+        self._chains[key] = deque([item])
+        task = asyncio.create_task(self._drain(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return True
+
+    async def _drain(self, key: Hashable):
+        chain = self._chains[key]
+        try:
+            while chain:
+                try:
+                    await self.handle(chain[0])
+                except Exception as e:
+                    logger.error(f"Error processing item for key {key}: {e}", exc_info=True)
+                finally:
+                    chain.popleft()
+                    self.pending -= 1
+        finally:
+            self.pending -= len(chain)
+            del self._chains[key]
+            if not self._chains:
+                self._idle.set()
+
+    async def join(self):
+        await self._idle.wait()
+
+    async def close(self):
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
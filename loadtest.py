@@ -0,0 +1,539 @@
+import argparse
+import asyncio
+import dataclasses
+import json
+import os
+import random
+import re
+import secrets
+import tempfile
+import time
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from dataclasses import dataclass, field
+from multiprocessing import get_context
+from typing import Any, Dict, List, Optional
+from urllib.parse import parse_qsl
+
+from aiohttp import web
+
+import config
+
+TAG = re.compile(r"lt:(\d+)")
+
+NO_RESULT_METHODS = {'answerCallbackQuery', 'deleteWebhook', 'setWebhook', 'deleteMessage'}
+
+def _file(seq: int, **extra) -> Dict[str, Any]:
+    return dict({'file_id': f"lt:{seq}", 'file_unique_id': f"u{seq}"}, **extra)
+
+CONTENT = {
+    'text': lambda seq: {'text': f"load test message lt:{seq}"},
+    'photo': lambda seq: {'photo': [_file(seq, width=640, height=480)], 'caption': f"photo lt:{seq}"},
+    'video': lambda seq: {'video': _file(seq, width=640, height=480, duration=5), 'caption': f"video lt:{seq}"},
+    'document': lambda seq: {'document': _file(seq, file_name="report.pdf"), 'caption': f"document lt:{seq}"},
+    'voice': lambda seq: {'voice': _file(seq, duration=3)},
+    'sticker': lambda seq: {'sticker': _file(seq, type='regular', width=512, height=512,
+                                             is_animated=False, is_video=False)},
+    'location': lambda seq: {'location': {'latitude': 55.75, 'longitude': 37.61}}
+}
+
+@dataclass
+class Scenario:
+    name: str = "default"
+    rooms: int = 10
+    members: int = 3
+    messages: int = 1000
+    # inbound updates per second, 0 pushes everything at once
+    rate: float = 200
+    mix: Dict[str, int] = field(default_factory=lambda: {
+        'text': 70, 'photo': 10, 'document': 5, 'voice': 5, 'sticker': 5, 'location': 5
+    })
+    api_latency: float = 0.02
+    api_jitter: float = 0.01
+    rate_limit_ratio: float = 0.0
+    retry_after: int = 1
+    # lift the outbound rate limits so the bot, not the throttle, is measured
+    unthrottled: bool = True
+    relay_mode: str = "copy"
+    # polling, or webhook to post updates to an in-process WebhookServer the way Telegram pushes them
+    update_mode: str = "polling"
+    # >0 runs the sharding supervisor with this many worker processes instead of polling in-process
+    workers: int = 0
+    # False measures the instrumentation overhead against the same scenario with metrics on
+    metrics: bool = True
+    # run db calls on the event loop thread without the membership cache or batched writes,
+    # the pre-executor code path the db executor is measured against
+    inline_db: bool = False
+    seed: int = 1
+
+SUITE = [
+    Scenario(name="text-small-rooms", rooms=20, members=2, messages=2000, mix={'text': 1}),
+    Scenario(name="text-small-rooms-webhook", rooms=20, members=2, messages=2000, mix={'text': 1},
+             update_mode="webhook"),
+    Scenario(name="mixed-content", rooms=10, members=3, messages=2000),
+    Scenario(name="mixed-content-webhook", rooms=10, members=3, messages=2000, update_mode="webhook"),
+    Scenario(name="mixed-content-no-metrics", rooms=10, members=3, messages=2000, metrics=False),
+    Scenario(name="mixed-rebuild", rooms=10, members=3, messages=2000, relay_mode="rebuild"),
+    Scenario(name="wide-fanout", rooms=2, members=25, messages=500, rate=50),
+    Scenario(name="rate-limited", rooms=10, members=3, messages=1000, rate=100, rate_limit_ratio=0.02),
+    Scenario(name="throttled-defaults", rooms=5, members=3, messages=200, rate=20, unthrottled=False),
+    Scenario(name="loop-lag-500", rooms=20, members=3, messages=5000, rate=500),
+    Scenario(name="loop-lag-500-inline-db", rooms=20, members=3, messages=5000, rate=500, inline_db=True),
+    Scenario(name="workers-in-process", rooms=40, members=3, messages=4000, rate=0, mix={'text': 1}),
+    Scenario(name="workers-in-process-no-metrics", rooms=40, members=3, messages=4000, rate=0, mix={'text': 1},
+             metrics=False),
+    Scenario(name="webhook-in-process", rooms=40, members=3, messages=4000, rate=0, mix={'text': 1},
+             update_mode="webhook"),
+    Scenario(name="workers-1", rooms=40, members=3, messages=4000, rate=0, mix={'text': 1}, workers=1),
+    Scenario(name="workers-2", rooms=40, members=3, messages=4000, rate=0, mix={'text': 1}, workers=2),
+    Scenario(name="workers-4", rooms=40, members=3, messages=4000, rate=0, mix={'text': 1}, workers=4)
+]
+
+API_URL_ENV = "LOADTEST_API_URL"
+UNTHROTTLED = {'outbound_global_rate': 10 ** 9, 'outbound_chat_rate': 10 ** 9, 'outbound_chat_burst': 10 ** 9}
+
+class InlineExecutor(Executor):
+    def submit(self, fn, *args, **kwargs) -> Future:
+        future = Future()
+        try:
+            future.set_result(fn(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+        return future
+
+class FakeTelegramServer:
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0, rate_limit_ratio: float = 0.0,
+                 retry_after: int = 1, seed: int = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit_ratio = rate_limit_ratio
+        self.retry_after = retry_after
+        self.random = random.Random(seed)
+
+        self._updates: List[Dict] = []
+        self._next_update_id = 1
+        self._sources: Dict[tuple, int] = {}
+        self._arrived = asyncio.Event()
+        self._runner: Optional[web.AppRunner] = None
+
+        self.calls: Dict[str, int] = {}
+        self.rate_limited = 0
+        self.deliveries: List[tuple] = []
+        self._message_ids = 0
+
+    def next_update(self, payload: Dict, seq: Optional[int] = None) -> Dict:
+        update_id = self._next_update_id
+        self._next_update_id += 1
+
+        if seq is not None:
+            message = payload['message']
+            self._sources[(message['chat']['id'], message['message_id'])] = seq
+        return dict(payload, update_id=update_id)
+
+    def push_update(self, payload: Dict, seq: Optional[int] = None) -> int:
+        update = self.next_update(payload, seq)
+        self._updates.append(update)
+        self._arrived.set()
+        return update['update_id']
+
+    async def _params(self, request: web.Request) -> Dict[str, Any]:
+        params = dict(request.query)
+        if request.content_type == 'multipart/form-data':
+            async for part in await request.multipart():
+                params[part.name] = await part.read() if part.filename else await part.text()
+        elif request.can_read_body:
+            # telebot sends getUpdates as a GET with a form body, which request.post() ignores
+            params.update(parse_qsl(await request.text()))
+        return params
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict]:
+        offset = int(params.get('offset') or 0)
+        if offset:
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+
+        if not self._updates:
+            self._arrived.clear()
+            try:
+                await asyncio.wait_for(self._arrived.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                pass
+
+        limit = int(params.get('limit') or 100)
+        return self._updates[:limit]
+
+    def _record_delivery(self, method: str, params: Dict[str, Any]) -> None:
+        received = time.perf_counter()
+        if method == 'copyMessage':
+            source = (int(params.get('from_chat_id') or 0), int(params.get('message_id') or 0))
+            self.deliveries.append((self._sources.get(source), params.get('chat_id'), method, received))
+            return
+        for value in params.values():
+            if isinstance(value, str):
+                match = TAG.search(value)
+                if match:
+                    self.deliveries.append((int(match.group(1)), params.get('chat_id'), method, received))
+                    return
+        self.deliveries.append((None, params.get('chat_id'), method, received))
+
+    def _message(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        self._message_ids += 1
+        chat_id = int(params.get('chat_id') or 0)
+        return {
+            'message_id': self._message_ids,
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'text': params.get('text', '')
+        }
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method']
+        params = await self._params(request)
+        self.calls[method] = self.calls.get(method, 0) + 1
+
+        if method == 'getUpdates':
+            return web.json_response({'ok': True, 'result': await self._get_updates(params)})
+        if method == 'getMe':
+            return web.json_response({'ok': True, 'result': {
+                'id': 1, 'is_bot': True, 'first_name': 'loadtest', 'username': 'loadtest_bot'
+            }})
+
+        if self.latency or self.jitter:
+            await asyncio.sleep(self.latency + self.random.uniform(0, self.jitter))
+
+        if method.startswith(('send', 'copy', 'forward')) and self.random.random() < self.rate_limit_ratio:
+            self.rate_limited += 1
+            return web.json_response({
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after}
+            })
+
+        if method in NO_RESULT_METHODS:
+            return web.json_response({'ok': True, 'result': True})
+
+        self._record_delivery(method, params)
+        if method == 'sendMediaGroup':
+            media = json.loads(params.get('media') or '[]')
+            return web.json_response({'ok': True, 'result': [self._message(params) for _ in media]})
+        if method == 'copyMessage':
+            return web.json_response({'ok': True, 'result': {'message_id': self._message(params)['message_id']}})
+        return web.json_response({'ok': True, 'result': self._message(params)})
+
+    async def start(self, host: str, port: int) -> str:
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        port = self._runner.addresses[0][1]
+        return f"http://{host}:{port}/bot{{0}}/{{1}}"
+
+    async def stop(self):
+        self._arrived.set()
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+def _user(user_id: int) -> Dict[str, Any]:
+    return {'id': user_id, 'is_bot': False, 'first_name': f"user_{user_id}", 'username': f"user_{user_id}"}
+
+def message_update(user_id: int, message_id: int, content: Dict[str, Any]) -> Dict[str, Any]:
+    message = dict({
+        'message_id': message_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': _user(user_id)
+    }, **content)
+    if content.get('text', '').startswith('/'):
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(content['text'].split()[0])}]
+    return {'message': message}
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    return values[min(len(values) - 1, int(q * (len(values) - 1) + 0.5))]
+
+async def _wait_until(predicate, timeout: float, interval: float = 0.05) -> bool:
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        if time.monotonic() > deadline:
+            return False
+        await asyncio.sleep(interval)
+    return True
+
+def create_worker_bot():
+    from telebot import asyncio_helper
+    asyncio_helper.API_URL = os.environ[API_URL_ENV]
+
+    import main
+    return main.create_bot()
+
+async def _sample_loop_lag(samples: List[float], interval: float = 0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        expected = loop.time() + interval
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - expected))
+
+async def _run(scenario: Scenario) -> Dict[str, Any]:
+    from telebot import asyncio_helper
+
+    from aiohttp import ClientSession
+
+    import main
+    import sharding
+    import webhook
+    from database import db
+    from states import user_states
+    from states.state_store import SQLiteBackend
+    from utils import delivery, outbound
+
+    if scenario.workers and scenario.update_mode != "polling":
+        raise ValueError("Worker processes only support polling")
+    if scenario.workers and config.settings.state_backend != 'sqlite':
+        raise ValueError("Worker processes require state_backend=sqlite")
+
+    server = FakeTelegramServer(scenario.api_latency, scenario.api_jitter, scenario.rate_limit_ratio,
+                                scenario.retry_after, scenario.seed)
+    asyncio_helper.API_URL = os.environ[API_URL_ENV] = await server.start('127.0.0.1', 0)
+    if scenario.unthrottled:
+        outbound.apply_settings(config.settings.replace(**UNTHROTTLED))
+
+    if scenario.inline_db:
+        db._executor = InlineExecutor()
+    db.init_db()
+    rng = random.Random(scenario.seed)
+    members = {}
+    for room_index in range(scenario.rooms):
+        room_id = await db.create_room(f"load room {room_index}")
+        for member_index in range(scenario.members):
+            user_id = 100000 + room_index * scenario.members + member_index
+            role = "client" if member_index % 2 == 0 else "coder"
+            await db.add_user(user_id, f"user_{user_id}", role)
+            await db.add_member_to_room(room_id, user_id, role)
+            members[user_id] = room_id
+
+    webhook_server = None
+    session = None
+    posts = []
+    if scenario.workers:
+        # workers own the bot and the outbox, the supervisor only polls and routes
+        bot = None
+        background = [asyncio.create_task(sharding.run_supervisor(create_worker_bot, scenario.workers))]
+        backend = SQLiteBackend()
+
+        def in_room(user_id: int) -> bool:
+            record = backend.load(user_id)
+            return bool(record and record['active_room'] is not None)
+    elif scenario.update_mode == "webhook":
+        bot = main.create_bot()
+        background = [asyncio.create_task(delivery.run_outbox_worker(bot))]
+        in_room = user_states.is_user_in_active_room
+
+        secret_token = secrets.token_urlsafe(16)
+        webhook_server = webhook.WebhookServer(
+            bot, config.settings.webhook_path, secret_token, queue_size=config.settings.webhook_queue_size
+        )
+        port = await webhook_server.start('127.0.0.1', 0)
+        session = ClientSession()
+        poster = webhook.UpdatePoster(
+            session, f"http://127.0.0.1:{port}{config.settings.webhook_path}", secret_token,
+            config.settings.webhook_workers
+        )
+    else:
+        bot = main.create_bot()
+        background = [
+            asyncio.create_task(bot.polling(non_stop=True, timeout=1, request_timeout=30)),
+            asyncio.create_task(delivery.run_outbox_worker(bot))
+        ]
+        in_room = user_states.is_user_in_active_room
+
+    def inject(payload: Dict, seq: Optional[int] = None):
+        if webhook_server is None:
+            server.push_update(payload, seq)
+        else:
+            # Telegram keeps up to max_connections webhook requests in flight
+            posts.append(asyncio.create_task(poster.post(server.next_update(payload, seq))))
+
+    message_id = 0
+    for user_id in members:
+        message_id += 1
+        inject(message_update(user_id, message_id, {'text': '/start'}))
+    if not await _wait_until(lambda: all(in_room(user_id) for user_id in members), 60):
+        raise RuntimeError("Members did not enter their rooms in time")
+
+    db_calls_before = sum(db._call_seconds.counts().values())
+    deliveries_before = len(server.deliveries)
+
+    content_types = list(scenario.mix)
+    weights = [scenario.mix[content_type] for content_type in content_types]
+    user_ids = list(members)
+    injected = {}
+    counts = {content_type: 0 for content_type in content_types}
+
+    lag = []
+    lag_sampler = asyncio.create_task(_sample_loop_lag(lag))
+
+    started = time.perf_counter()
+    for seq in range(1, scenario.messages + 1):
+        if scenario.rate:
+            delay = started + (seq - 1) / scenario.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        content_type = rng.choices(content_types, weights)[0]
+        counts[content_type] += 1
+        message_id += 1
+        injected[seq] = time.perf_counter()
+        inject(message_update(rng.choice(user_ids), message_id, CONTENT[content_type](seq)), seq)
+    injected_at = time.perf_counter()
+
+    def relayed() -> List[tuple]:
+        # rebuilt locations carry no text to tag, every other relay is matched by its sequence number
+        return [
+            record for record in server.deliveries[deliveries_before:]
+            if record[0] in injected or record[2] == 'sendLocation'
+        ]
+
+    expected = scenario.messages * (scenario.members - 1)
+    completed = await _wait_until(lambda: len(relayed()) >= expected, 120)
+    finished = max((record[3] for record in relayed()), default=time.perf_counter())
+
+    lag_sampler.cancel()
+    for task in background:
+        task.cancel()
+    await asyncio.gather(lag_sampler, *background, *posts, return_exceptions=True)
+    if webhook_server is not None:
+        await session.close()
+        await webhook_server.stop()
+    await db.flush_messages()
+    # worker processes keep their own metrics, only in-process runs with metrics on count db calls
+    db_calls = None if scenario.workers or not scenario.metrics else sum(db._call_seconds.counts().values()) - db_calls_before
+
+    latencies = sorted(received - injected[seq] for seq, _, _, received in relayed() if seq in injected)
+    lag.sort()
+    delivered = len(relayed())
+    elapsed = finished - started
+
+    if bot is not None:
+        await bot.close_session()
+    await server.stop()
+    user_states.close()
+    db.close_db()
+
+    return {
+        'scenario': scenario.name,
+        'completed': completed,
+        'messages': scenario.messages,
+        'content': counts,
+        'deliveries': delivered,
+        'expected_deliveries': expected,
+        'inbound_per_second': scenario.messages / (injected_at - started),
+        'deliveries_per_second': delivered / elapsed if elapsed > 0 else 0.0,
+        'latency_p50_ms': _percentile(latencies, 0.5) * 1000,
+        'latency_p99_ms': _percentile(latencies, 0.99) * 1000,
+        'latency_max_ms': latencies[-1] * 1000 if latencies else 0.0,
+        'loop_lag_p50_ms': _percentile(lag, 0.5) * 1000,
+        'loop_lag_p99_ms': _percentile(lag, 0.99) * 1000,
+        'loop_lag_max_ms': lag[-1] * 1000 if lag else 0.0,
+        'workers': scenario.workers,
+        'update_mode': scenario.update_mode,
+        'rejected_updates': webhook_server.rejected if webhook_server is not None else 0,
+        'db_ops_per_message': db_calls / scenario.messages if db_calls is not None else None,
+        'rate_limited': server.rate_limited,
+        'api_calls': server.calls
+    }
+
+def _export_settings(settings: config.Settings, names) -> None:
+    # spawned workers load their settings from the environment
+    for name in names:
+        value = getattr(settings, name)
+        if isinstance(value, frozenset):
+            value = ",".join(str(item) for item in sorted(value))
+        os.environ[name.upper()] = str(value)
+
+def run_scenario(scenario: Scenario) -> Dict[str, Any]:
+    with tempfile.TemporaryDirectory(prefix="loadtest-") as directory:
+        changes = {
+            'bot_token': "1:loadtest",
+            'admin_ids': frozenset(),
+            'db_path': os.path.join(directory, "loadtest.db"),
+            'log_file': os.path.join(directory, "loadtest.log"),
+            'metrics_enabled': scenario.metrics,
+            'metrics_port': 0,
+            'relay_mode': scenario.relay_mode
+        }
+        if scenario.inline_db:
+            changes.update(message_durability="sync", membership_cache_size=0)
+        if scenario.workers:
+            changes.update(polling_timeout=1, **(UNTHROTTLED if scenario.unthrottled else {}))
+        config.settings = config.settings.replace(**changes)
+        if scenario.workers:
+            _export_settings(config.settings, changes)
+        from logger import setup_logger, stop_logger
+        setup_logger()
+        try:
+            return asyncio.run(_run(scenario))
+        finally:
+            stop_logger()
+
+def run_isolated(scenario: Scenario) -> Dict[str, Any]:
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context('spawn')) as executor:
+        return executor.submit(run_scenario, scenario).result()
+
+def format_report(report: Dict[str, Any]) -> str:
+    status = "" if report['completed'] else "  (INCOMPLETE)"
+    db_ops = "n/a" if report['db_ops_per_message'] is None else f"{report['db_ops_per_message']:.2f}"
+    return (
+        f"{report['scenario']:30} {report['messages']:6} msgs  "
+        f"{report['inbound_per_second']:7.0f} in/s  {report['deliveries_per_second']:7.0f} out/s  "
+        f"p50 {report['latency_p50_ms']:7.1f} ms  p99 {report['latency_p99_ms']:7.1f} ms  "
+        f"loop lag p99 {report['loop_lag_p99_ms']:6.1f} ms  "
+        f"db ops/msg {db_ops}  429s {report['rate_limited']}{status}"
+    )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run the bot against a local fake Telegram Bot API")
+    parser.add_argument("--suite", action="store_true", help="run the bundled benchmark suite")
+    parser.add_argument("--scenario", choices=[scenario.name for scenario in SUITE], action="append",
+                        help="run one scenario of the suite, may be repeated")
+    parser.add_argument("--rooms", type=int, default=Scenario.rooms)
+    parser.add_argument("--members", type=int, default=Scenario.members)
+    parser.add_argument("--messages", type=int, default=Scenario.messages)
+    parser.add_argument("--rate", type=float, default=Scenario.rate)
+    parser.add_argument("--mix", type=json.loads, default=None, help='JSON weights, e.g. {"text": 9, "photo": 1}')
+    parser.add_argument("--latency", type=float, default=Scenario.api_latency)
+    parser.add_argument("--jitter", type=float, default=Scenario.api_jitter)
+    parser.add_argument("--rate-limit-ratio", type=float, default=Scenario.rate_limit_ratio)
+    parser.add_argument("--retry-after", type=int, default=Scenario.retry_after)
+    parser.add_argument("--throttled", action="store_true", help="keep the configured outbound rate limits")
+    parser.add_argument("--relay-mode", choices=("copy", "rebuild"), default=Scenario.relay_mode)
+    parser.add_argument("--update-mode", choices=("polling", "webhook"), default=Scenario.update_mode)
+    parser.add_argument("--workers", type=int, default=Scenario.workers,
+                        help="run the sharding supervisor with this many worker processes")
+    parser.add_argument("--no-metrics", action="store_true", help="disable metrics to measure their overhead")
+    parser.add_argument("--inline-db", action="store_true", help="run uncached, unbatched db calls on the event loop as a baseline")
+    parser.add_argument("--seed", type=int, default=Scenario.seed)
+    parser.add_argument("--json", action="store_true", help="print full reports as JSON")
+    args = parser.parse_args()
+
+    if args.suite:
+        scenarios = SUITE
+    elif args.scenario:
+        scenarios = [scenario for scenario in SUITE if scenario.name in args.scenario]
+    else:
+        scenario = Scenario(
+            name="custom", rooms=args.rooms, members=args.members, messages=args.messages, rate=args.rate,
+            api_latency=args.latency, api_jitter=args.jitter, rate_limit_ratio=args.rate_limit_ratio,
+            retry_after=args.retry_after, unthrottled=not args.throttled, relay_mode=args.relay_mode,
+            update_mode=args.update_mode, workers=args.workers, metrics=not args.no_metrics,
+            inline_db=args.inline_db, seed=args.seed
+        )
+        if args.mix:
+            scenario = dataclasses.replace(scenario, mix=args.mix)
+        scenarios = [scenario]
+
+    reports = [run_isolated(scenario) for scenario in scenarios]
+    if args.json:
+        print(json.dumps(reports, indent=2))
+    else:
+        for report in reports:
+            print(format_report(report))
@@ -1,25 +1,115 @@
+import atexit
+import json
 import logging
+import queue
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Dict, List, Optional, Tuple
 
-def setup_logger():
-    logging.basicConfig(
-        level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+import config
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+_listener: Optional[QueueListener] = None
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        return json.dumps({
+            'time': self.formatTime(record),
+            'level': record.levelname,
+            'logger': record.name,
+            'process': record.processName,
+            'message': record.getMessage()
+        }, ensure_ascii=False)
+
+class RateLimitFilter(logging.Filter):
+    def __init__(self, rate: float, burst: int):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[Tuple[str, int], List[float]] = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.rate:
+            return True
+
+        now = time.monotonic()
+        key = (record.pathname, record.lineno)
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = [self.burst, now, 0]
+
+            tokens, updated, suppressed = bucket
+            tokens = min(self.burst, tokens + (now - updated) * self.rate)
+            if tokens < 1:
+                bucket[:] = [tokens, now, suppressed + 1]
+                return False
+            bucket[:] = [tokens - 1, now, 0]
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} ({suppressed} similar messages suppressed)"
+            record.args = None
+        return True
+
+class DroppingQueueHandler(QueueHandler):
+    def __init__(self, log_queue: queue.Queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record: logging.LogRecord):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def _make_sinks(log_file: str) -> List[logging.Handler]:
+    settings = config.settings
+    formatter = JsonFormatter() if settings.log_format == "json" else logging.Formatter(FORMAT)
+
+    file_handler = RotatingFileHandler(
+        log_file,
+        maxBytes=settings.log_max_bytes,
+        backupCount=settings.log_backup_count,
+        encoding='utf-8'
     )
-    
-    logger = logging.getLogger(__name__)
-    
-    file_handler = logging.FileHandler('bot.log')
-    file_handler.setLevel(logging.INFO)
-    
     console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    
-    file_handler.setFormatter(formatter)
-    console_handler.setFormatter(formatter)
-    
-    logger.addHandler(file_handler)
-    logger.addHandler(console_handler)
-    
-    return logger
+
+    for handler in (file_handler, console_handler):
+        handler.setFormatter(formatter)
+    return [file_handler, console_handler]
+
+def stop_logger():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+def setup_logger(suffix: str = None):
+    global _listener
+    settings = config.settings
+    root = logging.getLogger()
+
+    if _listener is None:
+        log_file = settings.log_file
+        if suffix:
+            base, dot, extension = log_file.rpartition(".")
+            log_file = f"{base}.{suffix}.{extension}" if dot else f"{log_file}.{suffix}"
+
+        log_queue = queue.Queue(maxsize=settings.log_queue_size)
+        queue_handler = DroppingQueueHandler(log_queue)
+        queue_handler.addFilter(RateLimitFilter(settings.log_rate_limit, settings.log_rate_burst))
+
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.addHandler(queue_handler)
+        root.setLevel(settings.log_level)
+
+        _listener = QueueListener(log_queue, *_make_sinks(log_file), respect_handler_level=True)
+        _listener.start()
+        atexit.register(stop_logger)
+        config.add_reload_listener(lambda new_settings: root.setLevel(new_settings.log_level))
+
+    return logging.getLogger(__name__)
@@ -6,33 +6,87 @@ from telebot.async_telebot import AsyncTeleBot
 import config
 from database import db
 from handlers import common, admin, messaging
+from states import user_states
 from logger import setup_logger
+from utils import delivery, media_groups, metrics, outbound
+from utils.router import Router
+import sharding
+import webhook
 
-logger = setup_logger()
-
-bot = AsyncTeleBot(config.BOT_TOKEN)
+logger = logging.getLogger(__name__)
 
 if platform.system() == 'Windows':
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
 
-def register_all_handlers():
-    common.register_common_handlers(bot)
-    admin.register_admin_handlers(bot)
-    messaging.register_messaging_handlers(bot)
+def register_all_handlers(bot: AsyncTeleBot):
+    router = Router(
+        user_states.get_user_state, user_states.is_user_in_active_room, user_states.load_user_state
+    )
+    
+    common.register_common_handlers(bot, router)
+    admin.register_admin_handlers(bot, router)
+    messaging.register_messaging_handlers(bot, router)
     
+    router.install(bot)
     logger.info("All handlers registered")
 
+def create_bot() -> AsyncTeleBot:
+    bot = AsyncTeleBot(config.settings.bot_token)
+    register_all_handlers(bot)
+    return bot
+
 async def main():
+    config.install_reload_handler(asyncio.get_running_loop())
+    
+    if config.settings.worker_processes > 1:
+        db.init_db()
+        logger.info("Database initialized")
+        try:
+            await sharding.run_supervisor(create_bot, config.settings.worker_processes)
+        except Exception as e:
+            logger.error(f"Error in supervisor: {e}", exc_info=True)
+        finally:
+            db.close_db()
+        return
+
+    outbox_worker = None
+    search_backfill = None
+    metrics_server = None
     try:
         db.init_db()
         logger.info("Database initialized")
         
-        register_all_handlers()
+        if config.settings.metrics_port:
+            metrics_server = await metrics.start_metrics_server(
+                config.settings.metrics_host, config.settings.metrics_port
+            )
+        
+        bot = create_bot()
+        config.add_reload_listener(outbound.apply_settings)
+        
+        outbox_worker = asyncio.create_task(delivery.run_outbox_worker(bot))
+        search_backfill = asyncio.create_task(db.run_search_backfill())
         
-        logger.info("Bot started")
-        await bot.polling(non_stop=True, timeout=60)
+        logger.info(f"Bot started ({config.settings.update_mode})")
+        if config.settings.update_mode == "webhook":
+            await webhook.run_webhook(bot)
+        else:
+            await bot.delete_webhook()
+            await bot.polling(non_stop=True, timeout=config.settings.polling_timeout)
     except Exception as e:
         logger.error(f"Error starting bot: {e}", exc_info=True)
+    finally:
+        if outbox_worker:
+            outbox_worker.cancel()
+        if search_backfill:
+            search_backfill.cancel()
+        if metrics_server:
+            await metrics_server.cleanup()
+        await media_groups.buffer.close()
+        await db.flush_messages()
+        user_states.close()
+        db.close_db()
 
 if __name__ == "__main__":
+    setup_logger()
     asyncio.run(main())
\ No newline at end of file
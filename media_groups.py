@@ -0,0 +1,104 @@
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from telebot.types import (
+    InputMediaAudio, InputMediaDocument, InputMediaPhoto, InputMediaVideo, Message
+)
+
+import config
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+# Telegram never puts more than ten items in one album
+MAX_ALBUM_SIZE = 10
+
+INPUT_MEDIA = {
+    'photo': InputMediaPhoto,
+    'video': InputMediaVideo,
+    'document': InputMediaDocument,
+    'audio': InputMediaAudio
+}
+
+def media_item(message: Message, caption: Optional[str] = None) -> Dict[str, Any]:
+    ctype = message.content_type
+    if ctype == 'photo':
+        file_id = message.photo[-1].file_id
+    elif ctype in INPUT_MEDIA:
+        file_id = getattr(message, ctype).file_id
+    else:
+        raise ValueError(f"{ctype} cannot be part of a media group")
+
+    item = {'type': ctype, 'media': file_id}
+    caption = message.caption if caption is None else caption
+    if caption:
+        item['caption'] = caption
+    return item
+
+def build_album(messages: List[Message], sender_title: str) -> List[Dict[str, Any]]:
+    media = [media_item(message) for message in messages]
+    media[0]['caption'] = f"{sender_title}:\n{messages[0].caption or ''}"
+    return media
+
+def hydrate(media: List[Dict[str, Any]]) -> List[Any]:
+    return [
+        INPUT_MEDIA[item['type']](item['media'], caption=item.get('caption'))
+        for item in media
+    ]
+
+class MediaGroupBuffer:
+    def __init__(self, window_ms: int = 500):
+        self.window = window_ms / 1000
+
+        self._groups: Dict[Tuple[int, str], Dict[str, Any]] = {}
+        self._tasks = set()
+
+        self.albums = 0
+        self.items = 0
+
+    def __len__(self) -> int:
+        return len(self._groups)
+
+    def add(self, message: Message, on_complete: Callable[[List[Message]], Awaitable]) -> None:
+        key = (message.chat.id, message.media_group_id)
+        group = self._groups.get(key)
+        if group is None:
+            group = self._groups[key] = {'messages': [], 'on_complete': on_complete, 'timer': None}
+        else:
+            group['timer'].cancel()
+
+        group['messages'].append(message)
+        if len(group['messages']) >= MAX_ALBUM_SIZE:
+            self._spawn_flush(key)
+        else:
+            group['timer'] = asyncio.get_running_loop().call_later(self.window, self._spawn_flush, key)
+
+    def _spawn_flush(self, key: Tuple[int, str]) -> None:
+        task = asyncio.create_task(self.flush(key))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self, key: Tuple[int, str]) -> None:
+        group = self._groups.pop(key, None)
+        if group is None:
+            return
+        if group['timer'] is not None:
+            group['timer'].cancel()
+
+        messages = sorted(group['messages'], key=lambda message: message.message_id)
+        self.albums += 1
+        self.items += len(messages)
+        try:
+            await group['on_complete'](messages)
+        except Exception as e:
+            logger.error(f"Failed to relay media group {key[1]} from {key[0]}: {e}", exc_info=True)
+
+    async def close(self) -> None:
+        for key in list(self._groups):
+            self._spawn_flush(key)
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+buffer = MediaGroupBuffer(config.settings.media_group_window_ms)
+metrics.track_queue('media_groups', lambda: len(buffer))
@@ -1,76 +1,208 @@
+import asyncio
+import copy
 import logging
+from typing import Any, Dict, List, Optional, Tuple
 from telebot.async_telebot import AsyncTeleBot
-from telebot.types import Message
+from telebot.asyncio_helper import ApiTelegramException
+from telebot.types import Message, MessageEntity
 
 from database import db
 from states import user_states
-from utils import helpers
+from utils import delivery, helpers, media_groups, outbound
+from utils.fanout import fan_out
+from utils.router import Router
 import config
 
 logger = logging.getLogger(__name__)
 
-import logging
-from telebot.async_telebot import AsyncTeleBot
-from telebot.types import Message
-
-from database import db
-from states import user_states
-from utils import helpers
-import config
-
-logger = logging.getLogger(__name__)
-
-def register_messaging_handlers(bot: AsyncTeleBot):
-    @bot.message_handler(
-        func=lambda message: user_states.is_user_in_active_room(message.from_user.id) and message.content_type == 'text'
+def build_relay_call(message: Message, sender_title: str) -> Tuple[str, Dict[str, Any]]:
+    ctype = message.content_type
+    caption = f"{sender_title}:\n{message.caption or ''}"
+
+    if ctype == 'text':
+        return 'send_message', {'text': f"{sender_title}:\n{message.text}"}
+    elif ctype == 'photo':
+        return 'send_photo', {'photo': message.photo[-1].file_id, 'caption': caption}
+    elif ctype == 'video':
+        return 'send_video', {'video': message.video.file_id, 'caption': caption}
+    elif ctype == 'animation':
+        return 'send_animation', {'animation': message.animation.file_id, 'caption': caption}
+    elif ctype == 'audio':
+        return 'send_audio', {'audio': message.audio.file_id, 'caption': caption}
+    elif ctype == 'voice':
+        return 'send_voice', {'voice': message.voice.file_id, 'caption': f"{sender_title}:\n"}
+    elif ctype == 'document':
+        return 'send_document', {'document': message.document.file_id, 'caption': caption}
+    elif ctype == 'sticker':
+        return 'send_sticker', {'sticker': message.sticker.file_id}
+    elif ctype == 'video_note':
+        return 'send_video_note', {'data': message.video_note.file_id}
+    elif ctype == 'location':
+        return 'send_location', {
+            'latitude': message.location.latitude,
+            'longitude': message.location.longitude
+        }
+    elif ctype == 'contact':
+        return 'send_contact', {
+            'phone_number': message.contact.phone_number,
+            'first_name': message.contact.first_name,
+            'last_name': message.contact.last_name
+        }
+    elif ctype == 'venue':
+        return 'send_venue', {
+            'latitude': message.venue.location.latitude,
+            'longitude': message.venue.location.longitude,
+            'title': message.venue.title,
+            'address': message.venue.address
+        }
+    else:
+        return 'forward_message', {'from_chat_id': message.chat.id, 'message_id': message.message_id}
+
+CAPTIONED_TYPES = ('photo', 'video', 'animation', 'audio', 'voice', 'document')
+
+def _utf16_length(text: str) -> int:
+    return len(text.encode('utf-16-le')) // 2
+
+def _shift_entities(entities: List[MessageEntity], shift: int) -> List[MessageEntity]:
+    shifted = []
+    for entity in entities:
+        entity = copy.copy(entity)
+        entity.offset += shift
+        shifted.append(entity)
+    return shifted
+
+def build_copy_call(message: Message, sender_title: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+    if message.has_protected_content:
+        return None
+
+    header = f"{sender_title}:\n"
+    shift = _utf16_length(header)
+
+    if message.content_type == 'text':
+        kwargs = {'text': header + message.text}
+        if message.entities:
+            kwargs['entities'] = _shift_entities(message.entities, shift)
+        return 'send_message', kwargs
+
+    kwargs = {'from_chat_id': message.chat.id, 'message_id': message.message_id}
+    if message.content_type in CAPTIONED_TYPES:
+        kwargs['caption'] = header + (message.caption or '')
+        if message.caption_entities:
+            kwargs['caption_entities'] = _shift_entities(message.caption_entities, shift)
+        if message.show_caption_above_media:
+            kwargs['show_caption_above_media'] = True
+    return 'copy_message', kwargs
+
+async def deliver_to_members(bot: AsyncTeleBot, message: Message, method: str, kwargs: Dict[str, Any],
+                             other_members: List[Dict], label: str,
+                             fallback: Optional[Tuple[str, Dict[str, Any]]] = None):
+    # recipients whose first call was rejected, a retry of the rejected call would be rejected again
+    fell_back = set()
+
+    async def send(to_id: int):
+        try:
+            return await delivery.call_method(bot, method, to_id, kwargs)
+        except ApiTelegramException as e:
+            if fallback is None or e.error_code != 400:
+                raise
+            logger.warning(f"{method} отклонён для {label}, отправляю заново: {e.description}")
+            fell_back.add(to_id)
+            return await delivery.call_method(bot, fallback[0], to_id, fallback[1])
+
+    results = await fan_out([member['user_id'] for member in other_members], send)
+
+    failures = [result for result in results if not result['ok']]
+    for failure in failures:
+        logger.error(f"Не удалось отправить {label} участнику {failure['user_id']}: {failure['error']}")
+
+    if failures:
+        queued = await delivery.enqueue_failed(
+            message.chat.id, message.message_id, method, kwargs,
+            [failure for failure in failures if failure['user_id'] not in fell_back]
+        )
+        if fell_back:
+            queued += await delivery.enqueue_failed(
+                message.chat.id, message.message_id, *fallback,
+                [failure for failure in failures if failure['user_id'] in fell_back]
+            )
+        if queued:
+            logger.info(f"{queued} доставок поставлено в очередь на повторную отправку")
+
+async def relay_to_members(bot: AsyncTeleBot, message: Message, other_members: List[Dict], sender_title: str):
+    rebuilt = build_relay_call(message, sender_title)
+    copied = build_copy_call(message, sender_title) if config.settings.relay_mode == "copy" else None
+    if copied is None:
+        await deliver_to_members(bot, message, *rebuilt, other_members, message.content_type)
+    else:
+        await deliver_to_members(bot, message, *copied, other_members, message.content_type, fallback=rebuilt)
+
+async def relay_album(bot: AsyncTeleBot, room_id: int, album: List[Message]):
+    first = album[0]
+    user_id = first.from_user.id
+
+    captions = [message.caption for message in album if message.caption]
+    saved = asyncio.create_task(db.save_message(room_id, user_id, f"[ALBUM] {' '.join(captions)}"))
+
+    is_admin = helpers.is_admin(user_id)
+    room_role, other_members = await db.get_relay_context(room_id, user_id)
+    sender_title = helpers.get_sender_title(is_admin, "admin" if is_admin else room_role)
+
+    if not other_members:
+        await asyncio.gather(saved, outbound.send(bot.send_message, user_id, "В комнате нет других участников."))
+        return
+
+    media = media_groups.build_album(album, sender_title)
+    await asyncio.gather(
+        saved, deliver_to_members(bot, first, 'send_media_group', {'media': media}, other_members, "альбом")
     )
+
+def register_messaging_handlers(bot: AsyncTeleBot, router: Router):
+    @router.room('text')
     async def handle_text(message: Message):
         user_id = message.from_user.id
         room_id = user_states.get_active_room(user_id)
 
-        await db.save_message(room_id, user_id, message.text)
+        # with group durability the save waits for the batch commit, so it runs alongside the fan-out
+        saved = asyncio.create_task(db.save_message(room_id, user_id, message.text))
 
-        is_admin = helpers.is_admin(user_id)
-        room_role = await db.get_user_role_in_room(user_id, room_id)
-        sender_title = helpers.get_sender_title(is_admin, "admin" if is_admin else room_role)
+        try:
+            is_admin = helpers.is_admin(user_id)
+            room_role, other_members = await db.get_relay_context(room_id, user_id)
+            sender_title = helpers.get_sender_title(is_admin, "admin" if is_admin else room_role)
 
-        other_members = await db.get_other_room_members(room_id, user_id)
-        if not other_members:
-            await bot.send_message(user_id, "В комнате нет других участников.")
-            return
+            if not other_members:
+                await outbound.send(bot.send_message, user_id, "В комнате нет других участников.")
+                return
 
-        for member in other_members:
-            try:
-                await bot.send_message(member['user_id'], f"{sender_title}:\n{message.text}")
-            except Exception as e:
-                logger.error(f"Не удалось переслать текст участнику {member['user_id']}: {e}")
-
-    @bot.message_handler(
-        func=lambda m: user_states.is_user_in_active_room(m.from_user.id),
-        content_types=[
-            'text', 'photo', 'video', 'audio', 'voice', 'document',
-            'sticker', 'animation', 'video_note', 'location', 'contact', 'venue'
-        ]
+            await relay_to_members(bot, message, other_members, sender_title)
+        finally:
+            # the message is stored even when the relay fails
+            await saved
+
+    @router.room(
+        'photo', 'video', 'audio', 'voice', 'document',
+        'sticker', 'animation', 'video_note', 'location', 'contact', 'venue'
     )
     async def relay_room_message(message: Message):
         user_id = message.from_user.id
         room_id = user_states.get_active_room(user_id)
 
+        if message.media_group_id and message.content_type in media_groups.INPUT_MEDIA:
+            media_groups.buffer.add(message, lambda album: relay_album(bot, room_id, album))
+            return
+
         is_admin = helpers.is_admin(user_id)
-        room_role = await db.get_user_role_in_room(user_id, room_id)
+        room_role, other_members = await db.get_relay_context(room_id, user_id)
         sender_title = helpers.get_sender_title(
             is_admin, "admin" if is_admin else room_role
         )
 
-        other_members = await db.get_other_room_members(room_id, user_id)
         if not other_members:
-            await bot.send_message(user_id, "В комнате нет других участников.")
+            await outbound.send(bot.send_message, user_id, "В комнате нет других участников.")
             return
 
         ctype = message.content_type
-        if ctype == 'text':
-            db_text = message.text
-        elif ctype in ('photo', 'video', 'audio', 'voice', 'document', 'animation'):
+        if ctype in ('photo', 'video', 'audio', 'voice', 'document', 'animation'):
             caption = message.caption or ''
             db_text = f"[{ctype.upper()}] {caption}"
         elif ctype == 'sticker':
@@ -82,56 +214,12 @@ def register_messaging_handlers(bot: AsyncTeleBot):
         else:
             db_text = f"[{ctype.upper()}]"
 
-        await db.save_message(room_id, user_id, db_text)
-
-        for member in other_members:
-            to_id = member['user_id']
-            try:
-                if ctype == 'text':
-                    await bot.send_message(to_id, f"{sender_title}:\n{message.text}")
-                elif ctype == 'photo':
-                    file_id = message.photo[-1].file_id
-                    await bot.send_photo(to_id, file_id, caption=f"{sender_title}:\n{message.caption or ''}")
-                elif ctype == 'video':
-                    await bot.send_video(to_id, message.video.file_id,
-                                        caption=f"{sender_title}:\n{message.caption or ''}")
-                elif ctype == 'animation':
-                    await bot.send_animation(to_id, message.animation.file_id,
-                                            caption=f"{sender_title}:\n{message.caption or ''}")
-                elif ctype == 'audio':
-                    await bot.send_audio(to_id, message.audio.file_id,
-                                        caption=f"{sender_title}:\n{message.caption or ''}")
-                elif ctype == 'voice':
-                    await bot.send_voice(to_id, message.voice.file_id,
-                                        caption=f"{sender_title}:\n")
-                elif ctype == 'document':
-                    await bot.send_document(to_id, message.document.file_id,
-                                           caption=f"{sender_title}:\n{message.caption or ''}")
-                elif ctype == 'sticker':
-                    await bot.send_sticker(to_id, message.sticker.file_id)
-                elif ctype == 'video_note':
-                    await bot.send_video_note(to_id, message.video_note.file_id)
-                elif ctype == 'location':
-                    await bot.send_location(to_id,
-                                            latitude=message.location.latitude,
-                                            longitude=message.location.longitude)
-                elif ctype == 'contact':
-                    await bot.send_contact(to_id,
-                                          phone_number=message.contact.phone_number,
-                                          first_name=message.contact.first_name,
-                                          last_name=message.contact.last_name)
-                elif ctype == 'venue':
-                    await bot.send_venue(to_id,
-                                        latitude=message.venue.location.latitude,
-                                        longitude=message.venue.location.longitude,
-                                        title=message.venue.title,
-                                        address=message.venue.address)
-                else:
-                    await bot.forward_message(to_id, user_id, message.message_id)
-            except Exception as e:
-                logger.error(f"Не удалось отправить {ctype} участнику {to_id}: {e}")
+        await asyncio.gather(
+            db.save_message(room_id, user_id, db_text),
+            relay_to_members(bot, message, other_members, sender_title)
+        )
     
-    @bot.message_handler(func=lambda message: True)
+    @router.fallback('text')
     async def default_handler(message: Message):
         user_id = message.from_user.id
 
@@ -143,8 +231,9 @@ def register_messaging_handlers(bot: AsyncTeleBot):
             ]
             markup = helpers.get_main_menu_markup(user_id)
 
-            await bot.send_message(
+            await outbound.send(
+                bot.send_message,
                 user_id,
                 "Доступные команды:\n" + "\n".join(commands),
                 reply_markup=markup
-            )
\ No newline at end of file
+            )
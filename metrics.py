@@ -0,0 +1,195 @@
+import logging
+from bisect import bisect_left
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from aiohttp import web
+
+import config
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(names: Sequence[str], values: Tuple, extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+# metrics are recorded and rendered on the event loop thread of their process, so they take no locks
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, registry: "Registry", name: str, help: str, labels: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values: Dict[Tuple, float] = {}
+
+    def inc(self, *label_values, amount: float = 1) -> None:
+        if not self.registry.enabled:
+            return
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self) -> List[str]:
+        values = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values]
+
+class HistogramSeries:
+    __slots__ = ('registry', 'buckets', 'counts', 'total', 'count')
+
+    def __init__(self, registry: "Registry", buckets: Tuple[float, ...]):
+        self.registry = registry
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        if not self.registry.enabled:
+            return
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, registry: "Registry", name: str, help: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[Tuple, HistogramSeries] = {}
+
+    def series(self, *label_values) -> HistogramSeries:
+        # hot paths bind their series once instead of looking the labels up on every observation
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = HistogramSeries(self.registry, self.buckets)
+        return series
+
+    def observe(self, value: float, *label_values) -> None:
+        if not self.registry.enabled:
+            return
+        self.series(*label_values).observe(value)
+
+    def counts(self) -> Dict[Tuple, int]:
+        return {key: series.count for key, series in self._series.items()}
+
+    def samples(self) -> List[str]:
+        series = [
+            (key, list(series.counts), series.total, series.count)
+            for key, series in list(self._series.items()) if series.count
+        ]
+
+        lines = []
+        for key, counts, total, count in series:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+class Gauge:
+    kind = 'gauge'
+
+    def __init__(self, registry: "Registry", name: str, help: str, collect: Callable[[], object],
+                 labels: Sequence[str] = ()):
+        self.registry = registry
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def samples(self) -> List[str]:
+        values = self.collect()
+        if not isinstance(values, dict):
+            values = {(): values}
+        return [
+            f"{self.name}{_format_labels(self.labels, key if isinstance(key, tuple) else (key,))} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+class Registry:
+    def __init__(self, enabled: bool = True):
+        self.enabled = enabled
+        self._metrics: Dict[str, object] = {}
+
+    def _add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(self, name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._add(Histogram(self, name, help, labels, buckets))
+
+    def gauge(self, name: str, help: str, collect: Callable[[], object], labels: Sequence[str] = ()) -> Gauge:
+        return self._add(Gauge(self, name, help, collect, labels))
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            try:
+                samples = metric.samples()
+            except Exception as e:
+                samples = []
+                lines.append(f"# {metric.name} collection failed: {e}")
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(samples)
+        return "\n".join(lines) + "\n"
+
+registry = Registry(config.settings.metrics_enabled)
+
+_caches: Dict[str, Callable[[], Dict]] = {}
+_queues: Dict[str, Callable[[], int]] = {}
+
+def track_cache(name: str, stats: Callable[[], Dict]) -> None:
+    _caches[name] = stats
+
+def track_queue(name: str, depth: Callable[[], int]) -> None:
+    _queues[name] = depth
+
+registry.gauge('cache_hit_ratio', 'Share of cache lookups served from memory',
+               lambda: {name: stats()['hit_rate'] for name, stats in _caches.items()}, ('cache',))
+registry.gauge('cache_entries', 'Entries currently held by each cache',
+               lambda: {name: stats()['size'] for name, stats in _caches.items()}, ('cache',))
+registry.gauge('queue_depth', 'Items waiting in each internal queue',
+               lambda: {name: depth() for name, depth in _queues.items()}, ('queue',))
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type='text/plain', charset='utf-8')
+
+async def start_metrics_server(host: str, port: int) -> Optional[web.AppRunner]:
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        logger.error(f"Metrics endpoint disabled, cannot listen on {host}:{port}: {e}")
+        await runner.cleanup()
+        return None
+    return runner
@@ -0,0 +1,164 @@
+import sqlite3
+import logging
+from typing import List, Tuple
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS: List[Tuple[int, str, List[str]]] = [
+    (1, "initial schema", [
+        '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            role TEXT,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS rooms (
+            room_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS room_members (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id INTEGER,
+            user_id INTEGER,
+            role TEXT,
+            FOREIGN KEY (room_id) REFERENCES rooms (room_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id),
+            UNIQUE(room_id, user_id)
+        )
+        ''',
+        '''
+        CREATE TABLE IF NOT EXISTS messages (
+            message_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            room_id INTEGER,
+            user_id INTEGER,
+            text TEXT,
+            sent_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (room_id) REFERENCES rooms (room_id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        ''',
+    ]),
+    (2, "covering indexes for membership and message history", [
+        "CREATE INDEX IF NOT EXISTS idx_room_members_user ON room_members (user_id, room_id, role)",
+        "CREATE INDEX IF NOT EXISTS idx_room_members_room ON room_members (room_id, user_id, role)",
+        "CREATE INDEX IF NOT EXISTS idx_messages_room_sent ON messages (room_id, sent_at)",
+    ]),
+    (3, "outbox for failed relay deliveries", [
+        '''
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            source_chat_id INTEGER NOT NULL,
+            source_message_id INTEGER NOT NULL,
+            recipient_id INTEGER NOT NULL,
+            method TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            next_attempt_at REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            UNIQUE(source_chat_id, source_message_id, recipient_id)
+        )
+        ''',
+        "CREATE INDEX IF NOT EXISTS idx_outbox_due ON outbox (next_attempt_at)",
+    ]),
+    (4, "persistent user states", [
+        '''
+        CREATE TABLE IF NOT EXISTS user_states (
+            user_id INTEGER PRIMARY KEY,
+            state TEXT,
+            active_room INTEGER,
+            temp_data TEXT,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        ''',
+    ]),
+    (5, "full-text search over messages", [
+        '''
+        CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+            text,
+            room,
+            content='',
+            tokenize='unicode61 remove_diacritics 2'
+        )
+        ''',
+        # rows up to pending_max_id predate the index and are indexed by the background backfill
+        '''
+        CREATE TABLE IF NOT EXISTS search_backfill (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            pending_max_id INTEGER NOT NULL
+        )
+        ''',
+        "INSERT OR IGNORE INTO search_backfill (id, pending_max_id) SELECT 1, COALESCE(MAX(message_id), 0) FROM messages",
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_insert AFTER INSERT ON messages
+        BEGIN
+            INSERT INTO messages_fts (rowid, text, room) VALUES (new.message_id, new.text, 'r' || new.room_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_delete AFTER DELETE ON messages
+        WHEN old.message_id > (SELECT pending_max_id FROM search_backfill)
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, text, room)
+            VALUES ('delete', old.message_id, old.text, 'r' || old.room_id);
+        END
+        ''',
+        '''
+        CREATE TRIGGER IF NOT EXISTS messages_fts_update AFTER UPDATE OF text, room_id ON messages
+        WHEN old.message_id > (SELECT pending_max_id FROM search_backfill)
+        BEGIN
+            INSERT INTO messages_fts (messages_fts, rowid, text, room)
+            VALUES ('delete', old.message_id, old.text, 'r' || old.room_id);
+            INSERT INTO messages_fts (rowid, text, room) VALUES (new.message_id, new.text, 'r' || new.room_id);
+        END
+        ''',
+    ]),
+    (6, "keyset index for paged room history", [
+        "CREATE INDEX IF NOT EXISTS idx_messages_room_id ON messages (room_id, message_id)",
+    ]),
+]
+
+def get_schema_version(conn: sqlite3.Connection) -> int:
+    row = conn.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+def migrate(conn: sqlite3.Connection) -> int:
+    conn.execute('''
+    CREATE TABLE IF NOT EXISTS schema_version (
+        version INTEGER PRIMARY KEY,
+        description TEXT,
+        applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    ''')
+    conn.commit()
+
+    current = get_schema_version(conn)
+
+    for version, description, statements in MIGRATIONS:
+        if version <= current:
+            continue
+
+        logger.info(f"Applying migration {version}: {description}")
+        try:
+            conn.execute("BEGIN")
+            for statement in statements:
+                conn.execute(statement)
+            conn.execute(
+                "INSERT INTO schema_version (version, description) VALUES (?, ?)",
+                (version, description)
+            )
+            conn.commit()
+        except sqlite3.Error:
+            conn.rollback()
+            logger.error(f"Migration {version} failed", exc_info=True)
+            raise
+
+        current = version
+
+    return current
@@ -0,0 +1,303 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from telebot.asyncio_helper import ApiTelegramException
+
+import config
+from utils import metrics
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = 0
+BULK = 1
+
+_send_seconds = metrics.registry.histogram('telegram_send_seconds', 'Bot API call latency per attempt', ('method',))
+_send_errors = metrics.registry.counter('telegram_send_errors_total', 'Failed Bot API calls', ('method', 'error'))
+_queue_wait = metrics.registry.histogram('outbound_queue_wait_seconds', 'Time sends spend waiting for a rate slot')
+
+class SendTimeout(TimeoutError):
+    def __init__(self, message: str, dispatched: bool):
+        super().__init__(message)
+        # a dispatched request may still reach the chat after the caller stopped waiting
+        self.dispatched = dispatched
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def _refill(self) -> float:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return now
+
+    def reserve(self) -> float:
+        now = self._refill()
+        self.tokens -= 1
+
+        wait = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def wait(self) -> float:
+        now = self._refill()
+        wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        return max(wait, self.blocked_until - now)
+
+    def take(self) -> None:
+        self._refill()
+        self.tokens -= 1
+
+    def refund(self) -> None:
+        self.tokens = min(self.capacity, self.tokens + 1)
+
+    def block(self, seconds: float) -> None:
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+class _PendingSend:
+    __slots__ = ('priority', 'seq', 'enqueued_at', 'chat_id', 'method', 'args', 'kwargs', 'future', 'attempt')
+
+    def __init__(self, priority: int, seq: int, chat_id: int, method: Callable[..., Awaitable],
+                 args: tuple, kwargs: Dict[str, Any], future: asyncio.Future):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.attempt = 0
+
+    def __lt__(self, other: "_PendingSend") -> bool:
+        return (self.priority, self.seq) < (other.priority, other.seq)
+
+class SendScheduler:
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: float,
+                 max_retries: int = 3, max_queue: int = 0, max_chats: int = 10000):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.max_queue = max_queue
+        self.max_chats = max_chats
+
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats: "OrderedDict[int, TokenBucket]" = OrderedDict()
+        # pending sends per chat, highest priority first; a send takes its tokens only when it goes out
+        self._lanes: Dict[int, List[_PendingSend]] = {}
+        self._grants: List[tuple] = []
+        self._wakeup = None
+        self._slots = None
+        self._seq = itertools.count()
+        self._dispatcher = None
+        self._tasks = set()
+        self._calling = set()
+
+        self.submitted = 0
+        self.sent = 0
+        self.failed = 0
+        self.throttled = 0
+        self.queued = 0
+        self.in_flight = 0
+        self.last_queue_wait = 0.0
+        self.max_queue_wait = 0.0
+
+    def set_global_rate(self, rate: float) -> None:
+        self._global = TokenBucket(rate, rate)
+
+    def _ensure_started(self) -> None:
+        if self._dispatcher is None or self._dispatcher.done():
+            if self._wakeup is None:
+                self._wakeup = asyncio.Event()
+                if self.max_queue:
+                    self._slots = asyncio.Semaphore(self.max_queue)
+            self._dispatcher = asyncio.create_task(self._dispatch())
+
+    def _chat_bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._chats[chat_id] = bucket
+            if len(self._chats) > self.max_chats:
+                self._chats.popitem(last=False)
+        else:
+            self._chats.move_to_end(chat_id)
+        return bucket
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    def _enqueue(self, pending: _PendingSend) -> None:
+        self.queued += 1
+        lane = self._lanes.get(pending.chat_id)
+        if lane is not None:
+            heapq.heappush(lane, pending)
+            return
+
+        lane = self._lanes[pending.chat_id] = [pending]
+        self._spawn(self._run_chat(pending.chat_id, lane))
+
+    async def send(self, method: Callable[..., Awaitable], chat_id: int, *args,
+                   priority: int = INTERACTIVE, send_timeout: Optional[float] = None, **kwargs) -> Any:
+        self._ensure_started()
+        if self._slots is not None:
+            await self._slots.acquire()
+
+        future = asyncio.get_running_loop().create_future()
+        self.submitted += 1
+        self._enqueue(_PendingSend(priority, next(self._seq), chat_id, method, args, kwargs, future))
+        if send_timeout is None:
+            return await future
+
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), send_timeout)
+        except asyncio.TimeoutError:
+            if future in self._calling:
+                future.add_done_callback(_discard_result)
+                raise SendTimeout(f"no response after {send_timeout}s, the request was sent", True) from None
+            # a withdrawn send is skipped by its chat lane without taking a token
+            future.cancel()
+            raise SendTimeout(f"not sent within {send_timeout}s", False) from None
+
+    def _take(self, lane: List[_PendingSend]) -> _PendingSend:
+        pending = heapq.heappop(lane)
+        self.queued -= 1
+        if pending.attempt == 0 and self._slots is not None:
+            self._slots.release()
+        return pending
+
+    async def _run_chat(self, chat_id: int, lane: List[_PendingSend]) -> None:
+        try:
+            while lane:
+                if lane[0].future.done():
+                    self._take(lane)
+                    continue
+
+                wait = self._chat_bucket(chat_id).wait()
+                if wait > 0:
+                    # a higher priority send may join the lane meanwhile, so the head is picked after the wait
+                    await asyncio.sleep(wait)
+                    continue
+
+                pending = self._take(lane)
+                await self._acquire_global(pending.priority)
+                if pending.future.done():
+                    self._global.refund()
+                    continue
+
+                self._chat_bucket(chat_id).take()
+                if pending.attempt == 0:
+                    self.last_queue_wait = time.monotonic() - pending.enqueued_at
+                    _queue_wait.observe(self.last_queue_wait)
+                    self.max_queue_wait = max(self.max_queue_wait, self.last_queue_wait)
+                self._spawn(self._deliver(pending))
+        finally:
+            del self._lanes[chat_id]
+
+    async def _acquire_global(self, priority: int) -> None:
+        grant = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._grants, (priority, next(self._seq), grant))
+        self._wakeup.set()
+        await grant
+
+    async def _dispatch(self) -> None:
+        # hands out global tokens to the chat lanes, highest priority first
+        while True:
+            if not self._grants:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+
+            _, _, grant = heapq.heappop(self._grants)
+            if grant.done():
+                continue
+
+            wait = self._global.reserve()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            if grant.done():
+                self._global.refund()
+                continue
+            grant.set_result(None)
+
+    async def _deliver(self, pending: _PendingSend) -> None:
+        method, chat_id, future = pending.method, pending.chat_id, pending.future
+        self.in_flight += 1
+        started = time.perf_counter()
+        self._calling.add(future)
+        try:
+            result = await method(chat_id, *pending.args, **pending.kwargs)
+        except ApiTelegramException as e:
+            _send_errors.inc(method.__name__, e.error_code)
+            if e.error_code == 429 and pending.attempt < self.max_retries:
+                retry_after = (e.result_json.get('parameters') or {}).get('retry_after', 1)
+                self.throttled += 1
+                self._chat_bucket(chat_id).block(retry_after)
+                logger.warning(f"Rate limited by Telegram for chat {chat_id}, retrying in {retry_after}s")
+                # the retry waits for fresh chat and global tokens like any other send
+                pending.attempt += 1
+                self._enqueue(pending)
+            else:
+                self._fail(future, e)
+        except Exception as e:
+            _send_errors.inc(method.__name__, type(e).__name__)
+            self._fail(future, e)
+        else:
+            self.sent += 1
+            if not future.done():
+                future.set_result(result)
+        finally:
+            self._calling.discard(future)
+            _send_seconds.observe(time.perf_counter() - started, method.__name__)
+            self.in_flight -= 1
+
+    def _fail(self, future: asyncio.Future, error: Exception) -> None:
+        self.failed += 1
+        if not future.done():
+            future.set_exception(error)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'queue_depth': self.queued,
+            'in_flight': self.in_flight,
+            'submitted': self.submitted,
+            'sent': self.sent,
+            'failed': self.failed,
+            'throttled': self.throttled,
+            'last_queue_wait': self.last_queue_wait,
+            'max_queue_wait': self.max_queue_wait,
+            'tracked_chats': len(self._chats)
+        }
+
+def _discard_result(future: asyncio.Future) -> None:
+    if not future.cancelled():
+        future.exception()
+
+scheduler = SendScheduler(
+    global_rate=config.settings.outbound_global_rate,
+    chat_rate=config.settings.outbound_chat_rate,
+    chat_burst=config.settings.outbound_chat_burst,
+    max_retries=config.settings.outbound_max_retries,
+    max_queue=config.settings.outbound_max_queue
+)
+metrics.track_queue('outbound', lambda: scheduler.stats()['queue_depth'])
+
+def apply_settings(settings: config.Settings, share: int = 1) -> None:
+    scheduler.set_global_rate(settings.outbound_global_rate / share)
+    scheduler.chat_rate = settings.outbound_chat_rate
+    scheduler.chat_burst = settings.outbound_chat_burst
+    scheduler.max_retries = settings.outbound_max_retries
+
+async def send(method: Callable[..., Awaitable], chat_id: int, *args,
+               priority: int = INTERACTIVE, send_timeout: Optional[float] = None, **kwargs) -> Any:
+    return await scheduler.send(method, chat_id, *args, priority=priority, send_timeout=send_timeout, **kwargs)
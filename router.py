@@ -0,0 +1,123 @@
+import logging
+import time
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from telebot import util
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import CallbackQuery, Message
+
+from utils import callback_codec, metrics
+
+logger = logging.getLogger(__name__)
+
+Handler = Callable[..., Awaitable]
+
+_handler_seconds = metrics.registry.histogram('handler_seconds', 'Update handler latency', ('handler',))
+_handler_errors = metrics.registry.counter(
+    'handler_errors_total', 'Handlers that raised, by update content type', ('content_type',)
+)
+_unhandled = metrics.registry.counter('updates_unhandled_total', 'Updates no route matched', ('content_type',))
+
+async def _run(handler: Handler, seconds: metrics.HistogramSeries, content_type: str, *args):
+    started = time.perf_counter()
+    try:
+        await handler(*args)
+    except Exception:
+        _handler_errors.inc(content_type)
+        raise
+    finally:
+        seconds.observe(time.perf_counter() - started)
+
+class Router:
+    def __init__(self, get_state: Callable[[int], str], in_room: Callable[[int], bool],
+                 load_state: Optional[Callable[[int], Awaitable]] = None):
+        self.get_state = get_state
+        self.in_room = in_room
+        self.load_state = load_state
+
+        self.commands: Dict[str, Handler] = {}
+        self.states: Dict[str, Handler] = {}
+        self.room_handlers: Dict[str, Handler] = {}
+        self.fallbacks: Dict[str, Handler] = {}
+        self.actions: Dict[int, Handler] = {}
+        self._timers: Dict[Handler, metrics.HistogramSeries] = {}
+
+    def _register(self, table: Dict[Hashable, Handler], *keys: Hashable):
+        def decorator(handler: Handler) -> Handler:
+            for key in keys:
+                if key in table:
+                    raise ValueError(f"Route {key!r} is already registered to {table[key].__name__}")
+                table[key] = handler
+            if handler not in self._timers:
+                self._timers[handler] = _handler_seconds.series(handler.__name__)
+            return handler
+        return decorator
+
+    def command(self, *commands: str):
+        return self._register(self.commands, *commands)
+
+    def state(self, *states: str):
+        return self._register(self.states, *states)
+
+    def room(self, *content_types: str):
+        return self._register(self.room_handlers, *content_types)
+
+    def fallback(self, *content_types: str):
+        return self._register(self.fallbacks, *content_types)
+
+    def action(self, *actions: int):
+        return self._register(self.actions, *actions)
+
+    def resolve_message(self, message: Message) -> Optional[Handler]:
+        content_type = message.content_type
+
+        if content_type == 'text' and message.text.startswith('/'):
+            command = message.text.split(maxsplit=1)[0][1:].split('@')[0]
+            handler = self.commands.get(command)
+            if handler:
+                return handler
+
+        user_id = message.from_user.id
+        if content_type == 'text':
+            handler = self.states.get(self.get_state(user_id))
+            if handler:
+                return handler
+
+        if content_type in self.room_handlers and self.in_room(user_id):
+            return self.room_handlers[content_type]
+
+        return self.fallbacks.get(content_type)
+
+    def resolve_callback(self, data: str) -> Tuple[Optional[Handler], Tuple[int, ...]]:
+        action, args = callback_codec.decode(data)
+        return self.actions.get(action), args
+
+    async def dispatch_message(self, message: Message):
+        # resolving and the handlers read the state synchronously, so it has to be cached before they run
+        if self.load_state:
+            await self.load_state(message.from_user.id)
+        handler = self.resolve_message(message)
+        if handler:
+            await _run(handler, self._timers[handler], message.content_type, message)
+        else:
+            _unhandled.inc(message.content_type)
+
+    async def dispatch_callback(self, call: CallbackQuery):
+        try:
+            handler, args = self.resolve_callback(call.data or "")
+        except callback_codec.CallbackDataError as e:
+            _unhandled.inc('callback_query')
+            logger.warning(f"Rejected callback data {call.data!r}: {e}")
+            return
+
+        if handler:
+            if self.load_state:
+                await self.load_state(call.from_user.id)
+            await _run(handler, self._timers[handler], 'callback_query', call, *args)
+        else:
+            _unhandled.inc('callback_query')
+            logger.warning(f"No handler for callback data {call.data!r}")
+
+    def install(self, bot: AsyncTeleBot):
+        bot.register_message_handler(self.dispatch_message, content_types=util.content_type_media)
+        bot.register_callback_query_handler(self.dispatch_callback, func=lambda call: True)
@@ -0,0 +1,102 @@
+import re
+import sqlite3
+import unicodedata
+from typing import Any, Dict, List, Optional, Tuple
+
+TERM = re.compile(r"\w+")
+COMBINING = re.compile(r"[\u0300-\u036f]")
+
+# bm25 parameters, applied to the candidate window in python
+K1 = 1.2
+B = 0.75
+
+def room_token(room_id: int) -> str:
+    return f"r{room_id}"
+
+def _folded_terms(text: str) -> List[str]:
+    return TERM.findall(COMBINING.sub("", unicodedata.normalize('NFKD', text.lower())))
+
+def build_match(room_id: int, query: str) -> Optional[str]:
+    terms = TERM.findall(query.lower())
+    if not terms:
+        return None
+    phrases = " ".join(f'"{term}"' for term in terms)
+    return f'room : "{room_token(room_id)}" AND text : ({phrases})'
+
+def _rank(candidates: List[Dict[str, Any]], query_terms: List[str]) -> List[Dict[str, Any]]:
+    # every candidate contains every query term, so idf is the same for all of them and only tf and length matter
+    documents = [_folded_terms(candidate['text'] or '') for candidate in candidates]
+    average = sum(len(words) for words in documents) / len(documents) or 1
+    wanted = set(query_terms)
+
+    scored = []
+    for candidate, words in zip(candidates, documents):
+        norm = K1 * (1 - B + B * len(words) / average)
+        score = 0.0
+        for term in wanted:
+            frequency = words.count(term)
+            score += frequency * (K1 + 1) / (frequency + norm)
+        scored.append((score, candidate['message_id'], candidate))
+
+    scored.sort(key=lambda item: (item[0], item[1]), reverse=True)
+    return [candidate for _, _, candidate in scored]
+
+def search_messages(conn: sqlite3.Connection, room_id: int, query: str, limit: int = 10,
+                    cursor: Optional[Tuple[int, int]] = None, candidates: int = 1000) -> Dict[str, Any]:
+    match = build_match(room_id, query)
+    if match is None:
+        return {'messages': [], 'cursor': None}
+
+    if cursor is None:
+        snapshot = conn.execute("SELECT COALESCE(MAX(message_id), 0) FROM messages").fetchone()[0]
+        offset = 0
+    else:
+        snapshot, offset = cursor
+
+    # only the newest matches are ranked: fts5 walks the doclists backwards by rowid and stops at the limit.
+    # bm25() is not used because it counts every row of every phrase, including the room token, for idf
+    rows = conn.execute("""
+        SELECT m.message_id, m.user_id, u.username, m.text, m.sent_at
+        FROM (
+            SELECT rowid
+            FROM messages_fts
+            WHERE messages_fts MATCH ? AND rowid <= ?
+            ORDER BY rowid DESC
+            LIMIT ?
+        ) AS hits
+        JOIN messages m ON m.message_id = hits.rowid
+        LEFT JOIN users u ON u.user_id = m.user_id
+    """, (match, snapshot, candidates)).fetchall()
+    if not rows:
+        return {'messages': [], 'cursor': None}
+
+    ranked = _rank([dict(row) for row in rows], _folded_terms(query))
+    return {
+        'messages': ranked[offset:offset + limit],
+        'cursor': (snapshot, offset + limit) if offset + limit < len(ranked) else None
+    }
+
+def backfill(conn: sqlite3.Connection, batch_size: int) -> int:
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        pending = conn.execute("SELECT pending_max_id FROM search_backfill").fetchone()[0]
+        if not pending:
+            conn.rollback()
+            return 0
+
+        rows = conn.execute(
+            "SELECT message_id, text, room_id FROM messages WHERE message_id <= ? ORDER BY message_id DESC LIMIT ?",
+            (pending, batch_size)
+        ).fetchall()
+        conn.executemany(
+            "INSERT INTO messages_fts (rowid, text, room) VALUES (?, ?, ?)",
+            [(row['message_id'], row['text'], room_token(row['room_id'])) for row in rows]
+        )
+
+        pending = rows[-1]['message_id'] - 1 if len(rows) == batch_size else 0
+        conn.execute("UPDATE search_backfill SET pending_max_id = ?", (pending,))
+        conn.commit()
+    except sqlite3.Error:
+        conn.rollback()
+        raise
+    return len(rows)
@@ -0,0 +1,190 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from typing import Callable, Dict, List, Optional
+
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Update
+
+import config
+from database import db
+from states import user_states
+from utils import delivery, media_groups, metrics, outbound
+from utils.keyed import KeyedRunner
+
+logger = logging.getLogger(__name__)
+
+MSG_UPDATE = 'update'
+MSG_INVALIDATE_ROOM = 'invalidate_room'
+MSG_INVALIDATE_USER = 'invalidate_user'
+MSG_STOP = 'stop'
+
+def update_user_id(raw: Dict) -> Optional[int]:
+    for field in ('message', 'edited_message', 'callback_query'):
+        event = raw.get(field)
+        if event and event.get('from'):
+            return event['from']['id']
+    return None
+
+def shard_index(key: int, workers: int) -> int:
+    return (key >> 1) % workers
+
+def routing_key(raw: Dict, active_rooms: Dict[int, int]) -> int:
+    user_id = update_user_id(raw)
+    if user_id is None:
+        return raw['update_id'] * 2
+
+    room_id = active_rooms.get(user_id)
+    if room_id is not None:
+        return room_id * 2 + 1
+    return user_id * 2
+
+async def _process_update(bot: AsyncTeleBot, update: Update):
+    try:
+        await bot.process_new_updates([update])
+    except Exception as e:
+        logger.error(f"Error processing update {update.update_id}: {e}", exc_info=True)
+    finally:
+        # the supervisor routes the next update of this user by the persisted state
+        await user_states.store.wait_for_writes()
+
+async def _run_worker(index: int, workers: int, create_bot: Callable[[], AsyncTeleBot],
+                      inbox: multiprocessing.Queue, events: multiprocessing.Queue):
+    db.init_db()
+    db.add_change_listener(lambda room_id: events.put((index, MSG_INVALIDATE_ROOM, room_id)))
+    user_states.store.listeners.append(lambda user_id: events.put((index, MSG_INVALIDATE_USER, user_id)))
+    outbound.apply_settings(config.settings, workers)
+    config.add_reload_listener(lambda settings: outbound.apply_settings(settings, workers))
+    config.install_reload_handler(asyncio.get_running_loop())
+
+    bot = create_bot()
+    # updates run concurrently like in polling mode, only those sharing a routing key are serialised
+    updates = KeyedRunner(lambda update: _process_update(bot, update))
+    metrics.track_queue('worker_updates', lambda: updates.pending)
+    outbox_worker = asyncio.create_task(delivery.run_outbox_worker(bot)) if index == 0 else None
+    search_backfill = asyncio.create_task(db.run_search_backfill()) if index == 0 else None
+    metrics_server = None
+    if config.settings.metrics_port:
+        metrics_server = await metrics.start_metrics_server(
+            config.settings.metrics_host, config.settings.metrics_port + index
+        )
+
+    logger.info(f"Worker {index} started")
+    loop = asyncio.get_running_loop()
+    try:
+        while True:
+            kind, key, payload = await loop.run_in_executor(None, inbox.get)
+            if kind == MSG_STOP:
+                break
+            elif kind == MSG_UPDATE:
+                updates.submit(key, Update.de_json(payload))
+            elif kind == MSG_INVALIDATE_ROOM:
+                db.invalidate_room(key)
+            elif kind == MSG_INVALIDATE_USER:
+                user_states.store.invalidate(key)
+    finally:
+        await updates.join()
+        if outbox_worker:
+            outbox_worker.cancel()
+        if search_backfill:
+            search_backfill.cancel()
+        if metrics_server:
+            await metrics_server.cleanup()
+        await media_groups.buffer.close()
+        await db.flush_messages()
+        if asyncio_helper.session_manager.session is not None:
+            await bot.close_session()
+        user_states.close()
+        db.close_db()
+        logger.info(f"Worker {index} stopped")
+
+def worker_main(index: int, workers: int, create_bot: Callable[[], AsyncTeleBot],
+                inbox: multiprocessing.Queue, events: multiprocessing.Queue):
+    from logger import setup_logger, stop_logger
+    setup_logger(f"worker-{index}")
+    try:
+        asyncio.run(_run_worker(index, workers, create_bot, inbox, events))
+    finally:
+        stop_logger()
+
+def _relay_events(events: multiprocessing.Queue, inboxes: List[multiprocessing.Queue]):
+    while True:
+        event = events.get()
+        if event is None:
+            return
+        origin, kind, key = event
+        for index, inbox in enumerate(inboxes):
+            if index != origin:
+                inbox.put((kind, key, None))
+
+async def run_supervisor(create_bot: Callable[[], AsyncTeleBot], workers: int):
+    if config.settings.state_backend != 'sqlite':
+        # updates are routed by the active room the workers persist, the memory backend is invisible here
+        raise ValueError("Worker processes require state_backend=sqlite")
+
+    context = multiprocessing.get_context('spawn')
+    events = context.Queue()
+    inboxes = [context.Queue() for _ in range(workers)]
+
+    def spawn(index: int):
+        process = context.Process(
+            target=worker_main,
+            args=(index, workers, create_bot, inboxes[index], events),
+            name=f"bot-worker-{index}",
+            daemon=True
+        )
+        process.start()
+        return process
+
+    processes = [spawn(index) for index in range(workers)]
+
+    def forward_reload(settings: config.Settings):
+        for process in processes:
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGHUP)
+
+    if hasattr(signal, 'SIGHUP'):
+        config.add_reload_listener(forward_reload)
+    relay = threading.Thread(target=_relay_events, args=(events, inboxes), name="shard-events", daemon=True)
+    relay.start()
+
+    offset = None
+
+    logger.info(f"Supervisor started with {workers} workers")
+    try:
+        await asyncio_helper.delete_webhook(config.settings.bot_token)
+        while True:
+            for index, process in enumerate(processes):
+                if not process.is_alive():
+                    logger.error(f"Worker {index} exited with code {process.exitcode}, restarting")
+                    processes[index] = spawn(index)
+
+            try:
+                updates = await asyncio_helper.get_updates(
+                    config.settings.bot_token, offset=offset, timeout=config.settings.polling_timeout
+                )
+            except Exception as e:
+                logger.error(f"Failed to fetch updates: {e}")
+                await asyncio.sleep(3)
+                continue
+
+            # one lookup per batch, off the event loop
+            user_ids = list({user_id for user_id in map(update_user_id, updates) if user_id is not None})
+            active_rooms = await db.get_active_rooms(user_ids) if user_ids else {}
+            for raw in updates:
+                offset = raw['update_id'] + 1
+                key = routing_key(raw, active_rooms)
+                inboxes[shard_index(key, workers)].put((MSG_UPDATE, key, raw))
+    finally:
+        for inbox in inboxes:
+            inbox.put((MSG_STOP, 0, None))
+        for process in processes:
+            process.join(timeout=30)
+        events.put(None)
+        if asyncio_helper.session_manager.session is not None:
+            await AsyncTeleBot.close_session()
+        logger.info("Supervisor stopped")
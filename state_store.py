@@ -0,0 +1,152 @@
+import asyncio
+import json
+import logging
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Dict, Optional
+
+from database import db
+from utils.cache import LRUCache
+
+logger = logging.getLogger(__name__)
+
+class MemoryBackend:
+    def load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        return None
+
+    def save(self, user_id: int, record: Dict[str, Any]) -> None:
+        pass
+
+    def delete(self, user_id: int) -> None:
+        pass
+
+class SQLiteBackend:
+    def load(self, user_id: int) -> Optional[Dict[str, Any]]:
+        with db.get_db_connection() as conn:
+            row = conn.execute(
+                "SELECT state, active_room, temp_data FROM user_states WHERE user_id = ?",
+                (user_id,)
+            ).fetchone()
+
+        if row is None:
+            return None
+        return {
+            'state': row['state'],
+            'active_room': row['active_room'],
+            'temp': json.loads(row['temp_data']) if row['temp_data'] else {}
+        }
+
+    def save(self, user_id: int, record: Dict[str, Any]) -> None:
+        with db.get_db_connection() as conn:
+            conn.execute("""
+                INSERT INTO user_states (user_id, state, active_room, temp_data, updated_at)
+                VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    state = excluded.state,
+                    active_room = excluded.active_room,
+                    temp_data = excluded.temp_data,
+                    updated_at = excluded.updated_at
+            """, (user_id, record['state'], record['active_room'], json.dumps(record['temp'], ensure_ascii=False)))
+            conn.commit()
+
+    def delete(self, user_id: int) -> None:
+        with db.get_db_connection() as conn:
+            conn.execute("DELETE FROM user_states WHERE user_id = ?", (user_id,))
+            conn.commit()
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'sqlite': SQLiteBackend
+}
+
+class StateStore:
+    def __init__(self, backend, default_state: str, maxsize: int = 10000, ttl: Optional[float] = None):
+        self.backend = backend
+        self.default_state = default_state
+        self.listeners = []
+        self._cache = LRUCache(maxsize, ttl)
+        self._writes = ThreadPoolExecutor(max_workers=1, thread_name_prefix="state")
+        self._last_write: Optional[Future] = None
+        self._load_in_db_thread = db.run_in_db_thread(self._load)
+
+    def _empty_record(self) -> Dict[str, Any]:
+        return {'state': self.default_state, 'active_room': None, 'temp': {}}
+
+    def _load(self, user_id: int) -> Dict[str, Any]:
+        try:
+            record = self.backend.load(user_id)
+        except Exception as e:
+            logger.error(f"Failed to load state for user {user_id}: {e}")
+            record = None
+        return record or self._empty_record()
+
+    def get(self, user_id: int) -> Dict[str, Any]:
+        record = self._cache.get(user_id)
+        if record is None:
+            record = self._load(user_id)
+            self._cache.set(user_id, record)
+        return record
+
+    async def load(self, user_id: int) -> Dict[str, Any]:
+        record = self._cache.get(user_id)
+        if record is not None:
+            return record
+
+        generation = self._cache.version(user_id)
+        record = await self._load_in_db_thread(user_id)
+        # an update made while the load was in flight is newer than what was read
+        cached = self._cache.get(user_id)
+        if cached is not None:
+            return cached
+        self._cache.set(user_id, record, generation)
+        return record
+
+    def update(self, user_id: int, **changes: Any) -> Dict[str, Any]:
+        record = self.get(user_id)
+        record.update(changes)
+        self._cache.set(user_id, record)
+        self._persist(user_id, record)
+        return record
+
+    def invalidate(self, user_id: int) -> None:
+        self._cache.invalidate(user_id)
+
+    def clear_active_room(self, room_id: int, user_ids) -> None:
+        # the backend rows were cleared together with the room, only cached records still point at it
+        for user_id in user_ids:
+            record = self._cache.get(user_id)
+            if record is None:
+                self._cache.invalidate(user_id)
+            elif record['active_room'] == room_id:
+                self._cache.set(user_id, dict(record, active_room=None))
+
+            for listener in self.listeners:
+                listener(user_id)
+
+    def _persist(self, user_id: int, record: Dict[str, Any]) -> None:
+        if record == self._empty_record():
+            operation, args = self.backend.delete, (user_id,)
+        else:
+            operation, args = self.backend.save, (user_id, dict(record, temp=dict(record['temp'])))
+
+        self._last_write = self._writes.submit(self._write, user_id, operation, *args)
+
+    async def wait_for_writes(self) -> None:
+        # the writer is a single thread, so the last submitted write finishes after all the earlier ones
+        if self._last_write is not None:
+            await asyncio.wrap_future(self._last_write)
+
+    def _write(self, user_id: int, operation, *args) -> None:
+        try:
+            operation(*args)
+        except Exception as e:
+            logger.error(f"Failed to persist user state: {e}", exc_info=True)
+            return
+
+        for listener in self.listeners:
+            listener(user_id)
+
+    def stats(self) -> Dict[str, Any]:
+        return self._cache.stats()
+
+    def close(self) -> None:
+        self._writes.shutdown(wait=True)
@@ -0,0 +1,103 @@
+import base64
+import random
+
+import pytest
+
+from utils.callback_codec import (
+    LEGACY_ACTIONS, LEGACY_PREFIXES, MAX_LENGTH, PREFIX, VERSION, Action, CallbackDataError, decode, encode
+)
+
+def packed(*values: int) -> str:
+    return PREFIX + base64.urlsafe_b64encode(bytes(values)).rstrip(b"=").decode('ascii')
+
+def test_round_trip_random_actions_and_args():
+    rng = random.Random(20261018)
+    for _ in range(5000):
+        action = rng.randint(1, 255)
+        bits = rng.choice((6, 13, 31, 52))
+        args = tuple(rng.randint(-2 ** bits, 2 ** bits) for _ in range(rng.randint(0, 4)))
+
+        data = encode(action, *args)
+        assert data.startswith(PREFIX)
+        assert len(data.encode('utf-8')) <= MAX_LENGTH
+        assert decode(data) == (action, args)
+
+@pytest.mark.parametrize('value', [0, 1, -1, 63, -64, 64, -65, 127, 128, 2 ** 31 - 1, -2 ** 31, 2 ** 63, -2 ** 63])
+def test_round_trip_varint_boundaries(value):
+    assert decode(encode(Action.ROOM_INFO, value)) == (Action.ROOM_INFO, (value,))
+
+def test_round_trip_every_action():
+    actions = [value for name, value in vars(Action).items() if not name.startswith('_')]
+    assert len(actions) == len(set(actions))
+    for action in actions:
+        assert decode(encode(action, 42)) == (action, (42,))
+
+@pytest.mark.parametrize('action', [0, -1, 256])
+def test_action_must_fit_one_byte(action):
+    with pytest.raises(CallbackDataError):
+        encode(action)
+
+def test_length_limit():
+    # one prefix character plus 63 base64 characters carry the version, the action and 45 one-byte varints
+    assert len(encode(Action.SEARCH_PAGE, *[0] * 45)) == MAX_LENGTH
+    with pytest.raises(CallbackDataError):
+        encode(Action.SEARCH_PAGE, *[0] * 46)
+    with pytest.raises(CallbackDataError):
+        encode(Action.SEARCH_PAGE, *[2 ** 63] * 5)
+
+def test_search_page_cursor_fits():
+    data = encode(Action.SEARCH_PAGE, 2 ** 31, 2 ** 40, 10 ** 6)
+    assert len(data) <= MAX_LENGTH
+
+@pytest.mark.parametrize('data', [
+    PREFIX,
+    PREFIX + "A",
+    PREFIX + "!!!",
+    PREFIX + "AQ",
+    packed(VERSION),
+])
+def test_truncated_or_malformed_payload(data):
+    with pytest.raises(CallbackDataError):
+        decode(data)
+
+def test_payload_ending_inside_integer():
+    with pytest.raises(CallbackDataError, match="inside an integer"):
+        decode(packed(VERSION, Action.ROOM_INFO, 0x80))
+
+    data = encode(Action.ROOM_INFO, 2 ** 20)
+    raw = base64.urlsafe_b64decode(data[1:] + "=" * (-len(data[1:]) % 4))
+    with pytest.raises(CallbackDataError):
+        decode(packed(*raw[:-1]))
+
+def test_unsupported_version():
+    with pytest.raises(CallbackDataError, match="version"):
+        decode(packed(VERSION + 1, Action.MAIN_MENU))
+
+def test_random_garbage_never_raises_anything_else():
+    rng = random.Random(7)
+    alphabet = "ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789-_=~!"
+    for _ in range(2000):
+        data = PREFIX + "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 63)))
+        try:
+            action, args = decode(data)
+        except CallbackDataError:
+            continue
+        assert isinstance(action, int)
+        assert all(isinstance(arg, int) for arg in args)
+
+@pytest.mark.parametrize('data, action', list(LEGACY_ACTIONS.items()))
+def test_legacy_actions(data, action):
+    assert decode(data) == (action, ())
+
+@pytest.mark.parametrize('prefix, action', list(LEGACY_PREFIXES.items()))
+def test_legacy_prefixes(prefix, action):
+    assert decode(f"{prefix}17") == (action, (17,))
+
+def test_legacy_prefixes_do_not_shadow_each_other():
+    assert decode("admin_enter_room_5") == (Action.ADMIN_ENTER_ROOM, (5,))
+    assert decode("enter_room_5") == (Action.ENTER_ROOM, (5,))
+
+@pytest.mark.parametrize('data', ["", "unknown", "enter_room_", "enter_room_x", "room_info_1.5", "admin_enter_room"])
+def test_unknown_legacy_data(data):
+    with pytest.raises(CallbackDataError):
+        decode(data)
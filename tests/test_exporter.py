@@ -0,0 +1,114 @@
+import csv
+import gzip
+import html
+import io
+import json
+import re
+import sqlite3
+
+import pytest
+
+from database import exporter, migrations
+
+# message_id, room_id, user_id, text, sent_at; ids are not in send order on purpose
+MESSAGES = [
+    (1, 1, 10, "привет", "2024-01-01 10:00:02"),
+    (2, 1, 20, "second, with \"quotes\"", "2024-01-01 10:00:01"),
+    (3, 2, 10, "other room", "2024-01-01 10:00:00"),
+    (4, 1, 30, "<b>not a member</b>", "2024-01-01 10:00:02"),
+    (5, 1, 99, "line\nbreak", "2024-01-01 10:00:03"),
+    (6, 1, 10, "", "2024-01-01 10:00:00"),
+]
+
+EXPECTED = [
+    [6, "2024-01-01 10:00:00", 10, "alice", "client", ""],
+    [2, "2024-01-01 10:00:01", 20, "bob", "coder", "second, with \"quotes\""],
+    [1, "2024-01-01 10:00:02", 10, "alice", "client", "привет"],
+    [4, "2024-01-01 10:00:02", 30, "carol", None, "<b>not a member</b>"],
+    [5, "2024-01-01 10:00:03", 99, None, None, "line\nbreak"],
+]
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    migrations.migrate(conn)
+    conn.executemany("INSERT INTO users (user_id, username, role) VALUES (?, ?, ?)",
+                     [(10, "alice", "client"), (20, "bob", "coder"), (30, "carol", "client")])
+    conn.executemany("INSERT INTO rooms (room_id, name) VALUES (?, ?)", [(1, "Room A"), (2, "Room B")])
+    conn.executemany("INSERT INTO room_members (room_id, user_id, role) VALUES (?, ?, ?)",
+                     [(1, 10, "client"), (1, 20, "coder"), (2, 30, "client")])
+    conn.executemany("INSERT INTO messages (message_id, room_id, user_id, text, sent_at) VALUES (?, ?, ?, ?, ?)",
+                     MESSAGES)
+    conn.commit()
+    yield conn
+    conn.close()
+
+def export_text(conn: sqlite3.Connection, fmt: str, compress: bool, **kwargs) -> str:
+    with exporter.write_room_history(conn, 1, fmt, compress, **kwargs) as spool:
+        data = spool.read()
+    if compress:
+        data = gzip.decompress(data)
+    return data.decode('utf-8')
+
+def parse_csv(text: str):
+    header, *rows = csv.reader(io.StringIO(text))
+    assert header == exporter.COLUMNS
+    return [[int(row[0]), row[1], int(row[2]), row[3] or None, row[4] or None, row[5]] for row in rows]
+
+def parse_jsonl(text: str):
+    records = [json.loads(line) for line in text.splitlines()]
+    assert all(list(record) == exporter.COLUMNS for record in records)
+    return [[record[column] for column in exporter.COLUMNS] for record in records]
+
+def parse_html(text: str):
+    assert text.startswith("<!DOCTYPE html>") and text.endswith("</html>\n")
+    assert "<title>Room 1</title>" in text
+    header = re.findall(r"<th>(.*?)</th>", text)
+    assert header == exporter.COLUMNS
+    rows = []
+    for row in re.findall(r"<tr>(<td>.*?)</tr>", text, re.S):
+        cells = [html.unescape(cell) for cell in re.findall(r"<td>(.*?)</td>", row, re.S)]
+        rows.append([int(cells[0]), cells[1], int(cells[2]), cells[3] or None, cells[4] or None, cells[5]])
+    return rows
+
+PARSERS = {'csv': parse_csv, 'jsonl': parse_jsonl, 'html': parse_html}
+
+@pytest.mark.parametrize('compress', [False, True])
+@pytest.mark.parametrize('fmt', sorted(exporter.FORMATS))
+def test_export_rows(conn, fmt, compress):
+    assert PARSERS[fmt](export_text(conn, fmt, compress)) == EXPECTED
+
+@pytest.mark.parametrize('fmt', sorted(exporter.FORMATS))
+def test_export_is_chunk_size_independent(conn, fmt):
+    assert export_text(conn, fmt, False, chunk_size=1) == export_text(conn, fmt, False, chunk_size=1000)
+
+def test_html_escapes_text(conn):
+    text = export_text(conn, 'html', False)
+    assert "<b>not a member</b>" not in text
+    assert "&lt;b&gt;not a member&lt;/b&gt;" in text
+
+def test_compressed_export_is_gzip(conn):
+    with exporter.write_room_history(conn, 1, 'csv', True) as spool:
+        assert spool.read(2) == b"\x1f\x8b"
+
+def test_spools_to_disk_past_limit(conn):
+    with exporter.write_room_history(conn, 1, 'jsonl', False, spool_max_size=16) as spool:
+        assert spool._rolled
+        assert parse_jsonl(spool.read().decode('utf-8')) == EXPECTED
+
+def test_empty_room(conn):
+    with exporter.write_room_history(conn, 3, 'jsonl', False) as spool:
+        assert spool.read() == b""
+
+def test_unknown_format(conn):
+    with pytest.raises(ValueError):
+        exporter.write_room_history(conn, 1, 'xml')
+
+@pytest.mark.parametrize('fmt, compress, name', [
+    ('csv', False, "room_1_history.csv"),
+    ('jsonl', True, "room_1_history.jsonl.gz"),
+    ('html', False, "room_1_history.html"),
+])
+def test_export_filename(fmt, compress, name):
+    assert exporter.export_filename(1, fmt, compress) == name
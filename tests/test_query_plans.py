@@ -0,0 +1,77 @@
+import dataclasses
+import sqlite3
+
+import pytest
+
+import config
+from database import db, exporter, migrations
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    migrations.migrate(conn)
+
+    conn.executemany("INSERT INTO users (user_id, username, role) VALUES (?, ?, ?)",
+                     [(user_id, f"user{user_id}", 'client') for user_id in range(1, 201)])
+    conn.executemany("INSERT INTO rooms (room_id, name) VALUES (?, ?)",
+                     [(room_id, f"room {room_id}") for room_id in range(1, 51)])
+    conn.executemany("INSERT INTO room_members (room_id, user_id, role) VALUES (?, ?, ?)",
+                     [(room_id, user_id, 'client') for room_id in range(1, 51) for user_id in range(room_id, room_id + 4)])
+    conn.executemany("INSERT INTO messages (room_id, user_id, text) VALUES (?, ?, ?)",
+                     [(number % 50 + 1, number % 200 + 1, f"message {number}") for number in range(5000)])
+    conn.commit()
+    conn.execute("PRAGMA optimize")
+    yield conn
+    conn.close()
+
+def plan(conn: sqlite3.Connection, sql: str, params=()) -> str:
+    return "\n".join(row['detail'] for row in conn.execute(f"EXPLAIN QUERY PLAN {sql}", params))
+
+def test_rooms_of_user_use_membership_index(conn):
+    for sql, params in ((db.USER_ROOMS_AFTER_SQL, (7, 0, 10)), (db.USER_ROOMS_BEFORE_SQL, (7, 50, 10))):
+        detail = plan(conn, sql, params)
+        assert "USING COVERING INDEX idx_room_members_user" in detail
+        assert "TEMP B-TREE" not in detail
+
+def test_members_of_room_use_room_index(conn):
+    detail = plan(conn, db.ROOM_ROLES_SQL, (3,))
+    assert "USING COVERING INDEX idx_room_members_room" in detail
+
+def test_membership_check_uses_index(conn):
+    detail = plan(conn, db.MEMBERSHIP_SQL, (7, 3))
+    assert "SCAN" not in detail
+
+def test_history_page_uses_keyset_index(conn):
+    detail = plan(conn, db.ROOM_HISTORY_SQL, (3, 1000, 10))
+    assert "SEARCH m USING INDEX idx_messages_room_id (room_id=? AND" in detail
+    assert "TEMP B-TREE" not in detail
+
+def test_export_reads_room_by_send_time(conn):
+    detail = plan(conn, exporter.HISTORY_SQL, (3,))
+    assert "SEARCH m USING INDEX idx_messages_room_sent (room_id=?)" in detail
+    assert "SCAN" not in detail
+
+def test_due_outbox_uses_schedule_index(conn):
+    detail = plan(conn, db.DUE_DELIVERIES_SQL, (0, 10))
+    assert "idx_outbox_due" in detail
+    assert "TEMP B-TREE" not in detail
+
+def test_init_db_refreshes_statistics_after_migrating(tmp_path, monkeypatch):
+    statements = []
+    migrate = migrations.migrate
+
+    def traced_migrate(conn):
+        conn.set_trace_callback(statements.append)
+        return migrate(conn)
+
+    monkeypatch.setattr(config, 'settings', dataclasses.replace(config.settings, db_path=str(tmp_path / "bot.db")))
+    monkeypatch.setattr(migrations, 'migrate', traced_migrate)
+    monkeypatch.setattr(db, '_pool', None)
+    db.init_db()
+    db._pool.close()
+
+    optimize = [index for index, statement in enumerate(statements) if statement.startswith("PRAGMA optimize")]
+    assert optimize
+    assert not any(statement.upper().startswith("ANALYZE") for statement in statements)
+    assert any("INSERT INTO schema_version" in statement for statement in statements[:optimize[0]])
@@ -0,0 +1,138 @@
+import sqlite3
+
+import pytest
+
+from database import migrations, search
+
+FTS_VERSION = 5
+
+def migrate_to(conn: sqlite3.Connection, version: int, monkeypatch) -> None:
+    with monkeypatch.context() as patch:
+        patch.setattr(migrations, 'MIGRATIONS', [m for m in migrations.MIGRATIONS if m[0] <= version])
+        migrations.migrate(conn)
+
+def add_messages(conn: sqlite3.Connection, messages) -> None:
+    conn.executemany("INSERT INTO messages (message_id, room_id, user_id, text) VALUES (?, ?, 10, ?)", messages)
+    conn.commit()
+
+def found(conn: sqlite3.Connection, query: str, room_id: int = 1, **kwargs):
+    return [message['message_id'] for message in search.search_messages(conn, room_id, query, **kwargs)['messages']]
+
+def pending(conn: sqlite3.Connection) -> int:
+    return conn.execute("SELECT pending_max_id FROM search_backfill").fetchone()[0]
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    migrations.migrate(conn)
+    conn.execute("INSERT INTO users (user_id, username, role) VALUES (10, 'alice', 'client')")
+    conn.executemany("INSERT INTO rooms (room_id, name) VALUES (?, ?)", [(1, "Room A"), (2, "Room B")])
+    conn.commit()
+    yield conn
+    conn.close()
+
+@pytest.fixture
+def upgraded(monkeypatch):
+    # messages written before the index existed, ids 1-6 are left to the backfill
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    migrate_to(conn, FTS_VERSION - 1, monkeypatch)
+    add_messages(conn, [(number, 1, f"deploy old {number}") for number in range(1, 7)])
+    migrations.migrate(conn)
+    yield conn
+    conn.close()
+
+def test_upgrade_leaves_existing_messages_to_backfill(upgraded):
+    assert pending(upgraded) == 6
+    assert found(upgraded, "deploy") == []
+
+    add_messages(upgraded, [(7, 1, "deploy new")])
+    assert found(upgraded, "deploy") == [7]
+
+    assert search.backfill(upgraded, 4) == 4
+    assert pending(upgraded) == 2
+    assert sorted(found(upgraded, "deploy")) == [3, 4, 5, 6, 7]
+
+    assert search.backfill(upgraded, 4) == 2
+    assert search.backfill(upgraded, 4) == 0
+    assert pending(upgraded) == 0
+    assert sorted(found(upgraded, "deploy")) == [1, 2, 3, 4, 5, 6, 7]
+
+def test_changes_below_pending_are_picked_up_by_backfill(upgraded):
+    upgraded.execute("DELETE FROM messages WHERE message_id = 2")
+    upgraded.execute("UPDATE messages SET text = 'rollback old 3' WHERE message_id = 3")
+    upgraded.commit()
+
+    while search.backfill(upgraded, 4):
+        pass
+
+    assert sorted(found(upgraded, "deploy")) == [1, 4, 5, 6]
+    assert found(upgraded, "rollback") == [3]
+
+def test_changes_above_pending_go_through_triggers(upgraded):
+    add_messages(upgraded, [(7, 1, "deploy new 7"), (8, 1, "deploy new 8")])
+    upgraded.execute("DELETE FROM messages WHERE message_id = 7")
+    upgraded.execute("UPDATE messages SET text = 'rollback new 8' WHERE message_id = 8")
+    upgraded.commit()
+
+    assert found(upgraded, "deploy") == []
+    assert found(upgraded, "rollback") == [8]
+
+def test_changes_after_backfill_update_the_index(upgraded):
+    # a half finished backfill: ids 3-6 are indexed, 1-2 are still pending
+    search.backfill(upgraded, 4)
+    upgraded.execute("DELETE FROM messages WHERE message_id = 5")
+    upgraded.execute("UPDATE messages SET text = 'rollback old 6' WHERE message_id = 6")
+    upgraded.commit()
+    while search.backfill(upgraded, 4):
+        pass
+
+    upgraded.execute("DELETE FROM messages WHERE message_id = 1")
+    upgraded.execute("UPDATE messages SET text = 'rollback old 2' WHERE message_id = 2")
+    upgraded.commit()
+
+    assert sorted(found(upgraded, "deploy")) == [3, 4]
+    assert sorted(found(upgraded, "rollback")) == [2, 6]
+
+def test_search_stays_inside_the_room(conn):
+    add_messages(conn, [(1, 1, "hello from a"), (2, 2, "hello from b"), (3, 2, "r1 hello room token in text")])
+
+    assert found(conn, "hello", room_id=1) == [1]
+    assert sorted(found(conn, "hello", room_id=2)) == [2, 3]
+    assert found(conn, "r1", room_id=1) == []
+
+@pytest.mark.parametrize("query, expected", [
+    ('deploy OR rollback', [2]),
+    ('"deploy', [1, 2]),
+    ('deploy*', [1, 2]),
+    ('NEAR(deploy rollback)', []),
+    ('deploy -rollback', [2]),
+    ('room : deploy', []),
+    ('"* OR', [2]),
+    ('"', []),
+])
+def test_query_syntax_is_matched_as_plain_words(conn, query, expected):
+    add_messages(conn, [(1, 1, "deploy failed"), (2, 1, "deploy or rollback")])
+
+    assert sorted(found(conn, query)) == expected
+
+def test_diacritics_are_folded(conn):
+    add_messages(conn, [(1, 1, "Café опять упало")])
+
+    assert found(conn, "cafe") == [1]
+    assert found(conn, "CAFÉ") == [1]
+
+def test_cursor_pages_ignore_later_inserts(conn):
+    add_messages(conn, [(number, 1, f"deploy {number}") for number in range(1, 6)])
+
+    first = search.search_messages(conn, 1, "deploy", limit=2)
+    add_messages(conn, [(6, 1, "deploy 6"), (7, 1, "deploy deploy 7")])
+    second = search.search_messages(conn, 1, "deploy", limit=2, cursor=first['cursor'])
+    third = search.search_messages(conn, 1, "deploy", limit=2, cursor=second['cursor'])
+
+    pages = [first, second, third]
+    ids = [message['message_id'] for page in pages for message in page['messages']]
+    assert sorted(ids) == [1, 2, 3, 4, 5]
+    assert third['cursor'] is None
+    assert found(conn, "deploy", limit=10)[0] == 7
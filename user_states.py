@@ -1,44 +1,58 @@
 from typing import Dict, Any
 
+import config
+from states.state_store import BACKENDS, StateStore
+from utils import metrics
+
 class AdminState:
     IDLE = 'idle'
     WAITING_FOR_ROOM_NAME = 'waiting_for_room_name'
     WAITING_FOR_CLIENT_ID = 'waiting_for_client_id'
     WAITING_FOR_CODER_ID = 'waiting_for_coder_id'
+    WAITING_FOR_SEARCH_QUERY = 'waiting_for_search_query'
+
+store = StateStore(
+    BACKENDS[config.settings.state_backend](),
+    default_state=AdminState.IDLE,
+    maxsize=config.settings.state_cache_size,
+    ttl=config.settings.state_cache_ttl
+)
+metrics.track_cache('user_states', store.stats)
 
-user_states = {}
-temp_room_data = {}
-active_rooms = {}
+async def load_user_state(user_id: int) -> None:
+    await store.load(user_id)
 
 def get_user_state(user_id: int) -> str:
-    return user_states.get(user_id, AdminState.IDLE)
+    return store.get(user_id)['state']
 
 def set_user_state(user_id: int, state: str) -> None:
-    user_states[user_id] = state
+    store.update(user_id, state=state)
 
 def get_temp_room_data(user_id: int) -> Dict[str, Any]:
-    if user_id not in temp_room_data:
-        temp_room_data[user_id] = {}
-    return temp_room_data[user_id]
+    return store.get(user_id)['temp']
 
 def set_temp_room_data(user_id: int, key: str, value: Any) -> None:
-    if user_id not in temp_room_data:
-        temp_room_data[user_id] = {}
-    temp_room_data[user_id][key] = value
+    temp = dict(store.get(user_id)['temp'])
+    temp[key] = value
+    store.update(user_id, temp=temp)
 
 def clear_temp_room_data(user_id: int) -> None:
-    if user_id in temp_room_data:
-        del temp_room_data[user_id]
+    store.update(user_id, temp={})
 
 def set_active_room(user_id: int, room_id: int) -> None:
-    active_rooms[user_id] = room_id
+    store.update(user_id, active_room=room_id)
 
 def get_active_room(user_id: int) -> int:
-    return active_rooms.get(user_id)
+    return store.get(user_id)['active_room']
 
 def clear_active_room(user_id: int) -> None:
-    if user_id in active_rooms:
-        del active_rooms[user_id]
+    store.update(user_id, active_room=None)
+
+def clear_deleted_room(room_id: int, user_ids) -> None:
+    store.clear_active_room(room_id, user_ids)
 
 def is_user_in_active_room(user_id: int) -> bool:
-    return user_id in active_rooms
+    return store.get(user_id)['active_room'] is not None
+
+def close() -> None:
+    store.close()
@@ -0,0 +1,189 @@
+import argparse
+import asyncio
+import hmac
+import json
+import logging
+import secrets
+import time
+from typing import Dict, List, Optional
+
+from aiohttp import ClientSession, web
+from telebot.async_telebot import AsyncTeleBot
+from telebot.types import Update
+
+import config
+from utils import metrics
+from utils.keyed import KeyedRunner
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+def update_routing_key(update: Update) -> int:
+    for event in (update.message, update.edited_message, update.callback_query):
+        if event is not None and event.from_user is not None:
+            return event.from_user.id
+    return update.update_id
+
+class WebhookServer:
+    def __init__(self, bot: AsyncTeleBot, path: str, secret_token: str, queue_size: int = 1000):
+        if not secret_token:
+            raise ValueError("Webhook server requires a secret token")
+
+        self.bot = bot
+        self.path = path
+        self.secret_token = secret_token
+        self.queue_size = queue_size
+
+        self._updates: Optional[KeyedRunner] = None
+        self._runner: Optional[web.AppRunner] = None
+
+        self.received = 0
+        self.rejected = 0
+        self.processed = 0
+
+    def queue_depth(self) -> int:
+        return self._updates.pending if self._updates else 0
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        if not hmac.compare_digest(
+            request.headers.get(SECRET_HEADER, ""), self.secret_token
+        ):
+            logger.warning(f"Rejected webhook request with invalid secret from {request.remote}")
+            return web.Response(status=403)
+
+        try:
+            payload = await request.json()
+            update = Update.de_json(payload)
+        except (ValueError, KeyError, TypeError):
+            return web.Response(status=400)
+
+        if not self._updates.submit(update_routing_key(update), update):
+            self.rejected += 1
+            return web.Response(status=503)
+
+        self.received += 1
+        return web.Response()
+
+    async def _process(self, update: Update):
+        try:
+            await self.bot.process_new_updates([update])
+        except Exception as e:
+            logger.error(f"Error processing update {update.update_id}: {e}", exc_info=True)
+        finally:
+            self.processed += 1
+
+    def make_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        return app
+
+    async def start(self, host: str, port: int) -> int:
+        # updates of different users run concurrently like in polling mode, one user's updates stay in order
+        self._updates = KeyedRunner(self._process, max_pending=self.queue_size)
+        metrics.track_queue('webhook', self.queue_depth)
+
+        self._runner = web.AppRunner(self.make_app(), access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, host, port).start()
+        port = self._runner.addresses[0][1]
+        logger.info(f"Webhook server listening on {host}:{port}{self.path}")
+        return port
+
+    async def stop(self, drain_timeout: float = 10):
+        if self._runner is not None:
+            await self._runner.cleanup()
+
+        if self._updates is None:
+            return
+        try:
+            await asyncio.wait_for(self._updates.join(), drain_timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Dropping {self.queue_depth()} queued updates on shutdown")
+        await self._updates.close()
+
+async def run_webhook(bot: AsyncTeleBot):
+    secret_token = config.settings.webhook_secret
+    if not secret_token:
+        if not config.settings.webhook_url:
+            raise RuntimeError("webhook_secret must be set when the webhook is registered outside the bot")
+        secret_token = secrets.token_urlsafe(32)
+        logger.warning("webhook_secret is not set, using a random secret for this run")
+
+    server = WebhookServer(
+        bot,
+        config.settings.webhook_path,
+        secret_token=secret_token,
+        queue_size=config.settings.webhook_queue_size
+    )
+    await server.start(config.settings.webhook_host, config.settings.webhook_port)
+
+    try:
+        if config.settings.webhook_url:
+            await bot.set_webhook(
+                url=config.settings.webhook_url + config.settings.webhook_path,
+                secret_token=secret_token,
+                max_connections=config.settings.webhook_workers
+            )
+        await asyncio.Event().wait()
+    finally:
+        await server.stop()
+
+def fake_text_update(update_id: int, user_id: int, text: str) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f"user_{user_id}"},
+            'text': text
+        }
+    }
+
+class UpdatePoster:
+    def __init__(self, session: ClientSession, url: str, secret_token: str, concurrency: int):
+        self.session = session
+        self.url = url
+        self.secret_token = secret_token
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.latencies: List[float] = []
+        self.statuses: Dict[int, int] = {}
+
+    async def post(self, update: dict) -> int:
+        payload = json.dumps(update)
+        async with self.semaphore:
+            started = time.perf_counter()
+            async with self.session.post(self.url, data=payload, headers={
+                SECRET_HEADER: self.secret_token,
+                'Content-Type': 'application/json'
+            }) as response:
+                await response.read()
+            self.latencies.append(time.perf_counter() - started)
+            self.statuses[response.status] = self.statuses.get(response.status, 0) + 1
+        return response.status
+
+async def post_fake_updates(url: str, secret_token: str, count: int, users: int, concurrency: int):
+    async with ClientSession() as session:
+        poster = UpdatePoster(session, url, secret_token, concurrency)
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            poster.post(fake_text_update(update_id, 1000 + update_id % users, f"message {update_id}"))
+            for update_id in range(1, count + 1)
+        ))
+        elapsed = time.perf_counter() - started
+
+    latencies, statuses = sorted(poster.latencies), poster.statuses
+    print(f"posted {count} updates in {elapsed:.2f}s ({count / elapsed:.0f} updates/s), statuses {statuses}")
+    print(f"p50 {latencies[len(latencies) // 2] * 1000:.1f} ms, p99 {latencies[int(len(latencies) * 0.99)] * 1000:.1f} ms")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Post fake Telegram updates to a local webhook")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{config.settings.webhook_port}{config.settings.webhook_path}")
+    parser.add_argument("--secret", default=config.settings.webhook_secret)
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    asyncio.run(post_fake_updates(args.url, args.secret, args.count, args.users, args.concurrency))
@@ -0,0 +1,93 @@
+import asyncio
+import logging
+from typing import Awaitable, Callable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DURABILITY_SYNC = 'sync'
+DURABILITY_GROUP = 'group'
+DURABILITY_ASYNC = 'async'
+
+class WriteBehindBuffer:
+    def __init__(self, write_rows: Callable[[List[Tuple]], Awaitable], flush_interval_ms: int = 50,
+                 flush_rows: int = 500, durability: str = DURABILITY_GROUP):
+        if durability not in (DURABILITY_SYNC, DURABILITY_GROUP, DURABILITY_ASYNC):
+            raise ValueError(f"Unknown durability mode: {durability}")
+
+        self.write_rows = write_rows
+        self.flush_interval = flush_interval_ms / 1000
+        self.flush_rows = flush_rows
+        self.durability = durability
+
+        self._rows: List[Tuple] = []
+        self._waiters: List[asyncio.Future] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock = None
+        self._tasks = set()
+
+        self.flushes = 0
+        self.rows_written = 0
+        self.failed_rows = 0
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    async def add(self, row: Tuple) -> None:
+        if self.durability == DURABILITY_SYNC:
+            await self.write_rows([row])
+            self.rows_written += 1
+            return
+
+        self._rows.append(row)
+        waiter = None
+        if self.durability == DURABILITY_GROUP:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+
+        if len(self._rows) >= self.flush_rows:
+            self._spawn_flush()
+        elif self._timer is None:
+            self._timer = asyncio.get_running_loop().call_later(self.flush_interval, self._spawn_flush)
+
+        if waiter is not None:
+            await waiter
+
+    def _spawn_flush(self) -> None:
+        task = asyncio.create_task(self.flush())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        async with self._lock:
+            rows, self._rows = self._rows, []
+            waiters, self._waiters = self._waiters, []
+            if not rows:
+                return
+
+            try:
+                await self.write_rows(rows)
+            except Exception as e:
+                self.failed_rows += len(rows)
+                logger.error(f"Failed to flush {len(rows)} buffered rows: {e}", exc_info=True)
+                for waiter in waiters:
+                    if not waiter.done():
+                        waiter.set_exception(e)
+                return
+
+            self.flushes += 1
+            self.rows_written += len(rows)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    async def close(self) -> None:
+        await self.flush()
+        if self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)